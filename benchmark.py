@@ -0,0 +1,490 @@
+"""性能基准脚本。
+
+用法：
+    python benchmark.py blend [--size 6000x4000] [--repeat 5]
+    python benchmark.py tile [--size 9000x6700] [--repeat 3]
+    python benchmark.py pipeline [--count 16] [--size 3000x2000] [--workers 4]
+    python benchmark.py gui [--count 20] [--size 3000x2000] [--repeat 30] [--wysiwyg]
+    python benchmark.py png [--size 6000x4000] [--repeat 3] [--level 6]
+    python benchmark.py profiles [--count 8] [--size 6000x4000] [--long-edge 2048] [--format JPEG]
+    python benchmark.py large [--size 14000x13000]
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageChops, ImageEnhance
+
+# 确保能导入同目录下的 watermark.py
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import watermark  # noqa: E402
+
+
+def parse_size(s):
+    w, h = s.lower().split('x')
+    return int(w), int(h)
+
+
+def timeit(fn, repeat):
+    """运行 repeat 次，返回最好的一次耗时（毫秒）和最后一次的结果。"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        dt = (time.perf_counter() - t0) * 1000
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def make_base(size, mode):
+    # 渐变底图，避免全同色像素让结果失去代表性
+    grad = Image.linear_gradient('L').resize(size)
+    if mode == 'RGB':
+        return Image.merge('RGB', (grad, grad.transpose(Image.FLIP_LEFT_RIGHT), grad))
+    return Image.merge('RGBA', (grad, grad.transpose(Image.FLIP_LEFT_RIGHT), grad, Image.new('L', size, 255)))
+
+
+def make_sprite(size):
+    sprite = Image.new('RGBA', size, (255, 255, 255, 0))
+    inner = Image.new('RGBA', (size[0] // 2, size[1] // 2), (255, 0, 0, 200))
+    sprite.paste(inner, (size[0] // 4, size[1] // 4))
+    return sprite
+
+
+def max_diff(a, b, xy, size):
+    """两张图在水印区域内逐通道的最大差值。"""
+    box = (xy[0], xy[1], xy[0] + size[0], xy[1] + size[1])
+    d = ImageChops.difference(a.crop(box), b.crop(box))
+    return max(hi for _, hi in d.getextrema())
+
+
+def legacy_composite(base, sprite, xy, opacity):
+    """改造前的 Pillow 流程：Brightness 缩放 alpha -> 整图 overlay -> 整图 alpha_composite。"""
+    base = base.convert('RGBA')
+    overlay = Image.new('RGBA', base.size, (255, 255, 255, 0))
+    wim = sprite.copy()
+    if opacity < 1.0:
+        a = wim.split()[3]
+        a = ImageEnhance.Brightness(a).enhance(opacity)
+        wim.putalpha(a)
+    overlay.paste(wim, xy, wim)
+    return Image.alpha_composite(base, overlay)
+
+
+def bench_blend(args):
+    size = parse_size(args.size)
+    sprite = make_sprite((size[0] // 5, size[1] // 8))
+    xy = (size[0] // 3, size[1] // 2)
+    opacity = 0.8
+    print(f'底图 {size[0]}x{size[1]}，水印 {sprite.width}x{sprite.height}，重复 {args.repeat} 次取最优')
+    # 旧流程粘贴 overlay 时以自身为 mask，alpha 会被平方，因此误差以 region pillow 为基准
+    print(f'{"底图模式":<8}{"实现":<18}{"耗时(ms)":>10}{"最大误差":>10}')
+    bases = [(mode, make_base(size, mode)) for mode in ('RGB', 'RGBA')]
+    # 半透明底图：两条路径的 alpha 舍入与 over 运算不一致时在这里才会暴露
+    translucent = make_base(size, 'RGBA')
+    translucent.putalpha(Image.linear_gradient('L').rotate(90).resize(size))
+    bases.append(('RGBA~', translucent))
+    mismatched = []
+    for mode, base in bases:
+        ms, _ = timeit(lambda: legacy_composite(base, sprite, xy, opacity), args.repeat)
+        print(f'{mode:<10}{"legacy pillow":<20}{ms:>10.1f}{"-":>12}')
+        ref = None
+        for name, use_np in (('region pillow', False), ('region numpy', True)):
+            if use_np and watermark.get_numpy() is None:
+                print(f'{mode:<10}{name:<20}{"(未安装 numpy)":>10}')
+                continue
+            watermark.USE_NUMPY_BLEND = use_np
+            # blend_over 原地修改底图，副本在计时之外准备好，每次计时只合成一次
+            copies = [base.copy() for _ in range(args.repeat)]
+            ms, out = timeit(lambda: watermark.blend_over(copies.pop(), sprite, xy, opacity), args.repeat)
+            if ref is None:
+                ref = out
+            diff = max_diff(out, ref, xy, sprite.size)
+            print(f'{mode:<10}{name:<20}{ms:>10.1f}{diff:>12}')
+            if diff:
+                mismatched.append(mode)
+    watermark.USE_NUMPY_BLEND = False
+    if mismatched:
+        sys.exit(f'numpy 与 Pillow 合成结果不一致：{", ".join(mismatched)}')
+
+
+def bench_tile(args):
+    size = parse_size(args.size)
+    base = make_base(size, 'RGB')
+    settings = {
+        'type': '文本水印', 'text': '© PhotoWatermark 样张', 'font': '', 'font_size': 48,
+        'color': [255, 255, 255, 255], 'opacity': 50, 'shadow': True, 'stroke': False,
+        'rotate': 30, 'pos': watermark.TILE_PRESET, 'tile_gap': 60, 'tile_stagger': True,
+    }
+    sprite = watermark.render_text_sprite(settings)[0]
+    n = len(watermark.tile_centers(size[0], size[1], sprite.width, sprite.height, 30, 60, True))
+    print(f'底图 {size[0]}x{size[1]} ({size[0] * size[1] / 1e6:.0f} MP)，文字平铺 {n} 个，重复 {args.repeat} 次取最优')
+    ms, _ = timeit(lambda: watermark.render_watermark(base, settings), args.repeat)
+    print(f'{"文字平铺":<10}{ms:>10.1f} ms')
+    wm = Image.new('RGBA', (400, 160), (255, 255, 255, 0))
+    wm.paste(Image.new('RGBA', (300, 100), (255, 0, 0, 255)), (50, 30))
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_bench_wm.png')
+    wm.save(path)
+    try:
+        settings.update({'type': '图片水印', 'wm_image': path, 'img_scale': 5, 'img_opacity': 40,
+                         'img_rotate': 30, 'img_pos': watermark.TILE_PRESET, 'img_tile_gap': 60})
+        ms, _ = timeit(lambda: watermark.render_watermark(base, settings), args.repeat)
+        print(f'{"图片平铺":<10}{ms:>10.1f} ms')
+    finally:
+        os.remove(path)
+
+
+def bench_pipeline(args):
+    size = parse_size(args.size)
+    tmp = tempfile.mkdtemp(prefix='wm_bench_')
+    try:
+        paths = []
+        for i in range(args.count):
+            p = os.path.join(tmp, f'src_{i}.jpg')
+            Image.effect_noise(size, 40).convert('RGB').save(p, quality=90)
+            paths.append(p)
+        settings = {'type': '文本水印', 'text': '© PhotoWatermark', 'font_size': 80, 'pos': '右下'}
+        opts = {'out_folder': os.path.join(tmp, 'out'), 'format': 'JPEG', 'jpeg_quality': 90}
+        os.makedirs(opts['out_folder'])
+        print(f'{args.count} 张 {size[0]}x{size[1]}，{args.workers} 个 CPU 线程')
+        t0 = time.perf_counter()
+        reserver = watermark.OutputPathReserver(opts['out_folder'])
+        for p in paths:
+            watermark.export_one(p, settings, opts, reserver)
+        print(f'{"逐张导出":<10}{(time.perf_counter() - t0) * 1000:>10.1f} ms')
+        shutil.rmtree(opts['out_folder'])
+        plan = watermark.plan_export(paths, watermark.DEFAULT_MEMORY_BUDGET_MB * 2 ** 20, args.workers)
+        pipeline = watermark.ExportPipeline(settings, opts, plan.workers, plan.memory_budget)
+        pipeline.run(plan)
+        print(f'{"流水线":<10}{pipeline.wall * 1000:>10.1f} ms')
+        print(pipeline.stats_text())
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def png_roundtrip_failures():
+    """编码后重新打开，检查像素与元数据（透明色、ICC、gamma、sRGB、分辨率、文本）是否原样保留。
+    P 模式走 Pillow 回退路径。"""
+    text = {'Title': 'PhotoWatermark', 'Comment': '水印测试'}  # 后者需要 iTXt
+    cases = []
+    for mode, transparency in (('RGB', (255, 0, 0)), ('L', 7), ('RGBA', None), ('P', 3)):
+        im = make_base((96, 64), 'RGBA' if mode == 'RGBA' else 'RGB').convert(mode)
+        im.info.update(text, gamma=0.45455, dpi=(300, 300))
+        if mode == 'L':
+            im.info['srgb'] = 0
+        else:
+            im.info['icc_profile'] = b'fake icc profile'
+        if transparency is not None:
+            im.info['transparency'] = transparency
+        cases.append(im)
+    failures = []
+    for im in cases:
+        out = Image.open(io.BytesIO(watermark.encode_png(im)))
+        if out.mode != im.mode or out.tobytes() != im.tobytes():
+            failures.append(f'{im.mode} 像素不一致')
+        for key, want in im.info.items():
+            got = out.info.get(key)
+            if key in ('gamma', 'dpi'):
+                ok = got is not None and all(abs(a - b) < 0.01 for a, b in zip(*((got, want) if key == 'dpi' else
+                                                                                    ((got,), (want,)))))
+            else:
+                ok = got == want
+            if not ok:
+                failures.append(f'{im.mode} 的 {key}：写入 {want!r}，读回 {got!r}')
+    return failures
+
+
+def bench_png(args):
+    failures = png_roundtrip_failures()
+    if failures:
+        sys.exit('PNG 往返检查失败：\n' + '\n'.join(failures))
+    print('PNG 往返检查通过：像素、透明色、ICC、gamma、sRGB、分辨率与文本均保留')
+    size = parse_size(args.size)
+    base = make_base(size, 'RGBA')
+    # 叠加噪声，让压缩耗时接近真实照片
+    base = Image.merge('RGBA', [ImageChops.add(c, n) for c, n in
+                                zip(base.split(), Image.effect_noise(size, 20).convert('RGBA').split())])
+    print(f'RGBA {size[0]}x{size[1]}，压缩级别 {args.level}，{os.cpu_count()} 个 CPU，重复 {args.repeat} 次取最优')
+
+    def pillow():
+        buf = io.BytesIO()
+        base.save(buf, 'PNG', compress_level=args.level)
+        return buf.getvalue()
+
+    ms, data = timeit(pillow, args.repeat)
+    print(f'{"Pillow":<10}{ms:>10.1f} ms{len(data) / 2 ** 20:>10.2f} MB')
+    watermark.get_numpy()
+    for name in watermark.PNG_FILTERS:
+        ms, data = timeit(lambda: watermark.encode_png(base, args.level, name), args.repeat)
+        print(f'{name:<10}{ms:>10.1f} ms{len(data) / 2 ** 20:>10.2f} MB')
+
+
+def bench_profiles(args):
+    size = parse_size(args.size)
+    tmp = tempfile.mkdtemp(prefix='wm_bench_')
+    try:
+        paths = []
+        for i in range(args.count):
+            p = os.path.join(tmp, f'src_{i}.jpg')
+            # 噪声叠加渐变，接近照片的压缩特性
+            im = ImageChops.add(make_base(size, 'RGB'), Image.effect_noise(size, 24).convert('RGB'))
+            im.save(p, quality=92)
+            paths.append(p)
+        settings = {'type': '文本水印', 'text': '© PhotoWatermark', 'font_size': 80, 'pos': '右下'}
+        print(f'{args.count} 张 {size[0]}x{size[1]} JPEG，长边缩放到 {args.long_edge}，输出 {args.format}')
+        # 先导出一张预热字体和水印缓存，避免算进第一个配置
+        warm = os.path.join(tmp, 'warm')
+        os.makedirs(warm)
+        watermark.export_one(paths[0], settings, {'out_folder': warm, 'format': args.format},
+                             watermark.OutputPathReserver(warm))
+        results = {}
+        for name in watermark.EXPORT_PROFILES:
+            out = os.path.join(tmp, name)
+            os.makedirs(out)
+            opts = {'out_folder': out, 'format': args.format, 'jpeg_quality': 90, 'resize_mode': '按长边',
+                    'size_value': args.long_edge, 'export_profile': name}
+            reserver = watermark.OutputPathReserver(out)
+            t0 = time.perf_counter()
+            for p in paths:
+                watermark.export_one(p, settings, opts, reserver)
+            results[name] = (time.perf_counter() - t0) * 1000
+            total = sum(os.path.getsize(os.path.join(out, f)) for f in os.listdir(out))
+            print(f'{name:<8}{results[name]:>10.1f} ms{total / 2 ** 20:>10.2f} MB')
+        best = results.get('最佳')
+        if best:
+            print('相对“最佳”的加速：' + '，'.join(f'{n} {best / ms:.1f}x' for n, ms in results.items()))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_large(args):
+    size = parse_size(args.size)
+    limit = Image.MAX_IMAGE_PIXELS  # 本脚本直接导入的 Pillow，尚未被 watermark 调整
+    print(f'{size[0]}x{size[1]}（{size[0] * size[1] / 1e6:.0f} MP），Pillow 默认上限 {limit / 1e6:.0f} MP，'
+          f'超过 {2 * limit / 1e6:.0f} MP 拒绝打开')
+    tmp = tempfile.mkdtemp(prefix='wm_bench_')
+    failed = []
+    try:
+        paths = []
+        base = make_base(size, 'RGB')
+        for ext in ('.jpg', '.png'):
+            p = os.path.join(tmp, f'large{ext}')
+            base.save(p, **({'quality': 85} if ext == '.jpg' else {'compress_level': 1}))
+            paths.append(p)
+        del base
+        plan = watermark.plan_export(paths, watermark.DEFAULT_MEMORY_BUDGET_MB * 2 ** 20)
+        if plan.unreadable:
+            failed.append(f'plan_export 无法读取：{", ".join(map(os.path.basename, plan.unreadable))}')
+        print(f'{"文件":<10}{"预览解码(ms)":>12}{"预览尺寸":>12}{"驻留(MB)":>8}{"导出(ms)":>10}')
+        for p in paths:
+            name = os.path.basename(p)
+            if watermark.read_image_header(p)[0] != size:
+                failed.append(f'{name} 尺寸读取错误')
+            before = rss_mb()
+            t0 = time.perf_counter()
+            im = watermark.decode_preview(watermark.read_source(p))
+            decode_ms = (time.perf_counter() - t0) * 1000
+            held = rss_mb() - before
+            watermark.TilePyramid(im).level(3)
+            if im.width * im.height > watermark.PREVIEW_MAX_PIXELS or watermark.source_size(im) != size:
+                failed.append(f'{name} 预览尺寸 {im.size}，原图尺寸 {watermark.source_size(im)}')
+            preview = f'{im.width}x{im.height}'
+            del im
+            out = os.path.join(tmp, 'out')
+            opts = {'out_folder': out, 'format': 'JPEG', 'resize_mode': '按长边', 'size_value': 2048}
+            os.makedirs(out, exist_ok=True)
+            t0 = time.perf_counter()
+            outputs = watermark.export_one(p, {'text': '© PhotoWatermark', 'pos': '右下'}, opts,
+                                           watermark.OutputPathReserver(out))
+            export_ms = (time.perf_counter() - t0) * 1000
+            if Image.open(outputs[0]).size[0] != 2048:
+                failed.append(f'{name} 导出尺寸错误')
+            print(f'{name:<10}{decode_ms:>14.1f}{preview:>16}{held:>10.0f}{export_ms:>12.1f}')
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if failed:
+        sys.exit('超大图检查失败：\n' + '\n'.join(failed))
+    print('超大图可读取尺寸、缩小解码预览并导出；PNG 等无法缩小解码的格式先整图解码再缩小，'
+          '内存增长含已释放但未归还系统的原尺寸缓冲')
+
+
+def rss_mb():
+    """当前常驻内存（MB）；读不到 /proc 时退回到峰值常驻内存。"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(samples, ps=(50, 90, 99)):
+    s = sorted(samples)
+    return [s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))] for p in ps] + [s[-1]]
+
+
+class SceneProbe:
+    """测量一次界面操作从事件到场景更新完成的延迟。
+    QGraphicsScene.changed 在下一轮事件循环才发出，收到后再同步重绘视口，
+    计时因此覆盖 事件处理 -> 场景更新 -> 视口绘制 的全过程。"""
+
+    def __init__(self, app, win, timeout=10.0):
+        self.app = app
+        self.view = win.graphics_view
+        self.timeout = timeout
+        self.changed = False
+        win.graphics_scene.changed.connect(self._on_changed)
+
+    def _on_changed(self, _):
+        self.changed = True
+
+    def measure(self, action):
+        """返回延迟（毫秒）；timeout 秒内场景没有变化时返回 None，记为失败，不计入分位数。"""
+        self.app.processEvents()
+        self.changed = False
+        t0 = time.perf_counter()
+        action()
+        while not self.changed:
+            if time.perf_counter() - t0 >= self.timeout:
+                return None
+            self.app.processEvents()
+        self.view.viewport().repaint()
+        return (time.perf_counter() - t0) * 1000
+
+
+def isolate_app_data(root):
+    """把界面读写的上次设置、模板库、缩略图缓存和字体覆盖索引都指向 root，
+    基准既不读取用户保存的设置，也不往用户的数据目录写文件。"""
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    watermark.APP_DATA_DIR = root
+    watermark.LAST_SETTINGS_FILE = root / 'last_settings.json'
+    watermark.TEMPLATES_FILE = root / 'templates.json'
+    watermark.TEMPLATES_DB = root / 'templates.db'
+    watermark.THUMBS_DB = root / 'thumbnails.db'
+    watermark.FONT_COVERAGE_FILE = watermark.FONT_COVERAGE.path = root / 'font_coverage.json'
+
+
+def bench_gui(args):
+    # 必须在创建 QApplication 之前设置；已显式指定平台时保持不变
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+
+    size = parse_size(args.size)
+    tmp = tempfile.mkdtemp(prefix='wm_gui_bench_')
+    try:
+        corpus = os.path.join(tmp, 'corpus')
+        os.makedirs(corpus)
+        files = []
+        for i in range(args.count):
+            p = os.path.join(corpus, f'img_{i:03d}.jpg')
+            Image.effect_noise(size, 20 + i % 40).convert('RGB').save(p, quality=90)
+            files.append(p)
+
+        # 数据目录放在临时目录：缩略图第一次导入是冷缓存，界面状态不依赖上次保存的设置
+        isolate_app_data(os.path.join(tmp, 'app_data'))
+        app = QApplication.instance() or QApplication(sys.argv[:1])
+        win = watermark.WatermarkerApp()
+        win.resize(1200, 800)
+        win.show()
+        # 先完成延迟初始化（恢复设置、加载模板），否则它会在第一次 processEvents 时覆盖下面的脚本设置
+        app.processEvents()
+        win._deferred_init()
+        win.watermark_type_combo.setCurrentText('文本水印')
+        win.text_edit.setText('© PhotoWatermark')
+        win.pos_combo.setCurrentText('右下')
+        win.chk_wysiwyg.setChecked(args.wysiwyg)
+        app.processEvents()
+        probe = SceneProbe(app, win)
+        print(f'{args.count} 张 {size[0]}x{size[1]} JPEG，平台 {app.platformName()}，'
+              f'{"所见即所得" if args.wysiwyg else "普通"}预览，每项 {args.repeat} 次')
+
+        rows = []
+
+        def run(name, actions):
+            before = rss_mb()
+            samples = [probe.measure(a) for a in actions]
+            rows.append((name, [s for s in samples if s is not None], samples.count(None), rss_mb() - before))
+
+        def import_all():
+            win.clear_list()
+            win._add_image_paths(files)
+
+        run('导入(冷缓存)', [import_all])
+        run('导入(热缓存)', [import_all] * max(1, args.repeat // 10))
+        items = [win.list_widget.item(i % args.count) for i in range(args.repeat)]
+        run('切换图片', [lambda it=it: win.on_list_item_clicked(it) for it in items])
+        run('透明度滑块', [lambda v=v: win.opacity_slider.setValue(20 + v * 7 % 70) for v in range(1, args.repeat + 1)])
+        run('旋转滑块', [lambda v=v: win.rotate_slider.setValue(v * 13 % 90 - 45) for v in range(1, args.repeat + 1)])
+        run('字号', [lambda v=v: win.font_size_spin.setValue(24 + v * 5 % 60) for v in range(1, args.repeat + 1)])
+        # 再切换一轮图片：缓存都已填满，这一轮的内存变化反映泄漏
+        run('切换图片(第二轮)', [lambda it=it: win.on_list_item_clicked(it) for it in items])
+
+        print(f'{"操作":<12}{"次数":>6}{"超时":>6}{"p50":>9}{"p90":>9}{"p99":>9}{"最大":>9}{"内存变化":>10}')
+        for name, samples, timeouts, grow in rows:
+            stats = ''.join(f'{v:>9.1f}' for v in percentiles(samples)) if samples else f'{"-":>9}' * 4
+            print(f'{name:<12}{len(samples):>6}{timeouts:>6}{stats}{grow:>+9.1f}M')
+        print(f'延迟单位 ms，超时（{probe.timeout:.0f} 秒内场景无变化）不计入分位数；常驻内存 {rss_mb():.0f} MB')
+        if any(timeouts for _, _, timeouts, _ in rows):
+            sys.exit('部分操作超时，结果不完整')
+        win.hide()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='水印工具性能基准')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p = sub.add_parser('blend', help='对比 Pillow 整图合成与区域合成（Pillow / numpy）')
+    p.add_argument('--size', default='6000x4000')
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_blend)
+
+    p = sub.add_parser('tile', help='平铺水印整图渲染耗时')
+    p.add_argument('--size', default='9000x6700')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_tile)
+
+    p = sub.add_parser('pipeline', help='逐张导出与流水线导出对比，输出各阶段利用率')
+    p.add_argument('--count', type=int, default=16)
+    p.add_argument('--size', default='3000x2000')
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser('gui', help='无显示环境下（offscreen）测量界面操作延迟分位数和内存增长')
+    p.add_argument('--count', type=int, default=20)
+    p.add_argument('--size', default='3000x2000')
+    p.add_argument('--repeat', type=int, default=30)
+    p.add_argument('--wysiwyg', action='store_true', help='使用所见即所得预览')
+    p.set_defaults(func=bench_gui)
+
+    p = sub.add_parser('png', help='多线程 PNG 编码与 Pillow 单线程编码对比（各滤波方式）')
+    p.add_argument('--size', default='6000x4000')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--level', type=int, default=watermark.PNG_DEFAULT_LEVEL)
+    p.set_defaults(func=bench_png)
+
+    p = sub.add_parser('profiles', help='各导出配置（草稿/均衡/最佳）缩小导出的耗时与输出大小')
+    p.add_argument('--count', type=int, default=8)
+    p.add_argument('--size', default='6000x4000')
+    p.add_argument('--long-edge', type=int, default=2048)
+    p.add_argument('--format', default='JPEG')
+    p.set_defaults(func=bench_profiles)
+
+    p = sub.add_parser('large', help='超过 Pillow 默认解压炸弹上限的超大图：读取尺寸、预览缩小解码与导出')
+    p.add_argument('--size', default='14000x13000')
+    p.set_defaults(func=bench_large)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
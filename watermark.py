@@ -1,24 +1,145 @@
+from __future__ import annotations
+
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import hashlib
+import io
 import json
+import math
 import os
+import queue
+import re
+import socket
+import sqlite3
+import struct
 import sys
+import threading
+import time
+import zipfile
+import zlib
 from pathlib import Path
 
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance
+_STARTUP_T0 = time.perf_counter()
+
 from PyQt5 import QtCore, QtGui, QtWidgets
-from PyQt5.QtCore import Qt, QPointF, pyqtSignal
+from PyQt5.QtCore import Qt, QPointF, QRectF, pyqtSignal
 from PyQt5.QtGui import QPixmap, QImage, QIcon, QFontDatabase
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QFileDialog, QListWidget, QListWidgetItem,
     QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QSlider, QSpinBox, QComboBox,
     QGroupBox, QLineEdit, QGraphicsView, QGraphicsScene, QGraphicsPixmapItem,
-    QGraphicsTextItem, QTabWidget, QMessageBox, QColorDialog, QCheckBox
+    QGraphicsTextItem, QTabWidget, QMessageBox, QColorDialog, QCheckBox, QGraphicsItem
 )
 
+
+# --------------------------- Lazy imports ---------------------------
+# PIL 与 numpy 导入较慢（合计约 200 ms），推迟到第一次真正用到时再导入，
+# 以便窗口尽快显示。import 语句需显式写出，PyInstaller 才能静态分析到依赖。
+
+class _LazyModule:
+    """首次访问属性时才调用 loader 导入真正模块的代理对象。"""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._module = None
+
+    def __getattr__(self, name):
+        if self._module is None:
+            self._module = self._loader()
+        return getattr(self._module, name)
+
+
+# 打开的都是用户自己选的本地文件，Pillow 默认的解压炸弹上限（约 1.8 亿像素）会挡住正常的超大扫描图和拼接图。
+# 放宽到约 10 亿像素：超过它 Pillow 只发警告，超过两倍才拒绝打开
+MAX_SOURCE_PIXELS = 2 ** 30
+
+
+def _import_pil_image():
+    from PIL import Image as module
+    module.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+    return module
+
+
+def _import_pil_imagedraw():
+    from PIL import ImageDraw as module
+    return module
+
+
+def _import_pil_imagefont():
+    from PIL import ImageFont as module
+    return module
+
+
+def _import_pil_imagefilter():
+    from PIL import ImageFilter as module
+    return module
+
+
+def _import_pil_exiftags():
+    from PIL import ExifTags as module
+    return module
+
+
+Image = _LazyModule(_import_pil_image)
+ImageDraw = _LazyModule(_import_pil_imagedraw)
+ImageFont = _LazyModule(_import_pil_imagefont)
+ImageFilter = _LazyModule(_import_pil_imagefilter)
+ExifTags = _LazyModule(_import_pil_exiftags)
+
+np = None  # numpy 为可选依赖，通过 get_numpy() 按需导入
+
+
+def get_numpy():
+    """按需导入 numpy，未安装时返回 None。"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+class StartupTimer:
+    """记录启动各阶段的耗时，使用 --startup-timing 或 WATERMARK_STARTUP_TIMING=1 时打印。"""
+
+    def __init__(self, t0):
+        self.enabled = False
+        self.last = t0
+        self.t0 = t0
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last, now - self.t0))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        print('启动耗时：')
+        for name, dt, total in self.phases:
+            print(f'  {name:<12}{dt * 1000:8.1f} ms    累计 {total * 1000:8.1f} ms')
+        sys.stdout.flush()
+
+
+STARTUP_TIMER = StartupTimer(_STARTUP_T0)
+
 APP_DATA_DIR = Path(os.path.expanduser('~')) / '.watermarker_py'
-TEMPLATES_FILE = APP_DATA_DIR / 'templates.json'
+TEMPLATES_FILE = APP_DATA_DIR / 'templates.json'  # 旧版模板文件，首次启动时迁移到 TEMPLATES_DB
+TEMPLATES_DB = APP_DATA_DIR / 'templates.db'
+THUMBS_DB = APP_DATA_DIR / 'thumbnails.db'
+FONT_COVERAGE_FILE = APP_DATA_DIR / 'font_coverage.json'
 LAST_SETTINGS_FILE = APP_DATA_DIR / 'last_settings.json'
 
-SUPPORTED_INPUT = ('.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG')
+SUPPORTED_INPUT = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.tif', '.tiff',
+                   '.JPG', '.JPEG', '.PNG', '.GIF', '.WEBP', '.TIF', '.TIFF')
+ARCHIVE_INPUT = ('.zip',)
 
 
 # --------------------------- Helpers ---------------------------
@@ -101,27 +222,2438 @@ def find_system_font_path(family_name):
     return None
 
 
+# --------------------------- Archives ---------------------------
+# ZIP 中的图片用 "压缩包路径::成员名" 表示，导入时只列目录，成员在真正用到时才单独读取，
+# 不需要先解压。所有读取源图的地方都通过 open_source / source_stat。
+
+ARCHIVE_SEP = '::'
+
+
+def split_archive_path(path):
+    """拆成 (压缩包路径, 成员名)；普通文件返回 (path, None)。"""
+    if ARCHIVE_SEP in path:
+        archive, member = path.split(ARCHIVE_SEP, 1)
+        if archive.lower().endswith(ARCHIVE_INPUT):
+            return archive, member
+    return path, None
+
+
+@functools.lru_cache(maxsize=8)
+def _open_archive(path, mtime):
+    # ZipFile 在多个线程同时读取不同成员时内部会加锁，可以共用
+    return zipfile.ZipFile(path)
+
+
+def _archive(path):
+    return _open_archive(path, os.path.getmtime(path))
+
+
+def list_archive_images(path):
+    """压缩包中所有支持格式的图片，返回虚拟路径列表。"""
+    return [f'{path}{ARCHIVE_SEP}{info.filename}' for info in _archive(path).infolist()
+            if not info.is_dir() and info.filename.lower().endswith(SUPPORTED_INPUT)]
+
+
+def expand_sources(paths):
+    """把路径列表中的 ZIP 压缩包展开为其中的图片，其它路径原样保留。"""
+    out = []
+    for p in paths:
+        if p.lower().endswith(ARCHIVE_INPUT) and os.path.isfile(p):
+            out.extend(list_archive_images(p))
+        else:
+            out.append(p)
+    return out
+
+
+def open_source(path):
+    """以二进制方式打开源图（普通文件或压缩包成员），返回可 seek 的文件对象。"""
+    archive, member = split_archive_path(path)
+    if member is None:
+        return open(path, 'rb')
+    return _archive(archive).open(member)
+
+
+def read_source(path) -> bytes:
+    with open_source(path) as f:
+        return f.read()
+
+
+def source_stat(path):
+    """源图的 (大小, 修改时间)：压缩包成员取成员大小与压缩包的修改时间。"""
+    archive, member = split_archive_path(path)
+    if member is None:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+    return _archive(archive).getinfo(member).file_size, os.path.getmtime(archive)
+
+
+def source_dir(path):
+    """源图所在的磁盘目录（压缩包成员取压缩包所在目录）。"""
+    return os.path.dirname(split_archive_path(path)[0])
+
+
+def source_name(path):
+    """源图的文件名。压缩包成员取成员名的最后一段：'in.zip::dir/b.png' 和 'in.zip::b.png' 都是 'b.png'。"""
+    archive, member = split_archive_path(path)
+    # ZIP 成员名总以 '/' 分隔；在压缩包根目录时整个成员名就是文件名
+    return member.rsplit('/', 1)[-1] if member is not None else os.path.basename(archive)
+
+
+# --------------------------- PIL <-> Qt ---------------------------
+# PIL 不对外暴露内部像素缓冲，tobytes() 这一次拷贝无法避免；之后 QImage 直接包装这份 bytes
+# （把它挂在 QImage 上保证生命周期），RGB 图像用 Format_RGB888，不再先转换成 RGBA。
+# 得到 QPixmap 时 QPixmap.fromImage 还会再拷贝一次（转换成显示格式），因此 PIL -> QPixmap
+# 共两次拷贝，非 RGB/RGBA 模式另加一次 convert。设置 WATERMARK_DEBUG=1 时打印每次转换的拷贝次数。
+
+DEBUG = os.environ.get('WATERMARK_DEBUG') == '1'
+BRIDGE_STATS = {'conversions': 0, 'copies': 0, 'bytes_copied': 0}
+
+
+def _record_bridge(direction, size, mode, copies, nbytes):
+    if not DEBUG:
+        return
+    BRIDGE_STATS['conversions'] += 1
+    BRIDGE_STATS['copies'] += copies
+    BRIDGE_STATS['bytes_copied'] += nbytes
+    print(f'[bridge] {direction} {size[0]}x{size[1]} {mode}: {copies} 次拷贝 '
+          f'({nbytes / 2 ** 20:.1f} MB)，累计 {BRIDGE_STATS["copies"]} 次 / '
+          f'{BRIDGE_STATS["bytes_copied"] / 2 ** 20:.1f} MB')
+
+
+def pil_image_to_qimage(im: Image.Image) -> QImage:
+    """把 PIL 图像包装为 QImage。返回的 QImage 引用一份 bytes，该 bytes 作为属性挂在 QImage 上。"""
+    src_mode = im.mode
+    copies = 0
+    nbytes = 0
+    if im.mode not in ('RGB', 'RGBA'):
+        im = im.convert('RGBA')
+        copies += 1
+        nbytes += im.width * im.height * 4
+    if im.mode == 'RGB':
+        fmt, bpp = QImage.Format_RGB888, 3
+    else:
+        fmt, bpp = QImage.Format_RGBA8888, 4
+    data = im.tobytes('raw', im.mode)
+    copies += 1
+    nbytes += len(data)
+    qimg = QImage(data, im.width, im.height, im.width * bpp, fmt)
+    qimg._pil_buffer = data  # QImage 不拥有外部缓冲，必须保证它和 QImage 一样长寿
+    _record_bridge('pil->qimage', im.size, src_mode, copies, nbytes)
+    return qimg
+
+
 def pil_image_to_qpixmap(im: Image.Image) -> QPixmap:
+    # QPixmap.fromImage 会把像素拷贝并转换成显示格式，转换完成后不再引用 QImage 的缓冲
+    qimg = pil_image_to_qimage(im)
+    pix = QPixmap.fromImage(qimg)
+    _record_bridge('qimage->qpixmap', im.size, im.mode, 1, qimg.sizeInBytes())
+    return pix
+
+
+# --------------------------- Blending ---------------------------
+# 合成只发生在水印所在的矩形区域：先从底图裁出该区域，混合后再贴回，
+# 避免创建与原图等大的 overlay 并做整图 alpha_composite。
+# 设置环境变量 WATERMARK_NUMPY_BLEND=1 且安装了 numpy 时，在数组上一次完成“透明度缩放 + over 混合”；
+# 默认走 Pillow 的区域合成（实测更快，见 benchmark.py blend）。
+
+USE_NUMPY_BLEND = os.environ.get('WATERMARK_NUMPY_BLEND') == '1' and get_numpy() is not None
+
+
+def apply_opacity(im: Image.Image, opacity: float) -> Image.Image:
+    """按 opacity (0~1) 缩放 RGBA 图像的 alpha 通道，返回新图像。"""
     if im.mode != 'RGBA':
         im = im.convert('RGBA')
-    data = im.tobytes('raw', 'RGBA')
-    width, height = im.width, im.height
-    bytes_per_line = width * 4
-    qimg = QImage(data, width, height, bytes_per_line, QImage.Format_RGBA8888)
-    return QPixmap.fromImage(qimg.copy())
-
-
-def qpixmap_to_pil(qpixmap: QPixmap) -> Image.Image:
-    qimg = qpixmap.toImage().convertToFormat(QImage.Format_RGBA8888)
-    width = qimg.width()
-    height = qimg.height()
-    ptr = qimg.bits()
-    ptr.setsize(qimg.byteCount())
-    arr = bytes(ptr)
-    im = Image.frombuffer('RGBA', (width, height), arr, 'raw', 'RGBA', 0, 1)
+    if opacity >= 1.0:
+        return im
+    opacity = max(0.0, opacity)
+    if USE_NUMPY_BLEND:
+        arr = np.array(im)
+        arr[..., 3] = _opacity_lut(opacity)[arr[..., 3]]
+        return Image.fromarray(arr)
+    im = im.copy()
+    im.putalpha(im.getchannel('A').point(_opacity_lut(opacity)))
+    return im
+
+
+def _opacity_lut(opacity):
+    # alpha 缩放表，Pillow 与 numpy 两条路径共用同一舍入方式，结果逐像素一致
+    lut = [int(v * opacity + 0.5) for v in range(256)]
+    return np.array(lut, np.uint8) if USE_NUMPY_BLEND else lut
+
+
+def _clip_region(base_size, sprite_size, xy):
+    """计算 sprite 放在 xy 处时与底图相交的区域，返回 (底图 box, sprite box)，无交集返回 None。"""
+    bw, bh = base_size
+    sw, sh = sprite_size
+    x, y = int(xy[0]), int(xy[1])
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(bw, x + sw), min(bh, y + sh)
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right, bottom), (left - x, top - y, right - x, bottom - y)
+
+
+def _div255(x):
+    """对 uint16 数组做四舍五入的 x / 255，用移位代替整数除法。"""
+    x += 128
+    x += x >> 8
+    x >>= 8
+    return x
+
+
+def _np_blend_over(dst, src, opacity):
+    """在 numpy 数组上把 src (RGBA, 非预乘) 以 over 方式混合进 dst (RGB/RGBA)，原地修改 dst。
+    整数运算与 Pillow 的 paste(带蒙版) / alpha_composite 逐步相同，两条路径输出逐像素一致。"""
+    sa = src[..., 3]
+    if opacity < 1.0:
+        sa = _opacity_lut(opacity)[sa]
+    sa = sa.astype(np.uint16)[..., None]
+    if dst.shape[2] == 3:
+        # RGB 底图：out = (s*a + d*(255-a)) / 255，一次舍入（同 Pillow 的带蒙版 paste）
+        out = src[..., :3] * sa
+        out += dst * (255 - sa)
+        dst[...] = _div255(out)
+        return dst
+    # RGBA 底图：同 Pillow alpha_composite 的 7 位定点实现
+    sa = sa.astype(np.uint32)
+    da = dst[..., 3:].astype(np.uint32)
+    out_a255 = sa * 255 + da * (255 - sa)
+    coef1 = sa * (255 * 255 << 7) // np.maximum(out_a255, 1)
+    coef2 = (255 << 7) - coef1
+    rgb = src[..., :3] * coef1 + dst[..., :3] * coef2 + (0x80 << 7)
+    rgb = ((rgb >> 8) + rgb) >> 8
+    out_a = out_a255 + 0x80
+    out_a = ((out_a >> 8) + out_a) >> 8
+    keep = sa == 0  # 完全透明的像素保持底图不变
+    dst[..., :3] = np.where(keep, dst[..., :3], rgb >> 7)
+    dst[..., 3:] = np.where(keep, da, out_a)
+    return dst
+
+
+def blend_over(base: Image.Image, sprite: Image.Image, xy, opacity: float = 1.0, dirty=None) -> Image.Image:
+    """把 RGBA 水印 sprite 以左上角 xy 合成到 base (RGB 或 RGBA) 上，原地修改并返回 base。
+    只处理两者相交的区域；opacity 会与 sprite 自身的 alpha 相乘。
+    dirty 为列表时，追加实际修改过的底图区域 (left, top, right, bottom)。"""
+    if sprite.mode != 'RGBA':
+        sprite = sprite.convert('RGBA')
+    clip = _clip_region(base.size, sprite.size, xy)
+    if clip is None or opacity <= 0:
+        return base
+    base_box, sprite_box = clip
+    # 进一步收缩到 sprite 中 alpha 非零的部分（文字 sprite 往往大半透明）
+    opaque = sprite.crop(sprite_box).getchannel('A').getbbox()
+    if opaque is None:
+        return base
+    sprite_box = (sprite_box[0] + opaque[0], sprite_box[1] + opaque[1],
+                  sprite_box[0] + opaque[2], sprite_box[1] + opaque[3])
+    base_box = (base_box[0] + opaque[0], base_box[1] + opaque[1],
+                base_box[0] + opaque[2], base_box[1] + opaque[3])
+    if sprite_box != (0, 0) + sprite.size:
+        sprite = sprite.crop(sprite_box)
+    if dirty is not None:
+        dirty.append(base_box)
+    if USE_NUMPY_BLEND and base.mode in ('RGB', 'RGBA'):
+        region = np.array(base.crop(base_box))
+        _np_blend_over(region, np.asarray(sprite), opacity)
+        base.paste(Image.fromarray(region), base_box[:2])
+        return base
+    sprite = apply_opacity(sprite, opacity)
+    if base.mode == 'RGBA':
+        base.alpha_composite(sprite, base_box[:2])
+    else:
+        base.paste(sprite, base_box[:2], sprite)
+    return base
+
+
+def _opaque_pieces(sprite, band=32):
+    """把 sprite 按 band 行切成横条，每条再裁掉全透明的左右部分。
+    旋转后的文字包围盒大部分是透明的，逐条合成可以跳过这些像素。返回 [(dx, dy, piece)]。"""
+    alpha = sprite.getchannel('A')
+    pieces = []
+    for top in range(0, sprite.height, band):
+        bottom = min(sprite.height, top + band)
+        bbox = alpha.crop((0, top, sprite.width, bottom)).getbbox()
+        if bbox is None:
+            continue
+        box = (bbox[0], top + bbox[1], bbox[2], top + bbox[3])
+        pieces.append((box[0], box[1], sprite.crop(box)))
+    return pieces
+
+
+def stamp_sprite(base: Image.Image, sprite: Image.Image, positions, opacity: float = 1.0,
+                 dirty=None) -> Image.Image:
+    """把同一个 sprite 合成到 base 的多个位置（左上角坐标列表），原地修改并返回 base。
+    sprite 只做一次切条和透明度处理，之后每个位置只合成不透明的部分。dirty 同 blend_over。"""
+    if sprite.mode != 'RGBA':
+        sprite = sprite.convert('RGBA')
+    if opacity <= 0:
+        return base
+    pieces = _opaque_pieces(apply_opacity(sprite, opacity))
+    for x, y in positions:
+        for dx, dy, piece in pieces:
+            clip = _clip_region(base.size, piece.size, (x + dx, y + dy))
+            if clip is None:
+                continue
+            base_box, piece_box = clip
+            if dirty is not None:
+                dirty.append(base_box)
+            if base.mode == 'RGBA':
+                base.alpha_composite(piece, base_box[:2], piece_box)
+            else:
+                part = piece if piece_box == (0, 0) + piece.size else piece.crop(piece_box)
+                base.paste(part, base_box[:2], part)
+    return base
+
+
+# --------------------------- Font coverage ---------------------------
+# 所选字体缺字时（如英文字体里的中文）按字符回退到其它字体。各字体 cmap 覆盖的码位
+# 以合并后的区间保存在 FONT_COVERAGE_FILE 中，按文件 mtime/大小失效，查询是一次二分。
+
+FALLBACK_FONT_FAMILIES = ('Microsoft YaHei', 'SimHei', 'SimSun', 'NotoSansCJK')
+
+
+def _cmap_subtable(data, face_index=0):
+    """返回字体首选 Unicode cmap 子表的 (format, offset)，没有时返回 None。"""
+    base = 0
+    if data[:4] == b'ttcf':
+        base = struct.unpack_from('>I', data, 12 + 4 * face_index)[0]
+    num_tables = struct.unpack_from('>H', data, base + 4)[0]
+    for i in range(num_tables):
+        tag, _, offset, _ = struct.unpack_from('>4sIII', data, base + 12 + 16 * i)
+        if tag == b'cmap':
+            break
+    else:
+        return None
+    best = None
+    for i in range(struct.unpack_from('>H', data, offset + 2)[0]):
+        platform, encoding, sub = struct.unpack_from('>HHI', data, offset + 4 + 8 * i)
+        if platform not in (0, 3) or (platform == 3 and encoding not in (1, 10)):
+            continue
+        fmt = struct.unpack_from('>H', data, offset + sub)[0]
+        # format 12 覆盖完整 Unicode，优先于只含 BMP 的 format 4
+        if fmt == 12 or (fmt == 4 and best is None):
+            best = (fmt, offset + sub)
+    return best
+
+
+def read_cmap_ranges(path, face_index=0):
+    """读取字体 cmap 中有字形的码位，返回合并后的 [(start, end), ...]（两端都包含）。"""
+    data = Path(path).read_bytes()
+    sub = _cmap_subtable(data, face_index)
+    if sub is None:
+        return []
+    fmt, off = sub
+    ranges = []
+    if fmt == 12:
+        for i in range(struct.unpack_from('>I', data, off + 12)[0]):
+            start, end, glyph = struct.unpack_from('>III', data, off + 16 + 12 * i)
+            ranges.append((start + (glyph == 0), end))
+    else:
+        seg_x2 = struct.unpack_from('>H', data, off + 6)[0]
+        n = seg_x2 // 2
+        ends = struct.unpack_from(f'>{n}H', data, off + 14)
+        starts = struct.unpack_from(f'>{n}H', data, off + 16 + seg_x2)
+        deltas = struct.unpack_from(f'>{n}h', data, off + 16 + 2 * seg_x2)
+        ro_base = off + 16 + 3 * seg_x2
+        range_offsets = struct.unpack_from(f'>{n}H', data, ro_base)
+        for i in range(n):
+            start, end, delta, ro = starts[i], ends[i], deltas[i], range_offsets[i]
+            if start == 0xFFFF:
+                continue
+            if ro == 0:
+                # 整段按 delta 映射，只有映射到 0 号字形（缺字）的那个码位要排除
+                missing = (-delta) & 0xFFFF
+                if start <= missing <= end:
+                    ranges += [(start, missing - 1), (missing + 1, end)]
+                else:
+                    ranges.append((start, end))
+                continue
+            glyphs = struct.unpack_from(f'>{end - start + 1}H', data, ro_base + 2 * i + ro)
+            ranges += [(c, c) for c, g in zip(range(start, end + 1), glyphs) if g]
+    merged = []
+    for start, end in sorted(r for r in ranges if r[0] <= r[1]):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+class FontCoverageIndex:
+    """字体字形覆盖索引。每个字体只解析一次 cmap，结果写入磁盘缓存供下次启动复用；
+    内存中保存区间起点/终点两个列表，判断字符是否有字形只需一次二分查找。"""
+
+    def __init__(self, path=FONT_COVERAGE_FILE):
+        self.path = path
+        self._entries = None  # 字体路径 -> {'mtime', 'size', 'ranges': [s0, e0, s1, e1, ...]}
+        self._ranges = {}  # 字体路径 -> (starts, ends)
+        self._lock = threading.Lock()
+
+    def _font_ranges(self, font_path):
+        ranges = self._ranges.get(font_path)
+        if ranges is not None:
+            return ranges
+        with self._lock:
+            if self._entries is None:
+                self._entries = load_json(self.path)
+            try:
+                st = os.stat(font_path)
+                stamp = (st.st_mtime, st.st_size)
+            except OSError:
+                stamp = None
+            entry = self._entries.get(font_path)
+            if stamp is None:
+                flat = []
+            elif entry and (entry['mtime'], entry['size']) == stamp:
+                flat = entry['ranges']
+            else:
+                try:
+                    flat = [v for r in read_cmap_ranges(font_path) for v in r]
+                except (OSError, struct.error, IndexError):
+                    flat = []
+                self._entries[font_path] = {'mtime': stamp[0], 'size': stamp[1], 'ranges': flat}
+                try:
+                    ensure_app_dir()
+                    _write_json_atomic(self.path, self._entries)
+                except OSError:
+                    pass
+            ranges = self._ranges[font_path] = (flat[0::2], flat[1::2])
+        return ranges
+
+    def covers(self, font_path, ch):
+        starts, ends = self._font_ranges(font_path)
+        code = ord(ch)
+        i = bisect.bisect_right(starts, code) - 1
+        return i >= 0 and code <= ends[i]
+
+
+FONT_COVERAGE = FontCoverageIndex()
+
+
+@functools.lru_cache(maxsize=8192)
+def covering_font(font_paths, ch):
+    """font_paths 中第一个含有 ch 字形的字体序号，都没有时返回 0（用首选字体画缺字框）。"""
+    for i, path in enumerate(font_paths):
+        if FONT_COVERAGE.covers(path, ch):
+            return i
+    return 0
+
+
+def split_font_runs(text, font_paths):
+    """把 text 切成 [(片段, 字体序号), ...]，每个字符用第一个覆盖它的字体。
+    空白字符只要当前片段的字体有字形就并入当前片段，避免中英文之间的空格单独成段。"""
+    runs = []
+    for ch in text:
+        if runs and ch.isspace() and FONT_COVERAGE.covers(font_paths[runs[-1][1]], ch):
+            i = runs[-1][1]
+        else:
+            i = covering_font(font_paths, ch)
+        if runs and runs[-1][1] == i:
+            runs[-1][0] += ch
+        else:
+            runs.append([ch, i])
+    return [tuple(r) for r in runs]
+
+
+# --------------------------- Rendering ---------------------------
+# 水印渲染只依赖设置字典（即 _collect_settings 的结果），不依赖界面控件，
+# 导出与平铺预览共用同一套实现。
+
+POSITION_PRESETS = ['左上', '上中', '右上', '左中', '居中', '右中', '左下', '下中', '右下']
+TILE_PRESET = '平铺'
+AUTO_PRESET = '自动'
+# 自动位置在得分相同时的优先顺序：角落优先，避开画面中心的主体
+AUTO_PREFERENCE = ['右下', '左下', '右上', '左上', '下中', '上中', '右中', '左中', '居中']
+
+TEXT_SPRITE_PAD = 3  # 文字 sprite 四周留白，容纳阴影/描边的偏移
+WYSIWYG_MIN_PROXY_SIDE = 1024  # 所见即所得预览代理图长边的下限
+WYSIWYG_HANDLE_OPACITY = 0.01  # 所见即所得模式下拖拽手柄几乎透明，但仍能接收鼠标事件
+
+
+@functools.lru_cache(maxsize=256)
+def cached_font_path(family_name):
+    """find_system_font_path 需要遍历字体目录，结果按 family 缓存。"""
+    return find_system_font_path(family_name)
+
+
+def _truetype(path, size, is_bold, is_italic):
+    # 应用粗体和斜体设置
+    if hasattr(ImageFont, 'TRUETYPE'):
+        # 较新版本的PIL支持直接设置font_weight和font_style
+        font_weight = 'bold' if is_bold else 'normal'
+        font_style = 'italic' if is_italic else 'normal'
+        return ImageFont.truetype(path, size, font_weight=font_weight, font_style=font_style)
+    # 旧版本PIL的兼容处理
+    return ImageFont.truetype(path, size)
+
+
+@functools.lru_cache(maxsize=64)
+def load_pil_font(font_family, requested_size, is_bold=False, is_italic=False):
+    """按 family / 像素大小 / 粗斜体加载 PIL 字体，找不到时退回常见中文字体。"""
+    # 尝试找到系统字体文件（支持中文）
+    font_path = cached_font_path(font_family)
+    pil_font = None
+    if font_path:
+        try:
+            pil_font = _truetype(font_path, requested_size, is_bold, is_italic)
+        except Exception:
+            pil_font = None
+
+    # 如果没找到或加载失败，尝试常见中文备选（再试一次）
+    if pil_font is None:
+        fallback_list = [cached_font_path(family) for family in FALLBACK_FONT_FAMILIES]
+        for fp in filter(None, fallback_list):
+            try:
+                pil_font = _truetype(fp, requested_size, is_bold, is_italic)
+                break
+            except Exception:
+                pil_font = None
+
+    # 最后退回到 PIL 默认（会导致中文缺失），但我们尽量避免到这步
+    if pil_font is None:
+        pil_font = ImageFont.load_default()
+
+    # 对于PIL不支持直接设置粗体斜体的情况，我们可以尝试寻找特定的粗体斜体字体文件
+    if pil_font and (is_bold or is_italic):
+        try:
+            # 尝试寻找粗体版本的字体
+            if is_bold:
+                bold_variants = [f'{font_family} Bold', f'{font_family}Bold']
+                for variant in bold_variants:
+                    bold_path = cached_font_path(variant)
+                    if bold_path:
+                        pil_font = ImageFont.truetype(bold_path, requested_size)
+                        break
+            # 尝试寻找斜体版本的字体
+            if is_italic and pil_font:
+                italic_variants = [f'{font_family} Italic', f'{font_family}Italic']
+                for variant in italic_variants:
+                    italic_path = cached_font_path(variant)
+                    if italic_path:
+                        pil_font = ImageFont.truetype(italic_path, requested_size)
+                        break
+        except Exception:
+            # 如果找不到特定变体，保持原有字体
+            pass
+    return pil_font
+
+
+@functools.lru_cache(maxsize=8)
+def _load_wm_image(path, mtime):
+    # mtime 参与缓存键，水印文件被替换后会重新读取
+    return Image.open(path).convert('RGBA')
+
+
+def calc_preset_position(base_w, base_h, tw, th, preset, pad=10):
+    # 根据九宫格预设计算绘制坐标
+    if preset in ('左上', '左中', '左下'):
+        x = pad
+    elif preset in ('上中', '居中', '下中'):
+        x = (base_w - tw) / 2
+    else:
+        x = base_w - tw - pad
+    if preset in ('左上', '上中', '右上'):
+        y = pad
+    elif preset in ('左中', '居中', '右中'):
+        y = (base_h - th) / 2
+    else:
+        y = base_h - th - pad
+    return int(x), int(y)
+
+
+AUTO_ANALYSIS_SIDE = 128  # 自动位置/颜色分析用灰度小图的长边
+AUTO_OVERSAMPLE = 3  # 先最近邻取样到分析尺寸的 3 倍，再 box 缩小
+AUTO_LIGHT_LUMA = 140  # 区域平均亮度高于此值时用深色文字
+AUTO_DARK_COLOR = (32, 32, 32)
+AUTO_LIGHT_COLOR = (255, 255, 255)
+
+
+class RegionStats:
+    """在缩小的灰度图上统计任意矩形区域的平均亮度和繁忙程度，用于自动位置与自动颜色。
+    繁忙程度 = 平均边缘强度 + 亮度标准差；有 numpy 时用积分图，每个区域只需 4 次查表。
+    对整张大图做 box 缩小要读遍全部像素（24 MP 约 50 ms），这里先最近邻取样再缩小，
+    只读取约十万个像素，单张耗时在几毫秒以内。"""
+
+    def __init__(self, base: Image.Image):
+        self.w, self.h = base.size
+        k = min(1.0, AUTO_ANALYSIS_SIDE / max(base.size))
+        size = (max(1, round(self.w * k)), max(1, round(self.h * k)))
+        sample = base
+        if k * AUTO_OVERSAMPLE < 1:
+            sample = base.resize((size[0] * AUTO_OVERSAMPLE, size[1] * AUTO_OVERSAMPLE), Image.NEAREST)
+        luma = sample.convert('L')
+        if luma.size != size:
+            luma = luma.resize(size, Image.BOX)
+        self.luma = luma
+        self.edges = luma.filter(ImageFilter.FIND_EDGES)
+        # Pillow 的卷积滤镜不处理最外一圈像素（原样复制亮度），清零以免贴边的平坦区域被当成繁忙
+        ImageDraw.Draw(self.edges).rectangle((0, 0, size[0] - 1, size[1] - 1), outline=0)
+        self.kx, self.ky = size[0] / self.w, size[1] / self.h
+        self._integrals = None
+        numpy = get_numpy()
+        if numpy is not None:
+            y = numpy.asarray(luma, dtype=numpy.float64)
+            e = numpy.asarray(self.edges, dtype=numpy.float64)
+            self._integrals = [self._integral(numpy, a) for a in (y, y * y, e)]
+
+    @staticmethod
+    def _integral(numpy, a):
+        ii = numpy.zeros((a.shape[0] + 1, a.shape[1] + 1))
+        ii[1:, 1:] = a.cumsum(0).cumsum(1)
+        return ii
+
+    def stats(self, x, y, tw, th):
+        """原图坐标下矩形 (x, y, tw, th) 的 (平均亮度, 繁忙程度)，矩形超出图像的部分忽略。"""
+        sw, sh = self.luma.size
+        l = min(sw - 1, max(0, int(x * self.kx)))
+        t = min(sh - 1, max(0, int(y * self.ky)))
+        r = min(sw, max(l + 1, math.ceil((x + tw) * self.kx)))
+        b = min(sh, max(t + 1, math.ceil((y + th) * self.ky)))
+        n = (r - l) * (b - t)
+        if self._integrals is not None:
+            s, s2, e = (ii[b, r] - ii[t, r] - ii[b, l] + ii[t, l] for ii in self._integrals)
+        else:
+            hist = self.luma.crop((l, t, r, b)).histogram()
+            s = sum(i * c for i, c in enumerate(hist))
+            s2 = sum(i * i * c for i, c in enumerate(hist))
+            e = sum(i * c for i, c in enumerate(self.edges.crop((l, t, r, b)).histogram()))
+        mean = s / n
+        return mean, e / n + math.sqrt(max(0.0, s2 / n - mean * mean))
+
+    def best_preset(self, tw, th, pad=10):
+        """九宫格中放下 tw x th 水印时背景最不繁忙的预设位置。"""
+        def score(preset):
+            x, y = calc_preset_position(self.w, self.h, tw, th, preset, pad)
+            # 取一位小数，差别很小时按 AUTO_PREFERENCE 的顺序选
+            return round(self.stats(x, y, tw, th)[1], 1), AUTO_PREFERENCE.index(preset)
+        return min(AUTO_PREFERENCE, key=score)
+
+
+def contrast_color(luma, color=(255, 255, 255, 255)):
+    """按背景平均亮度选深色或白色文字，保留原颜色的 alpha。"""
+    rgb = AUTO_DARK_COLOR if luma > AUTO_LIGHT_LUMA else AUTO_LIGHT_COLOR
+    return list(rgb) + [list(color)[3] if len(color) > 3 else 255]
+
+
+@functools.lru_cache(maxsize=32)
+def _fallback_chain(primary_path):
+    # 首选字体在前，其后是按 FALLBACK_FONT_FAMILIES 找到的字体文件，去重保序
+    paths = [primary_path] + [cached_font_path(family) for family in FALLBACK_FONT_FAMILIES]
+    return tuple(dict.fromkeys(p for p in paths if p))
+
+
+@functools.lru_cache(maxsize=64)
+def _load_font_file(path, size, is_bold, is_italic):
+    return _truetype(path, size, is_bold, is_italic)
+
+
+def text_font_runs(text, pil_font, size, is_bold=False, is_italic=False):
+    """按字形覆盖把 text 切成 [(片段, 字体), ...]；首选字体能画出全部字符时只有一段。"""
+    primary = getattr(pil_font, 'path', None)
+    if not text or not isinstance(primary, str):
+        return [(text, pil_font)]
+    runs = split_font_runs(text, _fallback_chain(primary))
+    if len(runs) == 1:
+        return [(text, pil_font)]
+    chain = _fallback_chain(primary)
+    fonts = []
+    for run, i in runs:
+        try:
+            font = pil_font if i == 0 else _load_font_file(chain[i], size, is_bold, is_italic)
+        except OSError:
+            font = pil_font
+        fonts.append((run, font))
+    return fonts
+
+
+def render_text_sprite(s, px_scale=1.0):
+    """把文字（含阴影/描边）画到刚好容纳它的 RGBA sprite 上。
+    返回 (sprite, left, top, tw, th)：left/top 为文字包围盒相对绘制原点的偏移，
+    sprite 左上角对应绘制原点 (x + left - TEXT_SPRITE_PAD, y + top - TEXT_SPRITE_PAD)。
+    px_scale 用于在缩小的代理图上渲染：字号和阴影偏移按比例缩放。"""
+    text = s.get('text') or ''
+    # 直接根据用户的字号作为像素大小（不再使用“占比”）
+    requested_size = max(6, int(s.get('font_size', 36)))
+    if px_scale != 1.0:
+        requested_size = max(1, int(round(requested_size * px_scale)))
+    pil_font = load_pil_font(s.get('font', ''), requested_size, bool(s.get('bold')), bool(s.get('italic')))
+
+    runs = text_font_runs(text, pil_font, requested_size, bool(s.get('bold')), bool(s.get('italic')))
+    if len(runs) > 1:
+        # 多字体：各片段按基线对齐依次排开，坐标系与单字体时相同（原点在首选字体的 ascent 线上）
+        ascent = pil_font.getmetrics()[0]
+        placed, boxes, x = [], [], 0.0
+        for run, font in runs:
+            l, t, r, b = font.getbbox(run, anchor='ls')
+            boxes.append((x + l, ascent + t, x + r, ascent + b))
+            placed.append((x, run, font))
+            x += font.getlength(run)
+        left, top, right, bottom = (int(math.floor(v)) if i < 2 else int(math.ceil(v))
+                                    for i, v in enumerate(union_box(boxes)))
+    else:
+        # measure text using the chosen font
+        try:
+            left, top, right, bottom = pil_font.getbbox(text)
+        except Exception:
+            # fallback measure
+            left, top = 0, 0
+            right, bottom = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textsize(text, font=pil_font)
+    tw, th = right - left, bottom - top
+
+    # color + alpha
+    r, g, b = s.get('color', [255, 255, 255, 255])[:3]
+    alpha = int(255 * (s.get('opacity', 80) / 100.0))
+    fill = (r, g, b, alpha)
+
+    pad = TEXT_SPRITE_PAD
+    size = (max(1, tw) + 2 * pad, max(1, th) + 2 * pad)
+    sprite = Image.new('RGBA', size, (255, 255, 255, 0))
+    # 字形只栅格化一次，阴影、描边和正文都用这张覆盖度蒙版按偏移粘贴，
+    # 与逐次 draw.text 的结果逐像素相同；逐图变化的文字因此只需一次栅格化
+    mask = Image.new('L', size, 0)
+    if len(runs) > 1:
+        draw = ImageDraw.Draw(mask)
+        for x, run, font in placed:
+            draw.text((pad - left + x, pad - top + ascent), run, font=font, fill=255, anchor='ls')
+    else:
+        ImageDraw.Draw(mask).text((pad - left, pad - top), text, font=pil_font, fill=255)
+    # draw shadow/outline
+    if s.get('shadow'):
+        shadow_color = (0, 0, 0, int(alpha * 0.6))
+        shadow_off = max(1, int(round(2 * px_scale)))
+        _paste_shifted(sprite, shadow_color, mask, shadow_off, shadow_off)
+    if s.get('stroke'):
+        stroke_color = (0, 0, 0, alpha)
+        offsets = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+        for ox, oy in offsets:
+            _paste_shifted(sprite, stroke_color, mask, ox, oy)
+    sprite.paste(fill, (0, 0), mask)
+    return sprite, left, top, tw, th
+
+
+def _paste_shifted(im, color, mask, dx, dy):
+    # 把 mask 平移 (dx, dy) 后作为蒙版在 im 上填充 color，超出边界的部分裁掉
+    w, h = mask.size
+    mask = mask.crop((max(0, -dx), max(0, -dy), min(w, w - dx), min(h, h - dy)))
+    x, y = max(0, dx), max(0, dy)
+    im.paste(color, (x, y, x + mask.width, y + mask.height), mask)
+
+
+def render_image_sprite(s, base_w):
+    """按设置缩放图片水印（宽度为底图宽度的 img_scale%），未旋转、未应用透明度；无可用水印图时返回 None。"""
+    wm_path = s.get('wm_image')
+    if not wm_path or not os.path.exists(wm_path):
+        return None
+    # scale to width percent
+    target_w = max(1, int(base_w * (s.get('img_scale', 20) / 100.0)))
+    return _scaled_wm_image(wm_path, os.path.getmtime(wm_path), target_w, s.get('resample', 'LANCZOS'))
+
+
+@functools.lru_cache(maxsize=16)
+def _scaled_wm_image(path, mtime, target_w, resample='LANCZOS'):
+    # 同一批导出中同宽度的底图共用缩放结果；返回值只读。resample 为导出配置的滤波名
+    wim = _load_wm_image(path, mtime)
+    ratio = target_w / wim.width
+    new_size = (max(1, int(wim.width * ratio)), max(1, int(wim.height * ratio)))
+    return wim.resize(new_size, getattr(Image, resample))
+
+
+TEXT_SPRITE_KEYS = ('text', 'font', 'font_size', 'bold', 'italic', 'color', 'opacity', 'shadow', 'stroke')
+
+
+def cached_text_sprite(s, px_scale=1.0):
+    """render_text_sprite 的缓存版本，按文字相关设置和 px_scale 复用 sprite；返回的 sprite 只读。"""
+    key = json.dumps({k: s[k] for k in TEXT_SPRITE_KEYS if k in s}, ensure_ascii=False, sort_keys=True)
+    return _text_sprite_lru(key, px_scale)
+
+
+@functools.lru_cache(maxsize=32)
+def _text_sprite_lru(key, px_scale):
+    return render_text_sprite(json.loads(key), px_scale)
+
+
+def tile_centers(base_w, base_h, tile_w, tile_h, rot, gap_percent, stagger):
+    """平铺模式下各个水印中心点的位置。
+    网格步长为 (1 + gap%) 倍的未旋转水印尺寸，整个网格随水印一起旋转 rot 度（顺时针），
+    stagger 为 True 时奇数行错开半个步长。只返回会与底图相交的位置。"""
+    step_x = max(1.0, tile_w * (1 + gap_percent / 100.0))
+    step_y = max(1.0, tile_h * (1 + gap_percent / 100.0))
+    theta = math.radians(-rot)
+    cos_t, sin_t = math.cos(theta), math.sin(theta)
+    # 旋转后 sprite 的半宽/半高，用于判断是否与底图相交
+    half_w = (abs(tile_w * cos_t) + abs(tile_h * sin_t)) / 2
+    half_h = (abs(tile_w * sin_t) + abs(tile_h * cos_t)) / 2
+    radius = math.hypot(base_w, base_h) / 2 + max(half_w, half_h)
+    nx = int(radius / step_x) + 2
+    ny = int(radius / step_y) + 2
+    cx0, cy0 = base_w / 2, base_h / 2
+    centers = []
+    for j in range(-ny, ny + 1):
+        shift = step_x / 2 if (stagger and j % 2) else 0.0
+        for i in range(-nx, nx + 1):
+            dx, dy = i * step_x + shift, j * step_y
+            cx = cx0 + dx * cos_t + dy * sin_t
+            cy = cy0 - dx * sin_t + dy * cos_t
+            if -half_w < cx < base_w + half_w and -half_h < cy < base_h + half_h:
+                centers.append((cx, cy))
+    return centers
+
+
+def _stamp_tiled(base, sprite, rot, opacity, gap_percent, stagger, dirty=None):
+    """平铺模式：sprite 只旋转一次，然后按网格批量盖章到 base 上。"""
+    centers = tile_centers(base.width, base.height, sprite.width, sprite.height, rot, gap_percent, stagger)
+    tile = sprite.rotate(-rot, expand=1, resample=Image.BICUBIC) if rot else sprite
+    positions = [(int(round(cx - tile.width / 2)), int(round(cy - tile.height / 2))) for cx, cy in centers]
+    return stamp_sprite(base, tile, positions, opacity, dirty)
+
+
+def settings_layers(s: dict):
+    """设置中的图层列表（自下而上）；旧版单水印设置视为只有一个图层。"""
+    return s.get('layers') or [s]
+
+
+def render_watermark(base_im: Image.Image, s: dict, px_scale=1.0) -> Image.Image:
+    """按设置字典 s 把所有水印图层依次合成到 base_im 的同一个副本上并返回。
+    px_scale 为 base_im 相对原图的缩放比例（预览代理图），文字字号等像素量随之缩放。"""
+    # RGB/RGBA 底图直接在副本上原地合成，其它模式统一转为 RGBA
+    if base_im.mode in ('RGB', 'RGBA'):
+        base = base_im.copy()
+    else:
+        base = base_im.convert('RGBA')
+    for layer in settings_layers(s):
+        base = composite_layer(base, layer, px_scale)
+    return base
+
+
+def resolve_auto(base: Image.Image, s: dict, px_scale=1.0) -> dict:
+    """按 base 的内容把图层 s 的自动位置/自动颜色换成具体的预设和颜色，返回新的设置；
+    没有自动项时原样返回 s。动图只在第一帧上解析一次，各帧的水印位置和颜色因此保持一致。"""
+    is_text = s.get('type', '文本水印') == '文本水印'
+    pos_key = 'pos' if is_text else 'img_pos'
+    drag_pos = s.get('drag_pos')
+    auto_pos = s.get(pos_key) == AUTO_PRESET and drag_pos is None
+    auto_color = is_text and s.get('auto_color') and s.get('pos') != TILE_PRESET
+    if not (auto_pos or auto_color):
+        return s
+    w, h = base.size
+    pad = 10 * px_scale
+    if is_text:
+        tw, th = cached_text_sprite(s, px_scale)[3:]
+    else:
+        wim = render_image_sprite(s, w)
+        if wim is None:
+            return s
+        rot = s.get('img_rotate', 0)
+        tw, th = wim.rotate(-rot, expand=1).size if rot != 0 else wim.size
+    stats = RegionStats(base)
+    s = dict(s, auto_color=False)
+    if auto_pos:
+        s[pos_key] = stats.best_preset(tw, th, pad)
+    if auto_color:
+        if drag_pos is not None:
+            x, y = int(drag_pos[0] * w), int(drag_pos[1] * w)
+        else:
+            x, y = calc_preset_position(w, h, tw, th, s['pos'], pad)
+        # 颜色不影响排版，换色后的 sprite 尺寸和偏移不变
+        s['color'] = contrast_color(stats.stats(x, y, tw, th)[0], s.get('color', [255, 255, 255, 255]))
+    return s
+
+
+def composite_layer(base: Image.Image, s: dict, px_scale=1.0, dirty=None) -> Image.Image:
+    """把单个图层 s 原地合成到 base (RGB/RGBA) 上并返回 base。
+    s['drag_pos'] 为预览中拖拽得到的位置，以图像宽度归一化的 (x, y)；为空时使用预设位置。
+    dirty 为列表时追加被修改的底图区域，供预览做局部刷新。"""
+    w, h = base.size
+    drag_pos = s.get('drag_pos')
+    pad = 10 * px_scale
+
+    if s.get('type', '文本水印') == '文本水印':
+        s = resolve_auto(base, s, px_scale)
+        sprite, left, top, tw, th = cached_text_sprite(s, px_scale)
+        rot = s.get('rotate', 0)
+        if s.get('pos') == TILE_PRESET:
+            return _stamp_tiled(base, sprite, rot, 1.0, s.get('tile_gap', 50), s.get('tile_stagger', True), dirty)
+        # 检查是否有拖拽后的位置，如果有则使用，否则使用预设位置
+        if drag_pos is not None:
+            x, y = int(drag_pos[0] * w), int(drag_pos[1] * w)
+        else:
+            x, y = calc_preset_position(w, h, tw, th, s.get('pos', '居中'), pad)
+        sx, sy = x + left - TEXT_SPRITE_PAD, y + top - TEXT_SPRITE_PAD
+        # rotation
+        if rot != 0:
+            # 原实现是绕整张图的中心旋转 overlay，这里等价地把 sprite 绕自身中心旋转，
+            # 再把它的中心绕图像中心旋转到新位置
+            # 反转旋转角度的符号以匹配Qt的顺时针旋转方向
+            theta = math.radians(-rot)
+            cx, cy = sx + sprite.width / 2 - w / 2, sy + sprite.height / 2 - h / 2
+            ncx = cx * math.cos(theta) + cy * math.sin(theta) + w / 2
+            ncy = -cx * math.sin(theta) + cy * math.cos(theta) + h / 2
+            sprite = sprite.rotate(-rot, expand=1)
+            sx, sy = int(round(ncx - sprite.width / 2)), int(round(ncy - sprite.height / 2))
+        return blend_over(base, sprite, (sx, sy), dirty=dirty)
+
+    # 图片水印
+    try:
+        s = resolve_auto(base, s, px_scale)
+        wim = render_image_sprite(s, w)
+        if wim is None:
+            return base
+        # 透明度在混合时与 alpha 一并处理
+        opacity = s.get('img_opacity', 80) / 100.0
+        rot = s.get('img_rotate', 0)
+        if s.get('img_pos') == TILE_PRESET:
+            return _stamp_tiled(base, wim, rot, opacity, s.get('img_tile_gap', 50), s.get('img_tile_stagger', True),
+                                dirty)
+        if rot != 0:
+            # 反转旋转角度的符号以匹配Qt的顺时针旋转方向
+            wim = wim.rotate(-rot, expand=1)
+        # position
+        tw, th = wim.size
+        if drag_pos is not None:
+            x, y = int(drag_pos[0] * w), int(drag_pos[1] * w)
+        else:
+            x, y = calc_preset_position(w, h, tw, th, s.get('img_pos', '居中'), pad)
+        return blend_over(base, wim, (int(x), int(y)), opacity, dirty)
+    except Exception as e:
+        print('图片水印应用失败', e)
+        return base
+
+
+def union_box(boxes):
+    """多个 (l, t, r, b) 区域的外接矩形，没有区域时返回 None。"""
+    boxes = [b for b in boxes if b]
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+class ProxyRenderer:
+    """所见即所得预览：在缩小的代理图上用导出引擎渲染全部图层。
+    每次渲染只把上次水印覆盖的区域从干净的代理图恢复，再原地合成，
+    返回本次变化的区域，界面只需重绘这一块。"""
+
+    def __init__(self, full_image: Image.Image, max_side: int):
+        scale = min(1.0, max_side / max(full_image.size))
+        if scale < 1.0:
+            size = (max(1, round(full_image.width * scale)), max(1, round(full_image.height * scale)))
+            proxy = full_image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+        else:
+            proxy = full_image
+        if proxy.mode not in ('RGB', 'RGBA'):
+            proxy = proxy.convert('RGBA')
+        self.scale = proxy.width / source_size(full_image)[0]
+        self.clean = proxy
+        self.composite = proxy.copy()
+        self._last_box = None
+        self._last_hash = None
+
+    def render(self, settings: dict):
+        """按 settings 重新合成，返回变化区域 (l, t, r, b)；设置未变或无变化时返回 None。"""
+        h = settings_hash(settings)
+        if h == self._last_hash:
+            return None
+        self._last_hash = h
+        old = self._last_box
+        if old:
+            self.composite.paste(self.clean.crop(old), old[:2])
+        boxes = []
+        for layer in settings_layers(settings):
+            composite_layer(self.composite, layer, self.scale, boxes)
+        self._last_box = union_box(boxes)
+        return union_box([old, self._last_box])
+
+
+# --------------------------- Text fields ---------------------------
+# 文字水印可以包含按图片替换的字段：{filename}（不含扩展名的文件名）、{exif.标签名}、{csv.列名}。
+# 批量清单是 CSV 文件，按 filename 列（没有时用第一列）与源图的完整路径、文件名或不含扩展名的文件名对应。
+
+TEXT_FIELD_RE = re.compile(r'\{(filename|exif\.\w+|csv\.[^{}]+)\}')
+EXIF_IFD = 0x8769  # DateTimeOriginal、曝光参数等位于 Exif 子 IFD
+
+
+@functools.lru_cache(maxsize=4)
+def load_manifest(path, mtime):
+    # mtime 参与缓存键，清单被修改后会重新读取
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        key = 'filename' if 'filename' in fields else (fields[0] if fields else '')
+        return {row.get(key) or '': row for row in reader}
+
+
+def manifest_row(manifest, src):
+    if not manifest or not os.path.exists(manifest):
+        return {}
+    rows = load_manifest(manifest, os.path.getmtime(manifest))
+    base = source_name(src)
+    return rows.get(src) or rows.get(base) or rows.get(os.path.splitext(base)[0]) or {}
+
+
+def exif_fields(im):
+    """EXIF 标签名 -> 值，包含 Exif 子 IFD。"""
+    exif = im.getexif()
+    out = {}
+    for ifd in (exif, exif.get_ifd(EXIF_IFD)):
+        for tag, value in ifd.items():
+            name = ExifTags.TAGS.get(tag)
+            if name:
+                out[name] = value.decode('utf-8', 'replace').rstrip('\0') if isinstance(value, bytes) else value
+    return out
+
+
+def resolve_text(template, src, im=None, manifest=None):
+    """把文字模板中的字段替换为 src 对应的值，找不到的字段替换为空串。"""
+    sources = {}
+
+    def field(m):
+        name = m.group(1)
+        if name == 'filename':
+            return os.path.splitext(source_name(src))[0]
+        kind, key = name.split('.', 1)
+        if kind not in sources:
+            if kind == 'exif':
+                sources[kind] = exif_fields(im) if im is not None else {}
+            else:
+                sources[kind] = manifest_row(manifest, src)
+        value = sources[kind].get(key)
+        return '' if value is None else str(value)
+
+    return TEXT_FIELD_RE.sub(field, template)
+
+
+def resolve_settings(s, src, im=None, manifest=None):
+    """返回各文字图层的字段已按 src 替换的设置副本；不含字段时原样返回 s。"""
+    if not any(TEXT_FIELD_RE.search(layer.get('text') or '') for layer in settings_layers(s)):
+        return s
+    resolved = dict(s, text=resolve_text(s.get('text') or '', src, im, manifest))
+    if s.get('layers'):
+        resolved['layers'] = [dict(layer, text=resolve_text(layer.get('text') or '', src, im, manifest))
+                              for layer in s['layers']]
+    return resolved
+
+
+# --------------------------- Export ---------------------------
+# 单张导出 export_one 只依赖设置字典和导出选项，可以在工作线程中并发执行；
+# plan_export 只读取文件头估算每张图的像素、内存和耗时，ExportPipeline 按内存预算调度。
+
+# 估算用的经验值：解码 + 合成 + 缩放/编码过程中同时存在约 3 份 RGBA 大小的缓冲
+MEMORY_FACTOR = 3 * 4
+# 每百万像素的处理耗时（秒），仅用于导出前的预估；导出过程中的剩余时间按实测速度计算
+SECONDS_PER_MP = 0.05
+DEFAULT_MEMORY_BUDGET_MB = 2048
+
+
+def output_name(src, opts):
+    """按命名规则和输出格式得到输出文件名（不含目录）。"""
+    base_name, ext = os.path.splitext(source_name(src))
+    rule = opts.get('name_rule', '保留原文件名')
+    extra = opts.get('name_extra', '')
+    if rule == '保留原文件名':
+        name = base_name
+    elif rule == '添加前缀':
+        name = f'{extra}{base_name}' if extra else f'wm_{base_name}'
+    else:
+        name = f'{base_name}{extra}' if extra else f'{base_name}_watermarked'
+    # format choice
+    format_choice = opts.get('format', '保持原格式')
+    if format_choice == '保持原格式':
+        out_ext = ext.lower()
+    elif format_choice == 'JPEG':
+        out_ext = '.jpg'
+    elif format_choice == 'WebP':
+        out_ext = '.webp'
+    else:
+        out_ext = '.png'
+    return name, out_ext
+
+
+class OutputPathReserver:
+    """导出到文件夹：为并发导出分配不重名的输出路径（已存在或已被其它任务占用时追加 _1、_2…）并写入。
+    overwrite 为 True 时不避让已存在的文件，同一源图总是写到同一路径（分布式工作进程重跑任务时用）。
+    文件先写临时文件再改名，读者和并发写入者都不会看到写了一半的文件。"""
+
+    def __init__(self, out_folder='', overwrite=False):
+        self.out_folder = out_folder
+        self.overwrite = overwrite
+        self._lock = threading.Lock()
+        self._reserved = set()
+
+    def folder(self, subfolder=''):
+        folder = os.path.join(self.out_folder, subfolder)
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def reserve(self, folder, name, ext):
+        with self._lock:
+            path = os.path.join(folder, name + ext)
+            i = 1
+            while (not self.overwrite and os.path.exists(path)) or path in self._reserved:
+                path = os.path.join(folder, f'{name}_{i}{ext}')
+                i += 1
+            self._reserved.add(path)
+            return path
+
+    @contextlib.contextmanager
+    def open(self, path):
+        """以可读写、可 seek 的文件对象（TIFF 编码器会读回已写的部分）写入 path，正常退出时才改名到位。"""
+        tmp = f'{path}.{socket.gethostname()}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w+b') as f:
+                yield f
+        except BaseException:
+            os.remove(tmp)
+            raise
+        os.replace(tmp, path)
+
+    def write(self, path, data):
+        with self.open(path) as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+# 已压缩的格式在 ZIP 中用存储模式，再压缩一遍只会浪费 CPU
+STORED_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+
+
+class ZipOutput:
+    """导出到 ZIP：每个输出编码完成后立即作为一个成员写入压缩包，不落地临时文件。
+    接口与 OutputPathReserver 相同，路径为压缩包内的成员名。
+    压缩包先写到同目录的临时文件，close 时改名为 zip_path，已有的同名压缩包被整体替换。"""
+
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self._tmp_path = f'{zip_path}.{socket.gethostname()}.{os.getpid()}.tmp'
+        self._zip = zipfile.ZipFile(self._tmp_path, 'w', allowZip64=True)
+        self._lock = threading.Lock()
+        self._reserved = set()
+
+    def folder(self, subfolder=''):
+        return subfolder.replace(os.sep, '/').strip('/')
+
+    def reserve(self, folder, name, ext):
+        prefix = f'{folder}/' if folder else ''
+        with self._lock:
+            path = f'{prefix}{name}{ext}'
+            i = 1
+            while path in self._reserved:
+                path = f'{prefix}{name}_{i}{ext}'
+                i += 1
+            self._reserved.add(path)
+            return path
+
+    @contextlib.contextmanager
+    def open(self, path):
+        """与 OutputPathReserver.open 相同的接口。TIFF 等编码器需要 seek，ZIP 成员流不支持，
+        因此先写入内存再作为成员写入。"""
+        buf = io.BytesIO()
+        yield buf
+        self.write(path, buf.getvalue())
+
+    def write(self, path, data):
+        info = zipfile.ZipInfo(path, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED if path.lower().endswith(STORED_EXTS) else zipfile.ZIP_DEFLATED
+        with self._lock:
+            self._zip.writestr(info, data)
+
+    def close(self):
+        self._zip.close()
+        os.replace(self._tmp_path, self.zip_path)
+
+
+EXPORT_ZIP_NAME = 'watermarked.zip'
+EXPORT_REPORT_NAME = 'export_report.csv'
+
+
+def make_output(opts):
+    """按导出选项创建输出目标：opts['zip_output'] 非空时写入该 ZIP，否则写入 out_folder。
+    opts['overwrite'] 为真时输出文件夹中的同名文件被覆盖而不是追加 _1。"""
+    if opts.get('zip_output'):
+        return ZipOutput(opts['zip_output'])
+    return OutputPathReserver(opts['out_folder'], overwrite=bool(opts.get('overwrite')))
+
+
+def unique_path(path):
+    """path 已存在时追加 _1、_2… 直到不重名。"""
+    stem, ext = os.path.splitext(path)
+    i = 1
+    while os.path.exists(path):
+        path = f'{stem}_{i}{ext}'
+        i += 1
+    return path
+
+
+RESIZE_MODES = ['不变', '按宽度', '按高度', '按长边', '按百分比']
+FORMATS = ['保持原格式', 'JPEG', 'PNG', 'WebP']
+
+
+def export_target_size(w, h, resize_mode, size_value):
+    """按尺寸规则计算输出尺寸。"""
+    if resize_mode == '按宽度':
+        return size_value, max(1, int(h * (size_value / w)))
+    if resize_mode == '按高度':
+        return max(1, int(w * (size_value / h))), size_value
+    if resize_mode == '按长边':
+        k = size_value / max(w, h)
+        return max(1, int(w * k)), max(1, int(h * k))
+    if resize_mode == '按百分比':
+        return max(1, int(w * size_value / 100.0)), max(1, int(h * size_value / 100.0))
+    return w, h
+
+
+def export_renditions(opts):
+    """导出选项中的输出版本列表。每个版本是一个字典：
+    resize_mode / size_value / format / quality / suffix（追加到文件名）/ subfolder（输出目录下的子目录）/
+    max_kb（JPEG/WebP 的文件大小上限，0 为不限，此时 quality 作为搜索的上限）。
+    没有配置 renditions 时退化为单一版本，即界面上的尺寸与格式设置。"""
+    renditions = opts.get('renditions')
+    if renditions:
+        return renditions
+    return [{
+        'resize_mode': opts.get('resize_mode', '不变'),
+        'size_value': opts.get('size_value', 100),
+        'format': opts.get('format', '保持原格式'),
+        'quality': opts.get('jpeg_quality', 90),
+        'max_kb': opts.get('target_kb', 0),
+        'suffix': '',
+        'subfolder': '',
+    }]
+
+
+# PNG 多线程编码：按行分块，各块在线程池中独立滤波并压缩成不带结尾的 raw deflate 片段
+# （Z_SYNC_FLUSH 使片段按字节对齐），拼接后加上 zlib 头和合并出的 adler32 即为合法的 IDAT 流。
+# 每块用上一块末尾 32 KB 作为预设字典，压缩率与整体压缩接近。zlib 和 numpy 在这些操作中释放 GIL。
+PNG_FILTERS = {'自适应': 'adaptive', '无': 'none', 'Sub': 'sub', 'Up': 'up', 'Average': 'avg', 'Paeth': 'paeth'}
+PNG_FILTER_TYPES = {'none': 0, 'sub': 1, 'up': 2, 'avg': 3, 'paeth': 4}
+PNG_DEFAULT_LEVEL = 6
+PNG_DEFAULT_FILTER = '自适应'
+PNG_CHUNK_BYTES = 1 << 20  # 每个并行压缩块的大致字节数
+PNG_COLOR_TYPES = {'L': (0, 1), 'LA': (4, 2), 'RGB': (2, 3), 'RGBA': (6, 4)}  # 模式 -> (颜色类型, 每像素字节)
+ZLIB_WINDOW = 32768
+
+
+@functools.lru_cache(maxsize=1)
+def _encode_pool():
+    # 所有并发的 PNG 编码共用一个线程池，流水线的多个编码线程不会把线程数放大成 workers²
+    return concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='png')
+
+
+def adler32_combine(adler1, adler2, len2):
+    """已知两段数据各自的 adler32 和第二段的长度，得到拼接后的 adler32（同 zlib 的 adler32_combine）。"""
+    base = 65521
+    rem = len2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % base
+    sum1 += (adler2 & 0xFFFF) + base - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + base - rem
+    sum1 = sum1 % base
+    sum2 = sum2 % base
+    return sum1 | (sum2 << 16)
+
+
+def _png_filter_rows(rows, prev, bpp, method):
+    """对 rows (行数 x 行字节) 做 PNG 滤波，prev 为上一行（首行为 None），返回带滤波类型字节的数据。
+    各滤波器只依赖原始像素，整块一次向量化计算（uint8 运算自然按 256 取模）；
+    自适应按每行绝对值和（视为有符号字节）最小选择。"""
+    x = rows
+    up = np.empty_like(x)
+    up[0] = 0 if prev is None else prev
+    up[1:] = x[:-1]
+    left = np.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+
+    def paeth():
+        ul = np.zeros_like(x)
+        ul[:, bpp:] = up[:, :-bpp]
+        a, b, c = left.astype(np.int16), up.astype(np.int16), ul.astype(np.int16)
+        pa, pb, pc = np.abs(b - c), np.abs(a - c), np.abs(a + b - 2 * c)
+        return x - np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, ul))
+
+    makers = {'none': lambda: x, 'sub': lambda: x - left, 'up': lambda: x - up,
+              'avg': lambda: x - ((left >> 1) + (up >> 1) + (left & up & 1)), 'paeth': paeth}
+    names = list(PNG_FILTER_TYPES) if method == 'adaptive' else [method]
+    out = np.empty((x.shape[0], x.shape[1] + 1), np.uint8)
+    if len(names) == 1:
+        out[:, 0] = PNG_FILTER_TYPES[names[0]]
+        out[:, 1:] = makers[names[0]]()
+        return out
+    stack = np.stack([makers[n]() for n in names])
+    # |int8| 转回 uint8 后 -128 恰好对应 128
+    scores = np.abs(stack.view(np.int8)).view(np.uint8).sum(axis=2, dtype=np.uint32)
+    best = scores.argmin(axis=0)
+    out[:, 0] = np.array([PNG_FILTER_TYPES[n] for n in names], np.uint8)[best]
+    out[:, 1:] = stack[best, np.arange(x.shape[0])]
+    return out
+
+
+def _png_compress_chunk(pixels, r0, r1, bpp, method, level, last):
+    # 返回 (压缩片段, 该块滤波后数据的 adler32, 长度)；字典取上一块末尾的滤波数据，重新计算即可得到相同字节
+    stride = pixels.shape[1] + 1
+    data = _png_filter_rows(pixels[r0:r1], pixels[r0 - 1] if r0 else None, bpp, method).tobytes()
+    comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+    if r0:
+        d0 = max(0, r0 - -(-ZLIB_WINDOW // stride))
+        zdict = _png_filter_rows(pixels[d0:r0], pixels[d0 - 1] if d0 else None, bpp, method).tobytes()
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict[-ZLIB_WINDOW:])
+    out = comp.compress(data) + comp.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return out, zlib.adler32(data), len(data)
+
+
+def _png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+
+PNG_NON_TEXT_INFO = ('compression',)  # TIFF/TGA 源图 info 中的字符串项，不是文本元数据
+
+
+def _png_text_chunk(key, value):
+    # 能用 Latin-1 表示的写 tEXt，否则写 UTF-8 的 iTXt；关键字本身必须是 1~79 字节的 Latin-1
+    try:
+        keyword = key.encode('latin-1')
+    except UnicodeEncodeError:
+        return None
+    if not 0 < len(keyword) < 80:
+        return None
+    try:
+        return b'tEXt', keyword + b'\0' + value.encode('latin-1')
+    except UnicodeEncodeError:
+        lang = getattr(value, 'lang', None) or ''
+        tkey = getattr(value, 'tkey', None) or ''
+        return b'iTXt', (keyword + b'\0\0\0' + lang.encode('latin-1', 'ignore') + b'\0'
+                         + tkey.encode('utf-8') + b'\0' + value.encode('utf-8'))
+
+
+def _png_metadata_chunks(im):
+    """im.info 中要随 PNG 写出的辅助块 [(类型, 数据)]：gAMA、sRGB 与文本（Pillow 读入 PNG 时
+    把 tEXt/zTXt/iTXt 放在 info 的字符串项中）。iCCP、tRNS 和 pHYs 另行处理，
+    Pillow 编码时前两者自己从 info 读取，pHYs 只能通过 dpi 参数给出。"""
+    info = im.info
+    chunks = []
+    if info.get('gamma'):
+        chunks.append((b'gAMA', struct.pack('>I', int(info['gamma'] * 100000 + 0.5))))
+    if 'srgb' in info and not info.get('icc_profile'):  # 两者同时出现时以 ICC 为准
+        chunks.append((b'sRGB', bytes((info['srgb'],))))
+    for key, value in info.items():
+        if isinstance(key, str) and isinstance(value, str) and key not in PNG_NON_TEXT_INFO:
+            chunk = _png_text_chunk(key, value)
+            if chunk:
+                chunks.append(chunk)
+    return chunks
+
+
+def _png_transparency(im):
+    # L/RGB 模式的单一透明色（tRNS），RGBA/LA 自带 alpha，不写
+    t = im.info.get('transparency')
+    if t is None or im.mode not in ('L', 'RGB'):
+        return None
+    if im.mode == 'L':
+        return struct.pack('>H', t) if isinstance(t, int) else None
+    return struct.pack('>HHH', *t) if isinstance(t, tuple) and len(t) == 3 else None
+
+
+def _pillow_png(im, level):
+    # Pillow 单线程编码。它只写 info 中的 iCCP/tRNS，分辨率和其余辅助块需要显式传入；
+    # 滤波方式由 Pillow 自行选择，不支持 filter_name
+    from PIL import PngImagePlugin
+    pnginfo = PngImagePlugin.PngInfo()
+    for tag, data in _png_metadata_chunks(im):
+        pnginfo.add(tag, data)
+    buf = io.BytesIO()
+    params = {'dpi': im.info['dpi']} if im.info.get('dpi') else {}
+    im.save(buf, 'PNG', compress_level=level, pnginfo=pnginfo, **params)
+    return buf.getvalue()
+
+
+def encode_png(im, level=PNG_DEFAULT_LEVEL, filter_name=PNG_DEFAULT_FILTER):
+    """多线程 PNG 编码，返回字节串。ICC、透明色、gamma、分辨率和文本元数据随 im.info 写出。
+    没有 numpy 或模式不是 L/LA/RGB/RGBA 时交给 Pillow 单线程编码，此时忽略 filter_name。"""
+    if get_numpy() is None or im.mode not in PNG_COLOR_TYPES:
+        return _pillow_png(im, level)
+    color_type, bpp = PNG_COLOR_TYPES[im.mode]
+    w, h = im.size
+    pixels = np.asarray(im).reshape(h, w * bpp)
+    method = PNG_FILTERS.get(filter_name, 'adaptive')
+    rows = max(1, PNG_CHUNK_BYTES // (w * bpp + 1))
+    bounds = [(r, min(h, r + rows)) for r in range(0, h, rows)]
+    futures = [_encode_pool().submit(_png_compress_chunk, pixels, r0, r1, bpp, method, level, r1 == h)
+               for r0, r1 in bounds]
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    flg = flevel << 6
+    flg += 31 - (0x78 * 256 + flg) % 31
+    parts = [_png_chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, color_type, 0, 0, 0))]
+    icc = im.info.get('icc_profile')
+    if icc:
+        parts.append(_png_chunk(b'iCCP', b'ICC Profile\0\0' + zlib.compress(icc)))
+    trns = _png_transparency(im)
+    if trns:
+        parts.append(_png_chunk(b'tRNS', trns))
+    dpi = im.info.get('dpi')
+    if dpi:
+        parts.append(_png_chunk(b'pHYs', struct.pack('>IIB', int(dpi[0] / 0.0254 + 0.5), int(dpi[1] / 0.0254 + 0.5), 1)))
+    parts += [_png_chunk(tag, data) for tag, data in _png_metadata_chunks(im)]
+    adler = 1
+    for i, future in enumerate(futures):
+        data, chunk_adler, length = future.result()
+        adler = adler32_combine(adler, chunk_adler, length)
+        if i == 0:
+            data = bytes((0x78, flg)) + data
+        if i == len(futures) - 1:
+            data += struct.pack('>I', adler)
+        parts.append(_png_chunk(b'IDAT', data))
+    parts.append(_png_chunk(b'IEND', b''))
+    return b'\x89PNG\r\n\x1a\n' + b''.join(parts)
+
+
+# 导出配置：一次选定缩放滤波与 reducing_gap（先整数倍 reduce 到目标的 gap 倍再精细缩放）、
+# JPEG 的 draft 余量（DCT 域缩小解码到目标的 draft 倍以上，None 为完整解码）、PNG 压缩级别与滤波、
+# JPEG 色度抽样（0 = 4:4:4，2 = 4:2:0，-1 为 Pillow 默认的 4:2:0）和 optimize（多一遍哈夫曼表优化）。
+# 默认的“均衡”与引入导出配置之前的输出逐字节相同；draft 缩小解码和 reducing_gap 会改变像素，只用于“草稿”
+EXPORT_PROFILES = {
+    '草稿': {'resample': 'BILINEAR', 'reducing_gap': 2.0, 'draft': 1.0, 'png_level': 1, 'png_filter': 'Sub',
+           'jpeg_subsampling': 2, 'jpeg_optimize': False},
+    '均衡': {'resample': 'LANCZOS', 'reducing_gap': None, 'draft': None, 'png_level': PNG_DEFAULT_LEVEL,
+           'png_filter': PNG_DEFAULT_FILTER, 'jpeg_subsampling': -1, 'jpeg_optimize': False},
+    '最佳': {'resample': 'LANCZOS', 'reducing_gap': None, 'draft': None, 'png_level': 9,
+           'png_filter': PNG_DEFAULT_FILTER, 'jpeg_subsampling': 0, 'jpeg_optimize': True},
+}
+DEFAULT_EXPORT_PROFILE = '均衡'
+
+
+def export_profile(opts):
+    """导出选项 opts 中 export_profile 对应的配置；未设置或无法识别时为默认配置。"""
+    return EXPORT_PROFILES.get((opts or {}).get('export_profile'), EXPORT_PROFILES[DEFAULT_EXPORT_PROFILE])
+
+
+def profile_resize(im, size, profile):
+    """按导出配置的滤波和 reducing_gap 缩放。"""
+    return im.resize(size, getattr(Image, profile['resample']), reducing_gap=profile['reducing_gap'])
+
+
+def with_resample(settings, profile):
+    # 把配置的缩放滤波写进各图层，图片水印缩放时使用；默认 LANCZOS 时原样返回，不影响缓存键
+    if profile['resample'] == 'LANCZOS':
+        return settings
+    return {'layers': [dict(layer, resample=profile['resample']) for layer in settings_layers(settings)]}
+
+
+LOSSY_EXTS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.webp': 'WEBP'}
+MIN_SEARCH_QUALITY = 10
+MAX_SIZE_ENCODES = 8  # 先试上限 1 次，再对 10~94 二分 7 次即可精确到 1
+
+
+def encode_image(im, out_path, quality=90, opts=None) -> bytes:
+    """按输出路径的扩展名把图像编码为字节串（JPEG 转为 RGB；JPEG/WebP 使用 quality；PNG 多线程编码）。
+    JPEG 色度抽样/optimize 取自导出配置；PNG 压缩级别和滤波优先取 opts 中的 png_level/png_filter。"""
+    if isinstance(im, FrameSequence):
+        return im.encode(out_path, quality)
+    opts = opts or {}
+    profile = export_profile(opts)
+    buf = io.BytesIO()
+    ext = os.path.splitext(out_path)[1].lower()
+    if ext in ('.jpg', '.jpeg'):
+        # convert to RGB；已是 RGB 时不再复制（encode_to_size 的每次尝试都会走到这里）
+        if im.mode != 'RGB':
+            im = im.convert('RGB')
+        im.save(buf, 'JPEG', quality=quality, subsampling=profile['jpeg_subsampling'], optimize=profile['jpeg_optimize'])
+    elif ext == '.webp':
+        im.save(buf, 'WEBP', quality=quality)
+    elif ext == '.png':
+        return encode_png(im, opts.get('png_level', profile['png_level']), opts.get('png_filter', profile['png_filter']))
+    else:
+        im.save(buf, Image.registered_extensions().get(ext, 'PNG'))
+    return buf.getvalue()
+
+
+def encode_to_size(im, out_path, max_bytes, max_quality=95, max_encodes=MAX_SIZE_ENCODES, opts=None):
+    """在内存中二分搜索满足 max_bytes 的最高质量，返回 (数据, 质量, 是否满足上限)。
+    先试 max_quality，满足就直接返回；最多编码 max_encodes 次。
+    所有质量都超限时返回试过的最低质量的结果。"""
+    if os.path.splitext(out_path)[1].lower() in ('.jpg', '.jpeg') and im.mode != 'RGB':
+        im = im.convert('RGB')  # 只转换一次，各次尝试共用
+    data = encode_image(im, out_path, max_quality, opts)
+    if len(data) <= max_bytes:
+        return data, max_quality, True
+    best = None
+    smallest = (data, max_quality)
+    lo, hi = MIN_SEARCH_QUALITY, max_quality - 1
+    for _ in range(max_encodes - 1):
+        if lo > hi:
+            break
+        q = (lo + hi) // 2
+        data = encode_image(im, out_path, q, opts)
+        if len(data) <= max_bytes:
+            best = (data, q)
+            lo = q + 1
+        else:
+            smallest = (data, q)
+            hi = q - 1
+    if best is not None:
+        return best[0], best[1], True
+    return smallest[0], smallest[1], False
+
+
+def encode_rendition(im, out_path, r, opts=None):
+    """按输出版本 r 编码，返回 (数据, 实际质量, 是否满足大小上限)。编码参数另见 encode_image 的 opts。"""
+    quality = r.get('quality', 90)
+    max_kb = r.get('max_kb', 0)
+    if max_kb and os.path.splitext(out_path)[1].lower() in LOSSY_EXTS:
+        return encode_to_size(im, out_path, max_kb * 1024, quality, opts=opts)
+    return encode_image(im, out_path, quality, opts), quality, True
+
+
+REPORT_FIELDS = ('source', 'output', 'bytes', 'quality', 'max_kb', 'within_limit')
+
+
+def write_report(path, rows):
+    """把导出记录写成 CSV（utf-8-sig，Excel 可直接打开）。"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _loaded(im):
+    # 非 RGB/RGBA 模式统一转为 RGBA；多帧图只解码第一帧
+    if im.mode not in ('RGB', 'RGBA'):
+        return im.convert('RGBA')
+    im.load()
     return im
 
 
+# 预览底图的像素上限：更大的图按 2 的幂缩小解码，金字塔各层都由缩小后的图生成
+PREVIEW_MAX_PIXELS = 64 * 2 ** 20
+
+
+def decode_preview(data):
+    """预览用的解码：超过 PREVIEW_MAX_PIXELS 的图缩小到上限以内，原图尺寸记在 info['source_size']。
+    JPEG 用 draft 在 DCT 域缩小解码，不产生原尺寸的像素；其它格式解码后立即 reduce，原尺寸图随即释放。"""
+    im = Image.open(io.BytesIO(data))
+    w, h = im.size
+    f = 1
+    while math.ceil(w / f) * math.ceil(h / f) > PREVIEW_MAX_PIXELS:
+        f *= 2
+    if f == 1:
+        return _loaded(im)
+    if im.format == 'JPEG':
+        im.draft(im.mode, (math.ceil(w / f), math.ceil(h / f)))  # 最多缩小到 1/8，余下的由 reduce 完成
+    im = _loaded(im)
+    rest = max(1, round(im.width * f / w))
+    if rest > 1:
+        im = im.reduce(rest)
+    im.info['source_size'] = (w, h)
+    return im
+
+
+def source_size(im):
+    """im 对应的原图尺寸：缩小解码（draft 或预览缩小）的图记在 info['source_size'] 中。"""
+    return im.info.get('source_size', im.size)
+
+
+def decode_source(data, opts=None):
+    """导出用的解码：单帧图解码为 RGB/RGBA；多帧图（动图、多页 TIFF）返回 FrameSource，编码时再逐帧解码。
+    给出导出选项 opts 时，JPEG 按导出配置的 draft 余量缩小解码，见 _draft_for_export。"""
+    im = Image.open(io.BytesIO(data))
+    if getattr(im, 'n_frames', 1) > 1:
+        return FrameSource(data, im)
+    if opts:
+        _draft_for_export(im, opts)
+    return _loaded(im)
+
+
+def _draft_for_export(im, opts):
+    # 所有输出版本都明显小于原图时，让 libjpeg 在 DCT 域按 1/2~1/8 缩小解码，得到的图像不小于
+    # 最大输出尺寸的 draft 倍。原图尺寸记在 info['source_size']，输出尺寸和水印比例仍按原图计算
+    gap = export_profile(opts)['draft']
+    if not gap or im.format != 'JPEG':
+        return
+    w, h = im.size
+    sizes = [export_target_size(w, h, r.get('resize_mode', '不变'), r.get('size_value', 100))
+             for r in export_renditions(opts)]
+    need = (math.ceil(max(s[0] for s in sizes) * gap), math.ceil(max(s[1] for s in sizes) * gap))
+    if need[0] < w and need[1] < h:
+        im.draft(im.mode, need)
+        if im.size != (w, h):
+            im.info['source_size'] = (w, h)
+
+
+# 动图和多页 TIFF 不整体解码：水印在第一帧上定位并渲染成一张叠加层，编码器每取一帧
+# 才解码、缩放并叠加这一帧。输出到文件夹时直接编码进输出文件（见 frames_to_file）。
+# 内存并不与单帧相当：源文件的字节整份留在内存里；Pillow 的 GIF/APNG 编码器为计算帧间差异
+# 保留全部已叠加的帧，WebP 编码器保留全部编码结果，只有 TIFF 逐页写出。plan_export 按帧数估算。
+MULTIFRAME_EXTS = ('.gif', '.webp', '.png', '.tif', '.tiff')  # 能保存多帧的输出格式，.png 为 APNG
+
+
+class FrameSource:
+    """多帧源图。只保存编码后的字节，每次 open() 得到独立的 Image，各输出版本可在不同线程里逐帧读取。"""
+
+    def __init__(self, data, first):
+        self.data = data
+        self.first = first  # 已打开的源图（停在第一帧），用于尺寸、EXIF 和水印定位
+        self.format = first.format
+        self.n_frames = first.n_frames
+        self._disposals = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.first.size
+
+    def open(self):
+        return Image.open(io.BytesIO(self.data))
+
+    def disposals(self):
+        """逐帧的处置方式，只在第一次调用时扫描一遍帧头（不解码像素）。"""
+        with self._lock:
+            if self._disposals is None:
+                im = self.open()
+                self._disposals = []
+                for i in range(self.n_frames):
+                    im.seek(i)
+                    # GIF 的处置方式是解码器属性，APNG 在 info 中
+                    self._disposals.append(getattr(im, 'disposal_method', im.info.get('disposal', 0)))
+            return self._disposals
+
+
+class FrameSequence:
+    """多帧源图的一个输出版本。水印按第一帧解析自动位置/颜色后渲染成叠加层，
+    所有同尺寸的帧共用这一张 sprite；尺寸不同的页（多页 TIFF）单独渲染。"""
+
+    def __init__(self, source: FrameSource, size, settings, px_scale, profile=None):
+        self.source = source
+        self.size = size
+        self.px_scale = px_scale
+        self.profile = profile or EXPORT_PROFILES[DEFAULT_EXPORT_PROFILE]
+        first = self._scaled(source.first)
+        self.settings = {'layers': [resolve_auto(first, layer, px_scale) for layer in settings_layers(settings)]}
+        overlay = render_watermark(Image.new('RGBA', size, (0, 0, 0, 0)), self.settings, px_scale)
+        box = overlay.getbbox()
+        self.sprite = overlay.crop(box) if box else None
+        self.xy = box[:2] if box else (0, 0)
+
+    def _scaled(self, frame):
+        im = frame.convert('RGBA')
+        if im.size == self.source.size:
+            size = self.size
+        else:
+            size = (max(1, round(im.width * self.px_scale)), max(1, round(im.height * self.px_scale)))
+        return im if im.size == size else profile_resize(im, size, self.profile)
+
+    def watermark(self, frame):
+        """给已 seek 到的一帧加水印，返回 RGBA 图像。"""
+        im = self._scaled(frame)
+        if im.size != self.size:
+            return render_watermark(im, self.settings, self.px_scale)
+        if self.sprite is not None:
+            blend_over(im, self.sprite, self.xy)
+        return im
+
+    def first_frame(self):
+        return self.watermark(self.source.first)
+
+    def encode(self, out_path, quality=90, fp=None):
+        """按 out_path 的扩展名编码全部帧。给出可 seek 的文件对象 fp 时写入 fp 并返回 None，否则返回字节串。"""
+        ext = os.path.splitext(out_path)[1].lower()
+        fmt = Image.registered_extensions().get(ext, 'PNG')
+        stream = _frame_stream_class()(self)
+        params = {'save_all': True}
+        if fmt in ('GIF', 'WEBP', 'PNG'):
+            # WebP 的帧时长解码后才知道；这些编码器都在 seek 到第 i 帧之后才读取 duration[i]，
+            # 因此直接传入 FrameStream 边解码边追加的列表
+            params.update(duration=stream.durations, loop=self.source.first.info.get('loop', 0))
+            # 写出的是完整合成后的帧，GIF/APNG 编码器会按处置方式计算帧间差异；
+            # Pillow 的 GIF 编码器不支持“恢复到上一帧”(3)，按“不处置”(1) 写出
+            if fmt == self.source.format == 'GIF':
+                params['disposal'] = [1 if d == 3 else d for d in self.source.disposals()]
+            elif fmt == self.source.format == 'PNG':
+                params.update(disposal=self.source.disposals(), blend=0)
+        if fmt == 'WEBP':
+            params['quality'] = quality
+        elif fmt == 'TIFF' and self.source.format == 'TIFF':
+            params['compression'] = self.source.first.info.get('compression', 'raw')
+        if fp is not None:
+            stream.save(fp, fmt, **params)
+            return None
+        buf = io.BytesIO()
+        stream.save(buf, fmt, **params)
+        return buf.getvalue()
+
+
+@functools.lru_cache(maxsize=None)
+def _frame_stream_class():
+    # Image 是延迟导入的代理，子类只能在第一次用到时定义
+
+    class FrameStream(Image.Image):
+        """把 FrameSequence 包装成多帧 Image：编码器 seek 到哪一帧才解码并叠加那一帧，
+        不需要事先准备好全部帧（编码器自己是否保留已取的帧见 MULTIFRAME_EXTS 前的说明）。"""
+
+        def __init__(self, sequence):
+            super().__init__()
+            self._sequence = sequence
+            self._source = sequence.source.open()
+            self.n_frames = self._source.n_frames
+            self.is_animated = True
+            self.durations = []  # 已解码各帧的时长（毫秒）
+            self._frame = None
+            self.seek(0)
+
+        def seek(self, frame):
+            if frame == self._frame:
+                return
+            self._source.seek(frame)
+            im = self._sequence.watermark(self._source)
+            self.im = im.im
+            self._mode = im.mode
+            self._size = im.size
+            self.info = {'duration': self._source.info.get('duration', 0)}
+            if frame == len(self.durations):
+                self.durations.append(self.info['duration'])
+            self._frame = frame
+
+        def tell(self):
+            return self._frame
+
+    return FrameStream
+
+
+def _frame_renditions(src, source: FrameSource, settings, opts, reserver):
+    # render_renditions 的多帧版本：能保存多帧的格式输出 FrameSequence，在编码阶段逐帧生成；
+    # JPEG 等单帧格式只输出加好水印的第一帧
+    w, h = source.size
+    profile = export_profile(opts)
+    settings = with_resample(settings, profile)
+    for r in export_renditions(opts):
+        size = export_target_size(w, h, r.get('resize_mode', '不变'), r.get('size_value', 100))
+        name, out_ext = output_name(src, {**opts, 'format': r.get('format', '保持原格式')})
+        out_path = reserver.reserve(reserver.folder(r.get('subfolder', '')), name + r.get('suffix', ''), out_ext)
+        sequence = FrameSequence(source, size, settings, size[0] / w, profile)
+        yield out_path, (sequence if out_ext in MULTIFRAME_EXTS else sequence.first_frame()), r
+
+
+def render_renditions(src, im, settings, opts, reserver):
+    """为已解码的 src 依次生成 (输出路径, 加好水印的图像, 输出版本)，每个输出版本一项。
+    版本按输出尺寸从大到小处理：每个缩小版本从上一个更大的干净中间图缩放得到，
+    再按该尺寸（px_scale）直接渲染水印；尺寸相同的版本共用同一次渲染结果。"""
+    # 字段在原图上解析一次（缩小后的中间图不带 EXIF），各版本共用
+    if isinstance(im, FrameSource):
+        settings = resolve_settings(settings, src, im.first, opts.get('manifest'))
+        yield from _frame_renditions(src, im, settings, opts, reserver)
+        return
+    w, h = source_size(im)  # draft 解码时 im 比原图小
+    settings = resolve_settings(settings, src, im, opts.get('manifest'))
+    profile = export_profile(opts)
+    settings = with_resample(settings, profile)
+    renditions = export_renditions(opts)
+    sizes = [export_target_size(w, h, r.get('resize_mode', '不变'), r.get('size_value', 100)) for r in renditions]
+    order = sorted(range(len(renditions)), key=lambda i: sizes[i][0] * sizes[i][1], reverse=True)
+    clean = im  # 最近一次缩小得到的未加水印的中间图
+    rendered = rendered_size = None
+    for i in order:
+        size = sizes[i]
+        # 同尺寸的版本在排序后相邻，只需保留最近一次的渲染结果
+        if size != rendered_size:
+            if size == clean.size:
+                scaled = clean
+            else:
+                # 放大或比中间图还大时只能从原图缩放
+                source = clean if clean.width >= size[0] and clean.height >= size[1] else im
+                scaled = profile_resize(source, size, profile)
+                if size[0] <= w and size[1] <= h:
+                    clean = scaled
+            rendered, rendered_size = render_watermark(scaled, settings, size[0] / w), size
+        r = renditions[i]
+        name, out_ext = output_name(src, {**opts, 'format': r.get('format', '保持原格式')})
+        folder = reserver.folder(r.get('subfolder', ''))
+        yield reserver.reserve(folder, name + r.get('suffix', ''), out_ext), rendered, r
+
+
+def frames_to_file(im, out_path, r, reserver):
+    """im 是多帧输出且不需要按大小上限搜索质量时，直接编码进 reserver 的输出文件，返回写入的字节数；
+    否则返回 None，由调用方用 encode_rendition 编码成字节串再写入。"""
+    if not isinstance(im, FrameSequence):
+        return None
+    if r.get('max_kb') and os.path.splitext(out_path)[1].lower() in LOSSY_EXTS:
+        return None
+    with reserver.open(out_path) as f:
+        im.encode(out_path, r.get('quality', 90), f)
+        return f.tell()
+
+
+def export_one(src, settings, opts, reserver):
+    """解码 src 一次，生成所有输出版本并写入 reserver（OutputPathReserver 或 ZipOutput），返回输出路径列表。"""
+    im = decode_source(read_source(src), opts)
+    out_paths = []
+    for out_path, rendered, r in render_renditions(src, im, settings, opts, reserver):
+        if frames_to_file(rendered, out_path, r, reserver) is None:
+            reserver.write(out_path, encode_rendition(rendered, out_path, r, opts)[0])
+        out_paths.append(out_path)
+    return out_paths
+
+
+class ExportJob:
+    """一张待导出的图片及其预估代价。多帧图的耗时按全部帧计，内存另加编码器保留的每帧一份 RGBA。"""
+    __slots__ = ('src', 'width', 'height', 'frames', 'memory', 'seconds')
+
+    def __init__(self, src, width, height, frames=1):
+        self.src = src
+        self.width = width
+        self.height = height
+        self.frames = frames
+        pixels = width * height
+        self.memory = pixels * MEMORY_FACTOR
+        if frames > 1:
+            self.memory += pixels * frames * 4
+        self.seconds = self.pixels / 1e6 * SECONDS_PER_MP
+
+    @property
+    def pixels(self):
+        return self.width * self.height * self.frames
+
+
+class ExportPlan:
+    """导出计划：按像素数从大到小排列的任务，以及总量估算。"""
+
+    def __init__(self, jobs, unreadable, memory_budget, workers):
+        self.jobs = sorted(jobs, key=lambda j: j.pixels, reverse=True)
+        self.unreadable = unreadable
+        self.memory_budget = memory_budget
+        self.workers = workers
+
+    @property
+    def total_pixels(self):
+        return sum(j.pixels for j in self.jobs)
+
+    def peak_memory(self):
+        """按与调度器相同的准入规则估算第一批同时运行的任务占用的内存。"""
+        used = 0
+        running = 0
+        for job in self.jobs:
+            if running >= self.workers:
+                break
+            if running == 0 or used + job.memory <= self.memory_budget:
+                used += job.memory
+                running += 1
+        return used
+
+    def estimated_seconds(self):
+        """粗略估计：总耗时按可并行的任务数摊薄，但不少于最大单张的耗时。"""
+        if not self.jobs:
+            return 0.0
+        total = sum(j.seconds for j in self.jobs)
+        parallel = max(1, min(self.workers, len(self.jobs)))
+        return max(total / parallel, self.jobs[0].seconds)
+
+    def summary(self):
+        return (f'{len(self.jobs)} 张，共 {self.total_pixels / 1e6:.0f} MP，'
+                f'预计耗时约 {self.estimated_seconds():.0f} 秒，'
+                f'峰值内存约 {self.peak_memory() / 2 ** 20:.0f} MB'
+                f'（预算 {self.memory_budget / 2 ** 20:.0f} MB，{self.workers} 线程）')
+
+
+def read_image_header(path):
+    """只读取文件头得到图像尺寸和帧数 ((w, h), n)，不解码像素。GIF 要顺序扫描各帧的帧头才能得到帧数。"""
+    with open_source(path) as f, Image.open(f) as im:
+        return im.size, getattr(im, 'n_frames', 1)
+
+
+def plan_export(paths, memory_budget, workers=None):
+    jobs = []
+    unreadable = []
+    for p in paths:
+        try:
+            (w, h), frames = read_image_header(p)
+        except Exception:
+            unreadable.append(p)
+            continue
+        jobs.append(ExportJob(p, w, h, frames))
+    return ExportPlan(jobs, unreadable, memory_budget, workers or os.cpu_count() or 1)
+
+
+PIPELINE_IO_THREADS = 2
+PIPELINE_QUEUE_SIZE = 4
+
+
+class StageStats:
+    """流水线单个阶段的统计：处理耗时、等待上游（饥饿）和等待下游（背压）的耗时，均为各线程之和。"""
+    __slots__ = ('name', 'threads', 'items', 'busy', 'wait_in', 'wait_out')
+
+    def __init__(self, name, threads):
+        self.name = name
+        self.threads = threads
+        self.items = 0
+        self.busy = 0.0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+
+    def utilization(self, wall):
+        return self.busy / (wall * self.threads) if wall > 0 else 0.0
+
+
+class ExportPipeline:
+    """流水线导出：读取 → 解码 → 渲染 → 编码 → 写入 五个阶段重叠执行。
+    阶段之间用有界队列连接，队列满时上游阻塞（背压），在途的图像数因此有上限；
+    读取和写入是 I/O 线程，解码/渲染/编码各用 workers 个线程（Pillow 在这些操作中释放 GIL）。
+    源图按计划从大到小送入，同时在途的源图按 ExportJob.memory 受内存预算限制，
+    没有在途的源图时总是放行一张，避免超大图永远无法开始。"""
+
+    STAGES = ('读取', '解码', '渲染', '编码', '写入')
+    RENDER = 2
+
+    def __init__(self, settings, opts, workers, memory_budget,
+                 io_threads=PIPELINE_IO_THREADS, queue_size=PIPELINE_QUEUE_SIZE):
+        self.settings = settings
+        self.opts = opts
+        self.memory_budget = memory_budget
+        self.queue_size = queue_size
+        threads = (io_threads, workers, workers, workers, io_threads)
+        self.stats = [StageStats(name, n) for name, n in zip(self.STAGES, threads)]
+        self.wall = 0.0
+        self._reserver = make_output(opts)
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+        self._cancel = threading.Event()
+        self._used = 0
+        self._memory = {}  # src -> 占用的内存预算
+        self._remaining = {}  # src -> 尚未写完的输出版本数
+        self._done_paths = []
+        self._failures = []
+        self._finished = 0
+        self.report = []  # 每个输出一行，字段见 REPORT_FIELDS
+
+    # 各阶段的处理函数：(src, 上一阶段的结果) -> 本阶段结果的列表
+    def _read(self, src, _):
+        return [read_source(src)]
+
+    def _decode(self, src, data):
+        return [decode_source(data, self.opts)]
+
+    def _render(self, src, im):
+        return list(render_renditions(src, im, self.settings, self.opts, self._reserver))
+
+    def _encode(self, src, item):
+        out_path, im, r = item
+        written = frames_to_file(im, out_path, r, self._reserver)
+        if written is not None:
+            # 已直接写入输出文件，写入阶段只记录报告
+            return [(out_path, None, {'source': src, 'output': out_path, 'bytes': written,
+                                      'quality': r.get('quality', 90), 'max_kb': r.get('max_kb', 0),
+                                      'within_limit': True})]
+        data, quality, fits = encode_rendition(im, out_path, r, self.opts)
+        return [(out_path, data, {'source': src, 'output': out_path, 'bytes': len(data), 'quality': quality,
+                                  'max_kb': r.get('max_kb', 0), 'within_limit': fits})]
+
+    def _write(self, src, item):
+        out_path, data, record = item
+        if data is not None:
+            self._reserver.write(out_path, data)
+        with self._lock:
+            self.report.append(record)
+        return [out_path]
+
+    def _finish_source(self, src):
+        # 调用方持有 self._lock
+        self._finished += 1
+        self._used -= self._memory.pop(src, 0)
+        self._remaining.pop(src, None)
+        self._room.notify_all()
+
+    def _settle(self, stage, src, produced):
+        """记录一项处理结果。渲染阶段决定该源图有几个输出，之后的阶段每完成或失败一项减一。"""
+        with self._lock:
+            if stage < self.RENDER:
+                if not produced:
+                    self._finish_source(src)
+                return
+            if stage == self.RENDER:
+                self._remaining[src] = produced
+                if not produced:
+                    self._finish_source(src)
+                return
+            if stage == len(self.STAGES) - 1 or not produced:
+                self._remaining[src] -= 1
+                if self._remaining[src] <= 0:
+                    self._finish_source(src)
+
+    def _stage_loop(self, stage, fn, inbox, outbox, alive, next_threads):
+        st = self.stats[stage]
+        busy = wait_in = wait_out = 0.0
+        items = 0
+        while True:
+            t0 = time.perf_counter()
+            item = inbox.get()
+            wait_in += time.perf_counter() - t0
+            if item is None:
+                break
+            src, payload = item
+            t0 = time.perf_counter()
+            try:
+                results = fn(src, payload)
+            except Exception as e:
+                print('导出失败', src, e)
+                with self._lock:
+                    self._failures.append((src, e))
+                results = []
+            busy += time.perf_counter() - t0
+            items += 1
+            del item, payload
+            # 先登记输出数，再交给下游，保证下游完成时计数已就绪
+            self._settle(stage, src, len(results))
+            if outbox is None:
+                with self._lock:
+                    self._done_paths.extend(results)
+            else:
+                t0 = time.perf_counter()
+                for r in results:
+                    outbox.put((src, r))
+                wait_out += time.perf_counter() - t0
+            del results
+        with self._lock:
+            st.items += items
+            st.busy += busy
+            st.wait_in += wait_in
+            st.wait_out += wait_out
+            alive[stage] -= 1
+            last = alive[stage] == 0
+        # 本阶段最后一个线程退出时通知下一阶段的所有线程
+        if last and outbox is not None:
+            for _ in range(next_threads):
+                outbox.put(None)
+
+    def _feed(self, jobs, inbox):
+        for job in jobs:
+            with self._room:
+                while not self._cancel.is_set() and self._memory and self._used + job.memory > self.memory_budget:
+                    self._room.wait(0.1)
+                if self._cancel.is_set():
+                    break
+                self._used += job.memory
+                self._memory[job.src] = job.memory
+            inbox.put((job.src, None))
+        for _ in range(self.stats[0].threads):
+            inbox.put(None)
+
+    def run(self, plan, on_progress=None, should_cancel=None):
+        """执行导出计划。on_progress(done, total, elapsed) 在调用线程中回调；
+        should_cancel() 返回 True 时停止送入新的源图，已在途的会处理完。
+        返回 (成功的输出路径列表, [(src, 异常)])。"""
+        self._failures = [(p, 'unreadable') for p in plan.unreadable]
+        fns = (self._read, self._decode, self._render, self._encode, self._write)
+        queues = [queue.Queue(self.queue_size) for _ in fns]
+        alive = [st.threads for st in self.stats]
+        threads = [threading.Thread(target=self._feed, args=(plan.jobs, queues[0]), daemon=True)]
+        for i, fn in enumerate(fns):
+            outbox = queues[i + 1] if i + 1 < len(fns) else None
+            next_threads = self.stats[i + 1].threads if outbox is not None else 0
+            for _ in range(self.stats[i].threads):
+                threads.append(threading.Thread(target=self._stage_loop, daemon=True,
+                                                args=(i, fn, queues[i], outbox, alive, next_threads)))
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        total = len(plan.jobs)
+        while any(t.is_alive() for t in threads):
+            threads[-1].join(0.05)
+            if should_cancel is not None and should_cancel():
+                self._cancel.set()
+            if on_progress is not None:
+                on_progress(self._finished, total, time.perf_counter() - t0)
+        self._reserver.close()
+        self.wall = time.perf_counter() - t0
+        return self._done_paths, self._failures
+
+    def stats_text(self):
+        """各阶段利用率，利用率最高的阶段就是瓶颈。"""
+        parts = [f'{st.name} {st.utilization(self.wall) * 100:.0f}%（{st.threads} 线程）' for st in self.stats]
+        bottleneck = max(self.stats, key=lambda st: st.utilization(self.wall))
+        return f'阶段利用率：{"，".join(parts)}；瓶颈：{bottleneck.name}'
+
+
+# --------------------------- Distributed queue ---------------------------
+# 多机分布式导出：协调端把一次导出拆成共享目录（NFS 等，本地目录亦可）中的任务文件，
+# 任意多台机器上的工作进程（python watermark.py --worker 目录）通过租约文件领取任务、
+# 用同一份设置导出并写回结果。源图、图片水印和输出文件夹都必须是各机器可见的共享路径。
+# 目录结构：
+#   queue.json          水印设置与导出选项
+#   jobs/<id>.json      任务：一批源图路径
+#   leases/<id>.lease   租约：内容为持有者，mtime 为最近一次心跳，超过 lease_seconds 视为失效
+#   done/<id>.json      结果：持有者、输出路径、失败项与导出报告
+# 租约过期后任务会被整个重跑，新旧持有者可能同时在写。因此工作进程覆盖而不是避让同名输出，
+# 每个文件和每个任务的 ZIP 都原子改名写入；协调端在建队列时拒绝会输出到同一文件名的源图。
+
+JOB_CHUNK_SIZE = 50
+LEASE_SECONDS = 120
+
+
+def _write_json_atomic(path, data):
+    """先写临时文件再改名，其它机器不会读到写了一半的文件。"""
+    tmp = f'{path}.{socket.gethostname()}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def output_name_clashes(paths, opts):
+    """返回输出路径与前面某张源图相同的源图。单机导出靠追加 _1 避让，
+    分布式导出中哪张先写不确定，重跑后编号会变，所以必须事先排除。"""
+    owners, clashes = {}, []
+    for src in paths:
+        for r in export_renditions(opts):
+            name, ext = output_name(src, {**opts, 'format': r.get('format', '保持原格式')})
+            key = os.path.normcase(os.path.join(r.get('subfolder', ''), name + r.get('suffix', '') + ext)).lower()
+            if owners.setdefault(key, src) != src:
+                clashes.append(src)
+                break
+    return clashes
+
+
+class JobQueue:
+    """共享目录中的任务队列。所有状态都在文件里，协调端和工作进程之间不需要网络连接。"""
+
+    def __init__(self, root, lease_seconds=LEASE_SECONDS):
+        self.root = Path(root)
+        self.lease_seconds = lease_seconds
+        self.jobs_dir = self.root / 'jobs'
+        self.leases_dir = self.root / 'leases'
+        self.done_dir = self.root / 'done'
+
+    @classmethod
+    def create(cls, root, paths, settings, opts, chunk_size=JOB_CHUNK_SIZE):
+        """协调端：写入设置并把源图按 chunk_size 张一组拆成任务。"""
+        q = cls(root)
+        for d in (q.jobs_dir, q.leases_dir, q.done_dir):
+            os.makedirs(d, exist_ok=True)
+        if os.listdir(q.jobs_dir):
+            raise ValueError(f'共享目录中已有任务：{root}')
+        clashes = output_name_clashes(paths, opts)
+        if clashes:
+            raise ValueError('以下源图会输出到同一文件名，分布式导出要求输出名唯一：\n' + '\n'.join(clashes[:10]))
+        _write_json_atomic(q.root / 'queue.json', {
+            'settings': settings, 'opts': opts, 'created': time.time(), 'sources': len(paths),
+        })
+        for n, i in enumerate(range(0, len(paths), chunk_size)):
+            _write_json_atomic(q.jobs_dir / f'{n:08d}.json', {'sources': list(paths[i:i + chunk_size])})
+        return q
+
+    def config(self):
+        path = self.root / 'queue.json'
+        if not path.exists():
+            raise ValueError(f'不是分布式导出的任务目录（缺少 queue.json）：{self.root}')
+        return load_json(path)
+
+    def job_ids(self):
+        return sorted(n[:-5] for n in os.listdir(self.jobs_dir) if n.endswith('.json'))
+
+    def job_sources(self, job_id):
+        return load_json(self.jobs_dir / f'{job_id}.json').get('sources', [])
+
+    def _lease_path(self, job_id):
+        return self.leases_dir / f'{job_id}.lease'
+
+    def _done_path(self, job_id):
+        return self.done_dir / f'{job_id}.json'
+
+    def is_done(self, job_id):
+        return os.path.exists(self._done_path(job_id))
+
+    def _lease_expired(self, path):
+        return os.stat(path).st_mtime + self.lease_seconds < time.time()
+
+    def try_claim(self, job_id, worker):
+        """用 O_EXCL 创建租约文件领取任务，成功返回 True。
+        租约过期（持有者崩溃或失联）时先把旧租约改名——只有一个进程能改名成功——再重新领取。"""
+        if self.is_done(job_id):
+            return False
+        path = self._lease_path(job_id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if not self._lease_expired(path):
+                    return False
+                stale = f'{path}.{worker}.stale'
+                os.rename(path, stale)
+            except OSError:
+                return False
+            if not self._lease_expired(stale):
+                # 检查与改名之间别的进程已经换上了新租约，放回去
+                try:
+                    os.link(stale, path)
+                except OSError:
+                    pass
+                os.remove(stale)
+                return False
+            os.remove(stale)
+            return self.try_claim(job_id, worker)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(worker)
+        # 旧持有者可能在租约过期后才写完结果
+        if self.is_done(job_id):
+            self.release(job_id)
+            return False
+        return True
+
+    def heartbeat(self, job_id):
+        try:
+            os.utime(self._lease_path(job_id))
+        except OSError:
+            pass
+
+    def lease_owner(self, job_id):
+        try:
+            with open(self._lease_path(job_id), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def release(self, job_id):
+        try:
+            os.remove(self._lease_path(job_id))
+        except OSError:
+            pass
+
+    def complete(self, job_id, worker, outputs, failures, report=()):
+        _write_json_atomic(self._done_path(job_id), {
+            'worker': worker, 'finished': time.time(), 'outputs': outputs,
+            'failures': [[src, str(e)] for src, e in failures], 'report': list(report),
+        })
+        # 租约已被别的进程接管时不删除它的租约
+        if self.lease_owner(job_id) == worker:
+            self.release(job_id)
+
+    def summary(self):
+        """统计各状态的任务数和已处理的源图数。"""
+        counts = {'jobs': 0, 'done': 0, 'running': 0, 'stale': 0, 'pending': 0, 'outputs': 0, 'failures': 0}
+        for job_id in self.job_ids():
+            counts['jobs'] += 1
+            if self.is_done(job_id):
+                counts['done'] += 1
+                result = load_json(self._done_path(job_id))
+                counts['outputs'] += len(result.get('outputs', []))
+                counts['failures'] += len(result.get('failures', []))
+                continue
+            try:
+                counts['stale' if self._lease_expired(self._lease_path(job_id)) else 'running'] += 1
+            except OSError:
+                counts['pending'] += 1
+        return counts
+
+    def summary_text(self):
+        c = self.summary()
+        return (f'任务 {c["done"]}/{c["jobs"]} 已完成，{c["running"]} 进行中，{c["stale"]} 租约过期，'
+                f'{c["pending"]} 待领取；已输出 {c["outputs"]} 个文件，失败 {c["failures"]} 张')
+
+
+def run_worker(root, worker_id=None, memory_budget=DEFAULT_MEMORY_BUDGET_MB * 2 ** 20, poll=5.0):
+    """工作进程：循环领取任务并导出，所有任务完成后返回。
+    没有可领取的任务但仍有别人持有的任务时继续等待，以便接管过期的租约。"""
+    q = JobQueue(root)
+    cfg = q.config()
+    worker = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    while True:
+        remaining = [j for j in q.job_ids() if not q.is_done(j)]
+        if not remaining:
+            return 0
+        claimed = False
+        for job_id in remaining:
+            if not q.try_claim(job_id, worker):
+                continue
+            claimed = True
+            last_beat = [time.time()]
+
+            def beat(done, total, elapsed, job_id=job_id):
+                # 导出过程中定期续租
+                if time.time() - last_beat[0] > q.lease_seconds / 4:
+                    q.heartbeat(job_id)
+                    last_beat[0] = time.time()
+
+            # 重跑的任务覆盖上一个持有者留下的输出，而不是另存一份 name_1
+            opts = dict(cfg['opts'], overwrite=True)
+            if opts.get('zip_output'):
+                # 多个进程不能写同一个 ZIP，每个任务各写一个
+                stem, ext = os.path.splitext(opts['zip_output'])
+                opts = dict(opts, zip_output=f'{stem}_{job_id}{ext}')
+            plan = plan_export(q.job_sources(job_id), memory_budget)
+            pipeline = ExportPipeline(cfg['settings'], opts, plan.workers, plan.memory_budget)
+            outputs, failures = pipeline.run(plan, on_progress=beat)
+            q.complete(job_id, worker, outputs, failures, pipeline.report)
+            print(f'[{worker}] 任务 {job_id} 完成：{len(outputs)} 个文件，失败 {len(failures)} 张；{q.summary_text()}')
+        if not claimed:
+            time.sleep(poll)
+
+
+# --------------------------- Template store ---------------------------
+
+def settings_hash(settings: dict) -> str:
+    """设置字典的内容哈希（键排序后的 JSON 的 sha1），可作为批处理缓存的键。"""
+    data = json.dumps(settings, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class TemplateStore:
+    """基于 SQLite 的模板库。每个模板一行，修改只写该行并在事务中提交，
+    名称建有不区分大小写的索引用于搜索，内容哈希在写入时计算并保存。"""
+
+    def __init__(self, db_path=None, legacy_json=None):
+        # 默认路径在调用时读取，基准脚本等可以把数据目录整体重定向
+        self.db_path = Path(db_path or TEMPLATES_DB)
+        if legacy_json is None:
+            legacy_json = TEMPLATES_FILE  # 传入 '' 或 False 时不迁移
+        self.conn = sqlite3.connect(str(self.db_path))
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS templates ('
+                ' name TEXT PRIMARY KEY,'
+                ' data TEXT NOT NULL,'
+                ' hash TEXT NOT NULL,'
+                ' updated REAL NOT NULL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_templates_name_nocase '
+                              'ON templates (name COLLATE NOCASE)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        if legacy_json:
+            self._migrate_json(Path(legacy_json))
+
+    def _migrate_json(self, path):
+        """把旧版 templates.json 一次性导入数据库，成功后把原文件改名为 .migrated 保留备份。"""
+        done = self.conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if done or not path.exists():
+            return
+        data = load_json(path)
+        with self.conn:
+            for name, tpl in data.items():
+                if isinstance(tpl, dict):
+                    self._put(name, tpl, replace=False)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(path),))
+        try:
+            path.replace(path.with_name(path.name + '.migrated'))
+        except OSError:
+            pass
+
+    def _put(self, name, settings, replace=True, content_hash=None):
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        self.conn.execute(
+            f'{verb} INTO templates (name, data, hash, updated) VALUES (?, ?, ?, ?)',
+            (name, json.dumps(settings, ensure_ascii=False), content_hash or settings_hash(settings), time.time()),
+        )
+
+    def names(self, keyword=''):
+        """按名称排序返回模板名，keyword 非空时只返回名称包含它的（不区分大小写）。"""
+        if keyword:
+            escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            rows = self.conn.execute(
+                "SELECT name FROM templates WHERE name LIKE ? ESCAPE '\\' ORDER BY name COLLATE NOCASE",
+                (f'%{escaped}%',),
+            )
+        else:
+            rows = self.conn.execute('SELECT name FROM templates ORDER BY name COLLATE NOCASE')
+        return [r[0] for r in rows]
+
+    def get(self, name):
+        row = self.conn.execute('SELECT data FROM templates WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def content_hash(self, name):
+        row = self.conn.execute('SELECT hash FROM templates WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, name, settings):
+        """保存模板，返回是否实际写入；内容哈希与库中相同时不写，updated 保持不变。"""
+        h = settings_hash(settings)
+        if self.content_hash(name) == h:
+            return False
+        with self.conn:
+            self._put(name, settings, content_hash=h)
+        return True
+
+    def delete(self, name):
+        with self.conn:
+            self.conn.execute('DELETE FROM templates WHERE name = ?', (name,))
+
+    def close(self):
+        self.conn.close()
+
+
+# --------------------------- Thumbnail cache ---------------------------
+
+THUMB_SIZE = (240, 160)
+THUMB_CACHE_MAX_MB = 256
+
+
+class ThumbnailCache:
+    """列表缩略图的磁盘缓存：全部存放在一个 SQLite 文件中，每张图一行（JPEG/PNG 编码的 blob）。
+    以路径为键，文件大小或修改时间变化即视为失效；总大小超过上限时按最近使用时间淘汰。
+    命中时直接由 Qt 解码 blob，不需要 PIL。"""
+
+    def __init__(self, db_path=None, max_bytes=THUMB_CACHE_MAX_MB * 2 ** 20):
+        self.db_path = Path(db_path or THUMBS_DB)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(str(self.db_path))
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS thumbs ('
+                ' path TEXT PRIMARY KEY,'
+                ' file_size INTEGER NOT NULL,'
+                ' mtime REAL NOT NULL,'
+                ' data BLOB NOT NULL,'
+                ' last_used REAL NOT NULL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_thumbs_last_used ON thumbs (last_used)')
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(LENGTH(data)), 0) FROM thumbs').fetchone()[0]
+        self._touched = []
+
+    def get(self, path, file_size, mtime):
+        """返回缓存的编码数据，未命中或已失效时返回 None。命中的最近使用时间在 flush() 时批量更新。"""
+        row = self.conn.execute('SELECT file_size, mtime, data FROM thumbs WHERE path = ?', (path,)).fetchone()
+        if row is None or row[0] != file_size or row[1] != mtime:
+            return None
+        self._touched.append(path)
+        return row[2]
+
+    def put(self, path, file_size, mtime, data):
+        old = self.conn.execute('SELECT LENGTH(data) FROM thumbs WHERE path = ?', (path,)).fetchone()
+        self.conn.execute('INSERT OR REPLACE INTO thumbs (path, file_size, mtime, data, last_used) '
+                          'VALUES (?, ?, ?, ?, ?)', (path, file_size, mtime, data, time.time()))
+        self.total_bytes += len(data) - (old[0] if old else 0)
+
+    def flush(self):
+        """提交本批写入与命中记录，超过上限时淘汰最久未用的条目到上限的 90%。"""
+        now = time.time()
+        self.conn.executemany('UPDATE thumbs SET last_used = ? WHERE path = ?', ((now, p) for p in self._touched))
+        self._touched = []
+        if self.total_bytes > self.max_bytes:
+            target = self.max_bytes * 0.9
+            rows = self.conn.execute('SELECT path, LENGTH(data) FROM thumbs ORDER BY last_used')
+            evict = []
+            for path, nbytes in rows:
+                if self.total_bytes <= target:
+                    break
+                evict.append((path,))
+                self.total_bytes -= nbytes
+            self.conn.executemany('DELETE FROM thumbs WHERE path = ?', evict)
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def make_thumbnail(path) -> bytes:
+    """解码原图并生成缩略图的编码数据：不透明图存 JPEG，带透明通道的存 PNG。"""
+    im = Image.open(io.BytesIO(read_source(path)))
+    # JPEG 可在解码时直接按 1/2~1/8 缩小，大图省去大部分解码
+    im.draft('RGB', (THUMB_SIZE[0] * 2, THUMB_SIZE[1] * 2))
+    im.thumbnail(THUMB_SIZE)
+    buf = io.BytesIO()
+    if im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info:
+        im.convert('RGBA').save(buf, 'PNG')
+    else:
+        im.convert('RGB').save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
 # --------------------------- Graphics Items ---------------------------
 
 class DraggableTextItem(QGraphicsTextItem):
@@ -133,11 +2665,17 @@ class DraggableTextItem(QGraphicsTextItem):
         self.setDefaultTextColor(QtGui.QColor(255, 255, 255))
         self._rotation = 0.0
         self.positionChanged = None  # 位置变化回调函数
+        self.live_drag = False  # 为 True 时拖动过程中也回调（所见即所得预览）
 
     def set_rotation(self, deg):
         self._rotation = deg
         self.setRotation(deg)
-        
+
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        if self.live_drag and self.positionChanged:
+            self.positionChanged(self.pos())
+
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
         if self.positionChanged:
@@ -152,17 +2690,183 @@ class DraggablePixmapItem(QGraphicsPixmapItem):
         self.setAcceptHoverEvents(True)
         self._rotation = 0.0
         self.positionChanged = None  # 位置变化回调函数
+        self.live_drag = False  # 为 True 时拖动过程中也回调（所见即所得预览）
 
     def set_rotation(self, deg):
         self._rotation = deg
         self.setRotation(deg)
-        
+
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        if self.live_drag and self.positionChanged:
+            self.positionChanged(self.pos())
+
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
         if self.positionChanged:
             self.positionChanged(self.pos())
 
 
+class RenderedOverlayItem(QGraphicsPixmapItem):
+    """由导出引擎渲染的水印层（平铺水印、非当前编辑的图层），不可拖动。"""
+
+
+PREVIEW_TILE_SIZE = 512
+PREVIEW_TILE_CACHE_MB = 192
+PREVIEW_MAX_ZOOM = 8.0  # 最多放大到 800%
+PREVIEW_ZOOM_STEP = 1.25  # 滚轮每一格的缩放倍数
+
+
+class TilePyramid:
+    """预览用的多分辨率瓦片金字塔。第 k 层是原图缩小 2^k 倍，首次用到时由上一层 reduce(2) 得到；
+    瓦片在绘制时才转换成 QPixmap，放进按字节数限额的 LRU 缓存，显存/内存占用只与视口大小有关。"""
+
+    def __init__(self, image: Image.Image, tile_size=PREVIEW_TILE_SIZE, cache_bytes=PREVIEW_TILE_CACHE_MB * 2 ** 20):
+        self.source = image
+        if image.mode not in ('L', 'RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        self.size = image.size
+        self.levels = [image]
+        self.tile_size = tile_size
+        self.cache_bytes = cache_bytes
+        self._tiles = collections.OrderedDict()  # (层, tx, ty) -> QPixmap
+        self._bytes = 0
+        self.max_level = 0
+        side = max(image.size)
+        while side > tile_size:
+            side = (side + 1) // 2
+            self.max_level += 1
+
+    def level_for_scale(self, scale):
+        """每个原图像素显示为 scale 个设备像素时，分辨率仍不低于屏幕的最粗一层。"""
+        if scale >= 1.0:
+            return 0
+        return min(self.max_level, int(math.floor(math.log2(1.0 / max(scale, 1e-6)))))
+
+    def level(self, k):
+        while len(self.levels) <= k:
+            self.levels.append(self.levels[-1].reduce(2))
+        return self.levels[k]
+
+    def tile(self, k, tx, ty) -> QPixmap:
+        key = (k, tx, ty)
+        pix = self._tiles.get(key)
+        if pix is not None:
+            self._tiles.move_to_end(key)
+            return pix
+        im, n = self.level(k), self.tile_size
+        pix = pil_image_to_qpixmap(im.crop((tx * n, ty * n, min(im.width, (tx + 1) * n), min(im.height, (ty + 1) * n))))
+        self._tiles[key] = pix
+        self._bytes += pix.width() * pix.height() * 4
+        while self._bytes > self.cache_bytes and len(self._tiles) > 1:
+            _, old = self._tiles.popitem(last=False)
+            self._bytes -= old.width() * old.height() * 4
+        return pix
+
+    def tiles_in_rect(self, k, rect):
+        """与原图坐标矩形 rect (l, t, r, b) 相交的第 k 层瓦片，返回 [(tx, ty, 瓦片在原图坐标下的 (l, t, r, b))]。"""
+        im, n = self.level(k), self.tile_size
+        sx, sy = self.size[0] / im.width, self.size[1] / im.height
+        l, t, r, b = rect
+        tx0, ty0 = max(0, int(l / sx) // n), max(0, int(t / sy) // n)
+        tx1, ty1 = min((im.width - 1) // n, int(r / sx) // n), min((im.height - 1) // n, int(b / sy) // n)
+        return [(tx, ty, (tx * n * sx, ty * n * sy, min(im.width, (tx + 1) * n) * sx, min(im.height, (ty + 1) * n) * sy))
+                for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+
+
+class TiledImageItem(QGraphicsPixmapItem):
+    """预览底图。设置了金字塔时按当前缩放只绘制视口内的瓦片；
+    否则与普通 QGraphicsPixmapItem 相同（所见即所得模式下显示代理图）。"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pyramid = None
+        # exposedRect 才会是实际需要重绘的区域，而不是整张图
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+    def set_pyramid(self, pyramid):
+        self.prepareGeometryChange()
+        self.pyramid = pyramid
+        if pyramid is not None:
+            self.setPixmap(QPixmap())
+        self.update()
+
+    def boundingRect(self):
+        if self.pyramid is None:
+            return super().boundingRect()
+        return QRectF(0, 0, self.pyramid.size[0], self.pyramid.size[1])
+
+    def shape(self):
+        # fitInView(item) 按 shape 计算范围，空 pixmap 的默认 shape 为空
+        if self.pyramid is None:
+            return super().shape()
+        path = QtGui.QPainterPath()
+        path.addRect(self.boundingRect())
+        return path
+
+    def paint(self, painter, option, widget=None):
+        if self.pyramid is None:
+            super().paint(painter, option, widget)
+            return
+        scale = option.levelOfDetailFromTransform(painter.worldTransform()) * painter.device().devicePixelRatioF()
+        k = self.pyramid.level_for_scale(scale)
+        # 缩小显示时平滑插值；放大到 1:1 以上时保留像素边缘，便于检查水印锐度
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, scale < 1.0)
+        exposed = option.exposedRect
+        rect = (exposed.left(), exposed.top(), exposed.right(), exposed.bottom())
+        for tx, ty, (l, t, r, b) in self.pyramid.tiles_in_rect(k, rect):
+            pix = self.pyramid.tile(k, tx, ty)
+            painter.drawPixmap(QRectF(l, t, r - l, b - t), pix, QRectF(pix.rect()))
+
+
+class ZoomableGraphicsView(QGraphicsView):
+    """预览视图：滚轮以鼠标位置为中心缩放，在空白处按住左键拖动平移。
+    fit_mode 为 True 时显示整图并随窗口大小自动适应。"""
+    zoomChanged = pyqtSignal(float)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.fit_mode = True
+        self.fit_item = None
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        # 拖动手型只在点击没有被水印项接收时生效，不影响拖动水印
+        self.setDragMode(QGraphicsView.ScrollHandDrag)
+
+    def zoom(self):
+        return self.transform().m11()
+
+    def fit(self, item=None):
+        if item is not None:
+            self.fit_item = item
+        self.fit_mode = True
+        if self.fit_item is not None and self.fit_item.scene() is self.scene():
+            self.fitInView(self.fit_item, Qt.KeepAspectRatio)
+        self.zoomChanged.emit(self.zoom())
+
+    def refit(self):
+        if self.fit_mode:
+            self.fit()
+
+    def set_zoom(self, zoom):
+        """zoom 为 1.0 时一个原图像素占一个逻辑像素。"""
+        zoom = min(PREVIEW_MAX_ZOOM, max(0.01, zoom))
+        factor = zoom / self.zoom()
+        self.scale(factor, factor)
+        self.fit_mode = False
+        self.zoomChanged.emit(self.zoom())
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if not steps:
+            super().wheelEvent(event)
+            return
+        self.set_zoom(self.zoom() * PREVIEW_ZOOM_STEP ** steps)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.refit()
+
+
 class DragDropListWidget(QListWidget):
     """支持从资源管理器拖拽文件/文件夹到列表的 QListWidget 子类。
     发射 filesDropped(list_of_paths) 信号，路径已经展开为图片文件路径列表。"""
@@ -193,9 +2897,9 @@ class DragDropListWidget(QListWidget):
             if os.path.isdir(p):
                 for root, _, filenames in os.walk(p):
                     for fn in filenames:
-                        if fn.lower().endswith(SUPPORTED_INPUT):
+                        if fn.lower().endswith(SUPPORTED_INPUT + ARCHIVE_INPUT):
                             files.append(os.path.join(root, fn))
-            elif os.path.isfile(p) and p.lower().endswith(SUPPORTED_INPUT):
+            elif os.path.isfile(p) and p.lower().endswith(SUPPORTED_INPUT + ARCHIVE_INPUT):
                 files.append(p)
         if files:
             # 发射已经展开并过滤过的文件路径列表
@@ -213,17 +2917,64 @@ class WatermarkerApp(QMainWindow):
         self.resize(1200, 800)
 
         self.images = []  # list of file paths
+        self._image_index = {}  # path -> index in self.images，去重与定位都是 O(1)
         self.current_index = None
 
-        self.templates = load_json(TEMPLATES_FILE) or {}
-        self.last_settings = load_json(LAST_SETTINGS_FILE) or {}
-        
+        # 模板、字体列表和上次设置在首帧绘制之后再加载（见 _deferred_init）
+        self.template_store = None
+        self.thumb_cache = None  # 首次导入图片时打开
+        self.last_settings = {}
+        self._deferred_init_done = False
+        self._first_paint_seen = False
+        self._suspend_preview = False
+
+        # 水印图层：每项是一份单水印设置，current_layer 对应界面上正在编辑的那一层
+        self.layers = [{}]
+        self.current_layer = 0
+        self._overlay_cache = None  # (key, QPixmap)：非当前图层的预览渲染结果
+        self._overlay_level = 0  # 引擎渲染的预览叠加层所用的金字塔层级
+        self._refitting = False
+        self._region_stats_cache = None  # (预览图, RegionStats)：自动位置/颜色的背景统计
+        self._pyramid = None  # 普通预览模式下底图的瓦片金字塔
+        self.proxy_renderer = None  # 所见即所得预览的 ProxyRenderer，关闭时为 None
+        self._wysiwyg_pixmap = None
+
         # 添加存储拖拽后位置的变量
         self.dragged_text_pos = None
         self.dragged_image_pos = None
 
         self._build_ui()
+        STARTUP_TIMER.mark('构建界面')
+        # 万一窗口没有收到绘制事件（例如启动即最小化），也保证延迟初始化会执行
+        QtCore.QTimer.singleShot(500, self._deferred_init)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self._deferred_init_done and not self._first_paint_seen:
+            self._first_paint_seen = True
+            STARTUP_TIMER.mark('首帧绘制')
+            QtCore.QTimer.singleShot(0, self._deferred_init)
+
+    def _deferred_init(self):
+        """窗口显示后再做的初始化：枚举字体、读取模板、恢复上次设置。"""
+        if self._deferred_init_done:
+            return
+        self._deferred_init_done = True
+        self._populate_font_combo()
+        STARTUP_TIMER.mark('枚举字体')
+        self.template_store = TemplateStore()
+        self._refresh_template_list()
+        STARTUP_TIMER.mark('加载模板')
+        self.last_settings = load_json(LAST_SETTINGS_FILE) or {}
         self._load_last_settings()
+        STARTUP_TIMER.mark('恢复上次设置')
+        STARTUP_TIMER.report()
+
+    def _populate_font_combo(self):
+        families = sorted(QFontDatabase().families())
+        self.font_combo.blockSignals(True)
+        self.font_combo.addItems(families)
+        self.font_combo.blockSignals(False)
 
     def _build_ui(self):
         central = QWidget()
@@ -267,6 +3018,9 @@ class WatermarkerApp(QMainWindow):
         self.chk_prevent_overwrite.setChecked(True)
         eg_layout.addWidget(self.chk_prevent_overwrite)
 
+        self.chk_zip_output = QCheckBox(f'直接打包为 ZIP（输出文件夹下的 {EXPORT_ZIP_NAME}）')
+        eg_layout.addWidget(self.chk_zip_output)
+
         # 命名规则
         name_layout = QHBoxLayout()
         self.name_rule_combo = QComboBox()
@@ -276,10 +3030,19 @@ class WatermarkerApp(QMainWindow):
         name_layout.addWidget(self.name_extra_edit)
         eg_layout.addLayout(name_layout)
 
+        # 导出配置：草稿 / 均衡 / 最佳，决定缩放滤波、draft 解码、JPEG 抽样/优化，并带出 PNG 压缩设置
+        profile_layout = QHBoxLayout()
+        self.export_profile_combo = QComboBox()
+        self.export_profile_combo.addItems(list(EXPORT_PROFILES))
+        self.export_profile_combo.setCurrentText(DEFAULT_EXPORT_PROFILE)
+        profile_layout.addWidget(QLabel('导出配置'))
+        profile_layout.addWidget(self.export_profile_combo)
+        eg_layout.addLayout(profile_layout)
+
         # 输出格式 & JPEG 质量
         format_layout = QHBoxLayout()
         self.format_combo = QComboBox()
-        self.format_combo.addItems(['保持原格式', 'JPEG', 'PNG'])
+        self.format_combo.addItems(FORMATS)
         self.jpeg_quality_slider = QSlider(Qt.Horizontal)
         self.jpeg_quality_slider.setRange(1, 100)
         self.jpeg_quality_slider.setValue(90)
@@ -289,10 +3052,34 @@ class WatermarkerApp(QMainWindow):
         format_layout.addWidget(self.jpeg_quality_slider)
         eg_layout.addLayout(format_layout)
 
+        # 目标文件大小：JPEG/WebP 在不超过上限的前提下自动选择最高质量（以上面的质量为上限）
+        target_layout = QHBoxLayout()
+        self.target_kb_spin = QSpinBox()
+        self.target_kb_spin.setRange(0, 1000000)
+        self.target_kb_spin.setSingleStep(50)
+        self.target_kb_spin.setSpecialValueText('不限')
+        target_layout.addWidget(QLabel('目标大小上限 (KB)'))
+        target_layout.addWidget(self.target_kb_spin)
+        eg_layout.addLayout(target_layout)
+
+        # PNG 编码：压缩级别 0~9 与行滤波方式（自适应按行选择最省空间的滤波器）
+        png_layout = QHBoxLayout()
+        self.png_level_spin = QSpinBox()
+        self.png_level_spin.setRange(0, 9)
+        self.png_level_spin.setValue(PNG_DEFAULT_LEVEL)
+        self.png_filter_combo = QComboBox()
+        self.png_filter_combo.addItems(list(PNG_FILTERS))
+        png_layout.addWidget(QLabel('PNG压缩级别'))
+        png_layout.addWidget(self.png_level_spin)
+        png_layout.addWidget(QLabel('PNG滤波'))
+        png_layout.addWidget(self.png_filter_combo)
+        eg_layout.addLayout(png_layout)
+        self.export_profile_combo.currentTextChanged.connect(self._apply_export_profile)
+
         # 尺寸调整
         size_layout = QHBoxLayout()
         self.size_combo = QComboBox()
-        self.size_combo.addItems(['不变', '按宽度', '按高度', '按百分比'])
+        self.size_combo.addItems(RESIZE_MODES)
         self.size_value = QSpinBox()
         self.size_value.setRange(1, 10000)
         self.size_value.setValue(100)
@@ -301,8 +3088,46 @@ class WatermarkerApp(QMainWindow):
         size_layout.addWidget(self.size_value)
         eg_layout.addLayout(size_layout)
 
+        # 批量清单：文字水印中 {csv.列名} 字段的数据来源
+        manifest_layout = QHBoxLayout()
+        self.manifest_edit = QLineEdit()
+        self.manifest_edit.setPlaceholderText('清单 CSV（可选，供 {csv.列名} 字段使用）')
+        self.manifest_edit.editingFinished.connect(self.update_preview)
+        btn_choose_manifest = QPushButton('选择清单')
+        btn_choose_manifest.clicked.connect(self.choose_manifest)
+        manifest_layout.addWidget(self.manifest_edit)
+        manifest_layout.addWidget(btn_choose_manifest)
+        eg_layout.addLayout(manifest_layout)
+
+        # 多版本输出：每行一个版本，一次解码生成全部；表格为空时使用上面的格式与尺寸
+        self.rendition_table = QtWidgets.QTableWidget(0, 7)
+        self.rendition_table.setHorizontalHeaderLabels(['尺寸规则', '尺寸值', '格式', '质量', '上限KB', '后缀', '子文件夹'])
+        self.rendition_table.verticalHeader().setVisible(False)
+        self.rendition_table.horizontalHeader().setStretchLastSection(True)
+        eg_layout.addWidget(self.rendition_table)
+        rendition_btns = QHBoxLayout()
+        btn_add_rendition = QPushButton('添加输出版本')
+        btn_remove_rendition = QPushButton('删除输出版本')
+        btn_add_rendition.clicked.connect(lambda: self._add_rendition_row())
+        btn_remove_rendition.clicked.connect(self._remove_rendition_row)
+        rendition_btns.addWidget(btn_add_rendition)
+        rendition_btns.addWidget(btn_remove_rendition)
+        eg_layout.addLayout(rendition_btns)
+
+        # 并发导出的内存预算
+        budget_layout = QHBoxLayout()
+        self.memory_budget_spin = QSpinBox()
+        self.memory_budget_spin.setRange(256, 65536)
+        self.memory_budget_spin.setSingleStep(256)
+        self.memory_budget_spin.setValue(DEFAULT_MEMORY_BUDGET_MB)
+        budget_layout.addWidget(QLabel('内存预算 (MB)'))
+        budget_layout.addWidget(self.memory_budget_spin)
+        eg_layout.addLayout(budget_layout)
+
         self.btn_export = QPushButton('导出所选/全部图片')
         eg_layout.addWidget(self.btn_export)
+        self.btn_distribute = QPushButton('分发到共享目录（多机导出）')
+        eg_layout.addWidget(self.btn_distribute)
 
         export_group.setLayout(eg_layout)
         left_col.addWidget(export_group, 4)
@@ -316,10 +3141,29 @@ class WatermarkerApp(QMainWindow):
         preview_group = QGroupBox('图片预览（单击列表切换图片；可拖动水印）')
         pv_layout = QVBoxLayout()
 
-        self.graphics_view = QGraphicsView()
+        self.graphics_view = ZoomableGraphicsView()
         self.graphics_scene = QGraphicsScene()
         self.graphics_view.setScene(self.graphics_scene)
         pv_layout.addWidget(self.graphics_view)
+        zoom_layout = QHBoxLayout()
+        self.btn_zoom_fit = QPushButton('适应窗口')
+        self.btn_zoom_fit.clicked.connect(lambda: self.graphics_view.fit())
+        self.btn_zoom_actual = QPushButton('1:1')
+        # 1:1 指一个原图像素对应一个屏幕物理像素
+        self.btn_zoom_actual.clicked.connect(
+            lambda: self.graphics_view.set_zoom(1.0 / self.graphics_view.devicePixelRatioF()))
+        self.zoom_label = QLabel('')
+        self.graphics_view.zoomChanged.connect(
+            lambda z: self.zoom_label.setText(f'{z * self.graphics_view.devicePixelRatioF() * 100:.0f}%'))
+        self.graphics_view.zoomChanged.connect(self._on_preview_zoom)
+        zoom_layout.addWidget(self.btn_zoom_fit)
+        zoom_layout.addWidget(self.btn_zoom_actual)
+        zoom_layout.addWidget(self.zoom_label)
+        zoom_layout.addStretch(1)
+        pv_layout.addLayout(zoom_layout)
+        self.chk_wysiwyg = QCheckBox('所见即所得预览（使用导出引擎渲染）')
+        self.chk_wysiwyg.toggled.connect(self.on_wysiwyg_toggled)
+        pv_layout.addWidget(self.chk_wysiwyg)
         preview_group.setLayout(pv_layout)
         right_col.addWidget(preview_group, 7)
 
@@ -331,6 +3175,19 @@ class WatermarkerApp(QMainWindow):
         watermark_tab = QWidget()
         wm_layout = QVBoxLayout()
 
+        # 图层列表：自下而上合成，下方的设置编辑当前选中的图层
+        layer_layout = QHBoxLayout()
+        self.layer_list = QListWidget()
+        self.layer_list.setMaximumHeight(80)
+        layer_btn_layout = QVBoxLayout()
+        self.btn_add_layer = QPushButton('添加图层')
+        self.btn_remove_layer = QPushButton('删除图层')
+        layer_btn_layout.addWidget(self.btn_add_layer)
+        layer_btn_layout.addWidget(self.btn_remove_layer)
+        layer_layout.addWidget(self.layer_list)
+        layer_layout.addLayout(layer_btn_layout)
+        wm_layout.addLayout(layer_layout)
+
         # 切换文本/图片
         self.watermark_type_combo = QComboBox()
         self.watermark_type_combo.addItems(['文本水印', '图片水印'])
@@ -340,14 +3197,12 @@ class WatermarkerApp(QMainWindow):
         self.text_settings_widget = QWidget()
         ts_layout = QVBoxLayout()
         self.text_edit = QLineEdit('示例文字 — 水印')
+        self.text_edit.setToolTip('可使用按图片替换的字段：{filename}、{exif.DateTimeOriginal}、{csv.列名}（需在导出设置中选择清单 CSV）')
         ts_layout.addWidget(QLabel('文本内容'))
         ts_layout.addWidget(self.text_edit)
 
-        # 字体选择
-        font_db = QFontDatabase()
-        families = font_db.families()
+        # 字体选择（字体列表在窗口显示后由 _populate_font_combo 填充）
         self.font_combo = QComboBox()
-        self.font_combo.addItems(sorted(families))
         ts_layout.addWidget(QLabel('字体'))
         ts_layout.addWidget(self.font_combo)
 
@@ -374,6 +3229,8 @@ class WatermarkerApp(QMainWindow):
         color_layout.addWidget(QLabel('透明度'))
         color_layout.addWidget(self.opacity_slider)
         ts_layout.addLayout(color_layout)
+        self.chk_auto_color = QCheckBox('自动颜色（与背景对比）')
+        ts_layout.addWidget(self.chk_auto_color)
 
         # 阴影/描边
         effect_layout = QHBoxLayout()
@@ -395,9 +3252,18 @@ class WatermarkerApp(QMainWindow):
         # 预设位置（九宫格）
         pos_layout = QHBoxLayout()
         self.pos_combo = QComboBox()
-        self.pos_combo.addItems(['左上', '上中', '右上', '左中', '居中', '右中', '左下', '下中', '右下'])
+        self.pos_combo.addItems(POSITION_PRESETS + [AUTO_PRESET, TILE_PRESET])
         pos_layout.addWidget(QLabel('预设位置'))
         pos_layout.addWidget(self.pos_combo)
+        # 平铺：间距（相对水印尺寸 %）与交错排列
+        self.tile_gap_spin = QSpinBox()
+        self.tile_gap_spin.setRange(0, 500)
+        self.tile_gap_spin.setValue(50)
+        self.chk_tile_stagger = QCheckBox('交错')
+        self.chk_tile_stagger.setChecked(True)
+        pos_layout.addWidget(QLabel('平铺间距%'))
+        pos_layout.addWidget(self.tile_gap_spin)
+        pos_layout.addWidget(self.chk_tile_stagger)
         ts_layout.addLayout(pos_layout)
 
         # 缩放
@@ -442,9 +3308,17 @@ class WatermarkerApp(QMainWindow):
         # 图片位置预设
         img_pos_layout = QHBoxLayout()
         self.img_pos_combo = QComboBox()
-        self.img_pos_combo.addItems(['左上', '上中', '右上', '左中', '居中', '右中', '左下', '下中', '右下'])
+        self.img_pos_combo.addItems(POSITION_PRESETS + [AUTO_PRESET, TILE_PRESET])
         img_pos_layout.addWidget(QLabel('预设位置'))
         img_pos_layout.addWidget(self.img_pos_combo)
+        self.img_tile_gap_spin = QSpinBox()
+        self.img_tile_gap_spin.setRange(0, 500)
+        self.img_tile_gap_spin.setValue(50)
+        self.img_chk_tile_stagger = QCheckBox('交错')
+        self.img_chk_tile_stagger.setChecked(True)
+        img_pos_layout.addWidget(QLabel('平铺间距%'))
+        img_pos_layout.addWidget(self.img_tile_gap_spin)
+        img_pos_layout.addWidget(self.img_chk_tile_stagger)
         is_layout.addLayout(img_pos_layout)
 
         self.image_settings_widget.setLayout(is_layout)
@@ -457,6 +3331,9 @@ class WatermarkerApp(QMainWindow):
         # --- 模板管理页 ---
         templates_tab = QWidget()
         tpl_layout = QVBoxLayout()
+        self.template_search_edit = QLineEdit()
+        self.template_search_edit.setPlaceholderText('搜索模板名称')
+        tpl_layout.addWidget(self.template_search_edit)
         self.template_list = QListWidget()
         tpl_layout.addWidget(self.template_list)
         tpl_btn_layout = QHBoxLayout()
@@ -481,6 +3358,7 @@ class WatermarkerApp(QMainWindow):
         btn_choose_out.clicked.connect(self.choose_out_folder)
         self.list_widget.itemClicked.connect(self.on_list_item_clicked)
         self.btn_export.clicked.connect(self.export_images)
+        self.btn_distribute.clicked.connect(self.distribute_export)
 
         # watermarks
         self.watermark_type_combo.currentIndexChanged.connect(self.on_watermark_type_changed)
@@ -494,29 +3372,37 @@ class WatermarkerApp(QMainWindow):
         self.pos_combo.currentIndexChanged.connect(lambda: (setattr(self, 'dragged_text_pos', None), self.update_preview()))
         self.chk_shadow.stateChanged.connect(self.update_preview)
         self.chk_stroke.stateChanged.connect(self.update_preview)
+        self.chk_auto_color.stateChanged.connect(self.update_preview)
         self.chk_bold.stateChanged.connect(self.update_preview)
         self.chk_italic.stateChanged.connect(self.update_preview)
+        self.tile_gap_spin.valueChanged.connect(self.update_preview)
+        self.chk_tile_stagger.stateChanged.connect(self.update_preview)
 
         self.btn_choose_wm_image.clicked.connect(self.choose_wm_image)
+        self.btn_add_layer.clicked.connect(self.add_layer)
+        self.btn_remove_layer.clicked.connect(self.remove_layer)
+        self.layer_list.currentRowChanged.connect(self.on_layer_selected)
         self.img_opacity_slider.valueChanged.connect(self.update_preview)
         self.img_rotate_slider.valueChanged.connect(self.update_preview)
         self.img_scale_spin.valueChanged.connect(self.update_preview)
         self.img_pos_combo.currentIndexChanged.connect(lambda: (setattr(self, 'dragged_image_pos', None), self.update_preview()))
+        self.img_tile_gap_spin.valueChanged.connect(self.update_preview)
+        self.img_chk_tile_stagger.stateChanged.connect(self.update_preview)
 
         self.btn_save_template.clicked.connect(self.save_template)
         self.btn_load_template.clicked.connect(self.load_template)
         self.btn_delete_template.clicked.connect(self.delete_template)
+        self.template_search_edit.textChanged.connect(self._refresh_template_list)
 
         # 支持拖拽到 list
         # 使用自定义的 DragDropListWidget 并连接其 filesDropped 信号以添加图片路径
         self.list_widget.filesDropped.connect(self._add_image_paths)
 
-        # populate templates list
-        self._refresh_template_list()
-
         # default color
         self._color = QtGui.QColor(255, 255, 255)
 
+        self._refresh_layer_list()
+
     # ---------------- UI helpers ----------------
     def _drag_enter(self, event):
         if event.mimeData().hasUrls():
@@ -533,14 +3419,14 @@ class WatermarkerApp(QMainWindow):
                 # import folder
                 for root, _, filenames in os.walk(p):
                     for fn in filenames:
-                        if fn.lower().endswith(SUPPORTED_INPUT):
+                        if fn.lower().endswith(SUPPORTED_INPUT + ARCHIVE_INPUT):
                             files.append(os.path.join(root, fn))
-            elif os.path.isfile(p) and p.lower().endswith(SUPPORTED_INPUT):
+            elif os.path.isfile(p) and p.lower().endswith(SUPPORTED_INPUT + ARCHIVE_INPUT):
                 files.append(p)
         self._add_image_paths(files)
 
     def add_files(self):
-        files, _ = QFileDialog.getOpenFileNames(self, '选择图片', '', 'Images (*.png *.jpg *.jpeg)')
+        files, _ = QFileDialog.getOpenFileNames(self, '选择图片或压缩包', '', 'Images (*.png *.jpg *.jpeg *.gif *.webp *.tif *.tiff *.zip)')
         if files:
             self._add_image_paths(files)
 
@@ -550,21 +3436,29 @@ class WatermarkerApp(QMainWindow):
             files = []
             for root, _, filenames in os.walk(folder):
                 for fn in filenames:
-                    if fn.lower().endswith(SUPPORTED_INPUT):
+                    if fn.lower().endswith(SUPPORTED_INPUT + ARCHIVE_INPUT):
                         files.append(os.path.join(root, fn))
             self._add_image_paths(files)
 
     def _add_image_paths(self, files):
+        if self.thumb_cache is None:
+            ensure_app_dir()
+            self.thumb_cache = ThumbnailCache()
+        cache = self.thumb_cache
         added = 0
-        for f in files:
-            if f not in self.images:
+        for f in expand_sources(files):
+            if f not in self._image_index:
+                self._image_index[f] = len(self.images)
                 self.images.append(f)
                 # create thumbnail
                 try:
-                    im = Image.open(f)
-                    im.thumbnail((240, 160))
-                    im = im.convert('RGBA')  # <-- 强制 RGBA
-                    pix = pil_image_to_qpixmap(im)
+                    size, mtime = source_stat(f)
+                    data = cache.get(f, size, mtime)
+                    if data is None:
+                        data = make_thumbnail(f)
+                        cache.put(f, size, mtime, data)
+                    pix = QPixmap()
+                    pix.loadFromData(data)
                     icon = QIcon(pix)
                 except Exception:
                     icon = QIcon()
@@ -572,12 +3466,14 @@ class WatermarkerApp(QMainWindow):
                 item.setData(Qt.UserRole, f)
                 self.list_widget.addItem(item)
                 added += 1
+        cache.flush()
         if added > 0 and self.current_index is None:
             self.list_widget.setCurrentRow(0)
             self.on_list_item_clicked(self.list_widget.item(0))
 
     def clear_list(self):
         self.images = []
+        self._image_index = {}
         self.list_widget.clear()
         self.graphics_scene.clear()
         self.current_index = None
@@ -590,22 +3486,28 @@ class WatermarkerApp(QMainWindow):
     def on_list_item_clicked(self, item: QListWidgetItem):
         path = item.data(Qt.UserRole)
         if path:
-            try:
-                self.current_index = self.images.index(path)
-            except ValueError:
-                self.current_index = None
+            self.current_index = self._image_index.get(path)
             self.load_preview_image(path)
 
     def load_preview_image(self, path):
         self.graphics_scene.clear()
+        # 拖拽位置按预览图宽度归一化保存，换图后按新图尺寸还原
+        self.layers[self.current_layer] = self._collect_layer()
         try:
-            im = Image.open(path).convert('RGBA')
+            im = decode_preview(read_source(path))
             self.preview_base_image = im
-            pix = pil_image_to_qpixmap(im)
-            self.base_pixmap_item = QGraphicsPixmapItem(pix)
+            self.preview_path = path
+            self._restore_drag_pos(self.layers[self.current_layer])
+            self.base_pixmap_item = TiledImageItem()
             self.graphics_scene.addItem(self.base_pixmap_item)
+            self._build_base_pixmap()
+            self.graphics_scene.setSceneRect(self.base_pixmap_item.sceneBoundingRect())
             # fit view
-            self.graphics_view.fitInView(self.base_pixmap_item, Qt.KeepAspectRatio)
+            self._refitting = True
+            try:
+                self.graphics_view.fit(self.base_pixmap_item)
+            finally:
+                self._refitting = False
             # add watermark item
             self._add_preview_watermark()
         except Exception as e:
@@ -614,25 +3516,53 @@ class WatermarkerApp(QMainWindow):
     def _add_preview_watermark(self):
         # remove existing watermark items
         for it in list(self.graphics_scene.items()):
-            if isinstance(it, (DraggableTextItem, DraggablePixmapItem)):
+            if isinstance(it, (DraggableTextItem, DraggablePixmapItem, RenderedOverlayItem)):
                 self.graphics_scene.removeItem(it)
 
-        if self.watermark_type_combo.currentText() == '文本水印':
-            text = self.text_edit.text()
+        is_text = self.watermark_type_combo.currentText() == '文本水印'
+        preset = self.pos_combo.currentText() if is_text else self.img_pos_combo.currentText()
+        wysiwyg = self.proxy_renderer is not None
+        if wysiwyg:
+            # 所有图层都已画进代理图，Qt 水印项只作为几乎透明的拖拽手柄
+            self._refresh_wysiwyg()
+            if preset == TILE_PRESET:
+                self.preview_watermark_item = None
+                return
+        else:
+            # 其它图层由导出引擎渲染成一张静态叠加层
+            self._add_preview_other_layers()
+
+        if preset == TILE_PRESET and hasattr(self, 'preview_base_image'):
+            # 平铺模式：用导出引擎把整层水印画到透明图上显示
+            item = self._render_overlay_item(self._resolve_preview(self._collect_layer()))
+            self.graphics_scene.addItem(item)
+            self.preview_watermark_item = item
+            return
+
+        if is_text:
+            text = self._resolve_preview({'text': self.text_edit.text()})['text']
             ti = DraggableTextItem(text)
-            font = QtGui.QFont(self.font_combo.currentText(), self.font_size_spin.value())
+            # 字号按原图像素计，超大图的预览底图缩小过，字号随之缩小
+            preview_scale = self.preview_base_image.width / source_size(self.preview_base_image)[0]
+            font = QtGui.QFont(self.font_combo.currentText())
+            font.setPointSizeF(self.font_size_spin.value() * preview_scale)
             font.setBold(self.chk_bold.isChecked())
             font.setItalic(self.chk_italic.isChecked())
             ti.setFont(font)
             ti.setDefaultTextColor(self._color)
-            ti.setOpacity(self.opacity_slider.value() / 100.0)
+            ti.setOpacity(WYSIWYG_HANDLE_OPACITY if wysiwyg else self.opacity_slider.value() / 100.0)
             # position preset
-            self._place_item_by_preset(ti, self.pos_combo.currentText())
+            self._place_item_by_preset(ti, self.pos_combo.currentText(), self.dragged_text_pos)
+            if self.chk_auto_color.isChecked() and not wysiwyg:
+                r = ti.sceneBoundingRect()
+                luma = self._region_stats().stats(r.x(), r.y(), r.width(), r.height())[0]
+                ti.setDefaultTextColor(QtGui.QColor(*contrast_color(luma, self._color.getRgb())))
             ti.set_rotation(self.rotate_slider.value())
             self.graphics_scene.addItem(ti)
             self.preview_watermark_item = ti
             # 连接位置变化信号来跟踪拖拽
-            ti.positionChanged = lambda pos: setattr(self, 'dragged_text_pos', pos)
+            ti.positionChanged = lambda pos: self._on_watermark_dragged('dragged_text_pos', pos)
+            ti.live_drag = wysiwyg
         else:
             # image watermark
             wm_path = getattr(self, 'wm_image_path', None)
@@ -646,27 +3576,127 @@ class WatermarkerApp(QMainWindow):
                     wim.thumbnail((target_w, 10000), Image.LANCZOS)
                     pix = pil_image_to_qpixmap(wim)
                     pi = DraggablePixmapItem(pix)
-                    pi.setOpacity(self.img_opacity_slider.value() / 100.0)
-                    self._place_item_by_preset(pi, self.img_pos_combo.currentText())
+                    pi.setOpacity(WYSIWYG_HANDLE_OPACITY if wysiwyg else self.img_opacity_slider.value() / 100.0)
+                    self._place_item_by_preset(pi, self.img_pos_combo.currentText(), self.dragged_image_pos)
                     pi.set_rotation(self.img_rotate_slider.value())
                     self.graphics_scene.addItem(pi)
                     self.preview_watermark_item = pi
                     # 连接位置变化信号来跟踪拖拽
-                    pi.positionChanged = lambda pos: setattr(self, 'dragged_image_pos', pos)
+                    pi.positionChanged = lambda pos: self._on_watermark_dragged('dragged_image_pos', pos)
+                    pi.live_drag = wysiwyg
                 except Exception as e:
                     print('加载水印图失败', e)
             else:
                 self.preview_watermark_item = None
 
-    def _place_item_by_preset(self, item, preset_name):
+    def _add_preview_other_layers(self):
+        if not hasattr(self, 'preview_base_image') or len(self.layers) < 2:
+            return
+        others = self._resolve_preview({'layers': [layer for i, layer in enumerate(self.layers)
+                                                   if i != self.current_layer]})
+        self._overlay_level = self._preview_overlay_level()
+        key = (id(self.preview_base_image), settings_hash(others), self._overlay_level)
+        if self._overlay_cache is None or self._overlay_cache[0] != key:
+            self._overlay_cache = (key, self._render_overlay_item(others).pixmap())
+        item = RenderedOverlayItem(self._overlay_cache[1])
+        item.setScale(self.preview_base_image.width / self._overlay_cache[1].width())
+        self.graphics_scene.addItem(item)
+
+    def _preview_overlay_level(self):
+        # 与底图瓦片相同的层级：叠加层分辨率只需跟上当前缩放，不必是原图大小
+        if self._pyramid is None or self.proxy_renderer is not None:
+            return 0
+        view = self.graphics_view
+        return self._pyramid.level_for_scale(view.zoom() * view.devicePixelRatioF())
+
+    def _render_overlay_item(self, s):
+        """用导出引擎把设置 s 渲染到当前层级大小的透明图上，返回按预览底图坐标缩放好的叠加项。
+        自动位置/颜色按同一层级的底图解析，与导出结果一致。"""
+        self._overlay_level = k = self._preview_overlay_level()
+        preview = self.preview_base_image
+        base = self._pyramid.level(k) if k else preview
+        px_scale = base.width / source_size(preview)[0]  # 超大图的预览底图本身已比原图小
+        s = {'layers': [resolve_auto(base, layer, px_scale) for layer in settings_layers(s)]}
+        canvas = Image.new('RGBA', base.size, (0, 0, 0, 0))
+        item = RenderedOverlayItem(pil_image_to_qpixmap(render_watermark(canvas, s, px_scale)))
+        item.setScale(preview.width / base.width)
+        item.setTransformationMode(Qt.SmoothTransformation)
+        return item
+
+    def _on_preview_zoom(self, _zoom):
+        # 缩放跨过金字塔层级时按新分辨率重画引擎渲染的叠加层
+        if self._refitting:
+            return  # update_preview 随后会重建
+        overlays = [it for it in self.graphics_scene.items() if isinstance(it, RenderedOverlayItem)]
+        if overlays and self._preview_overlay_level() != self._overlay_level:
+            self._add_preview_watermark()
+
+    def _resolve_preview(self, s):
+        """用当前预览图解析设置中的文字字段，预览与导出结果一致。"""
+        if not hasattr(self, 'preview_base_image'):
+            return s
+        return resolve_settings(s, self.preview_path, self.preview_base_image, self.manifest_edit.text().strip())
+
+    def _build_base_pixmap(self):
+        """按当前预览模式设置底图：普通模式显示原图，所见即所得模式显示代理图的合成结果。"""
+        im = self.preview_base_image
+        if self.chk_wysiwyg.isChecked():
+            view = self.graphics_view.viewport().size()
+            max_side = max(WYSIWYG_MIN_PROXY_SIDE, int(max(view.width(), view.height()) * self.devicePixelRatioF()))
+            self.proxy_renderer = ProxyRenderer(im, max_side)
+            self.proxy_renderer.render(self._resolve_preview(self._collect_settings()))
+            self._wysiwyg_pixmap = pil_image_to_qpixmap(self.proxy_renderer.composite)
+            self.base_pixmap_item.set_pyramid(None)
+            self.base_pixmap_item.setPixmap(self._wysiwyg_pixmap)
+            # 场景坐标保持预览底图的分辨率，拖拽位置和预设位置的换算与普通模式一致
+            self.base_pixmap_item.setScale(im.width / self.proxy_renderer.composite.width)
+            self.base_pixmap_item.setTransformationMode(Qt.SmoothTransformation)
+        else:
+            self.proxy_renderer = None
+            self._wysiwyg_pixmap = None
+            # 原图不整体转换成 QPixmap，按视口从瓦片金字塔取图；切换模式时复用同一份金字塔
+            if self._pyramid is None or self._pyramid.source is not im:
+                self._pyramid = TilePyramid(im)
+            self.base_pixmap_item.set_pyramid(self._pyramid)
+            self.base_pixmap_item.setScale(1.0)
+
+    def _refresh_wysiwyg(self):
+        # 只把变化区域重新画到底图 pixmap 上
+        renderer = self.proxy_renderer
+        box = renderer.render(self._resolve_preview(self._collect_settings()))
+        if box is None:
+            return
+        painter = QtGui.QPainter(self._wysiwyg_pixmap)
+        painter.setCompositionMode(QtGui.QPainter.CompositionMode_Source)
+        painter.drawImage(box[0], box[1], pil_image_to_qimage(renderer.composite.crop(box)))
+        painter.end()
+        self.base_pixmap_item.setPixmap(self._wysiwyg_pixmap)
+
+    def on_wysiwyg_toggled(self, checked):
+        if not hasattr(self, 'preview_base_image'):
+            return
+        self._build_base_pixmap()
+        self.update_preview()
+
+    def _on_watermark_dragged(self, attr, pos):
+        setattr(self, attr, pos)
+        if self.proxy_renderer is not None:
+            self._refresh_wysiwyg()
+
+    def _place_item_by_preset(self, item, preset_name, dragged_pos=None):
         # 计算在 base_pixmap_item 上的位置
         if not hasattr(self, 'base_pixmap_item'):
             return
-        base_rect = self.base_pixmap_item.boundingRect()
+        if dragged_pos is not None:
+            item.setPos(dragged_pos)
+            return
+        base_rect = self.base_pixmap_item.sceneBoundingRect()
         it_rect = item.boundingRect()
         x = 0
         y = 0
         name = preset_name
+        if name == AUTO_PRESET:
+            name = self._region_stats().best_preset(it_rect.width(), it_rect.height())
         # horizontal
         if name in ('左上', '左中', '左下'):
             x = base_rect.left() + 10
@@ -683,6 +3713,13 @@ class WatermarkerApp(QMainWindow):
             y = base_rect.bottom() - it_rect.height() - 10
         item.setPos(QPointF(x, y))
 
+    def _region_stats(self):
+        # 预览图不变时复用同一份统计，拖动滑块时不必重新分析
+        im = self.preview_base_image
+        if self._region_stats_cache is None or self._region_stats_cache[0] is not im:
+            self._region_stats_cache = (im, RegionStats(im))
+        return self._region_stats_cache[1]
+
     def on_watermark_type_changed(self, idx):
         if self.watermark_type_combo.currentText() == '文本水印':
             self.text_settings_widget.show()
@@ -693,7 +3730,7 @@ class WatermarkerApp(QMainWindow):
         # 重置拖拽位置
         self.dragged_text_pos = None
         self.dragged_image_pos = None
-        self._add_preview_watermark()
+        self.update_preview()
 
     def choose_color(self):
         col = QColorDialog.getColor(self._color, self, '选择字体颜色')
@@ -710,18 +3747,93 @@ class WatermarkerApp(QMainWindow):
 
     def update_preview(self):
         # refresh preview watermark item properties
+        if self._suspend_preview:
+            return
+        self.layer_list.item(self.current_layer).setText(
+            self._layer_label(self.current_layer, self._collect_layer()))
         if not hasattr(self, 'preview_base_image'):
             return
+        # 适应窗口模式下重新适应；用户缩放过则保持当前视图。先确定缩放，叠加层按该缩放的分辨率渲染
+        self._refitting = True
+        try:
+            self.graphics_view.refit()
+        finally:
+            self._refitting = False
         # rebuild to apply text/image changes
         self._add_preview_watermark()
-        # fit view
-        if hasattr(self, 'base_pixmap_item'):
-            self.graphics_view.fitInView(self.base_pixmap_item, Qt.KeepAspectRatio)
+
+    # ---------------- Layers ----------------
+    def _layer_label(self, idx, layer):
+        if layer.get('type', '文本水印') == '文本水印':
+            return f'{idx + 1}. 文本：{layer.get("text", "")}'
+        name = os.path.basename(layer.get('wm_image') or '') or '未选择'
+        return f'{idx + 1}. 图片：{name}'
+
+    def _refresh_layer_list(self):
+        self.layer_list.blockSignals(True)
+        self.layer_list.clear()
+        for i, layer in enumerate(self.layers):
+            if i == self.current_layer:
+                layer = self._collect_layer()
+            self.layer_list.addItem(self._layer_label(i, layer))
+        self.layer_list.setCurrentRow(self.current_layer)
+        self.layer_list.blockSignals(False)
+        self.btn_remove_layer.setEnabled(len(self.layers) > 1)
+
+    def _switch_layer(self, idx):
+        """保存当前图层的编辑结果，把 idx 图层载入界面。"""
+        self.layers[self.current_layer] = self._collect_layer()
+        self.current_layer = idx
+        self._load_layer_into_widgets(self.layers[idx])
+        self._refresh_layer_list()
+        self.update_preview()
+
+    def on_layer_selected(self, row):
+        if 0 <= row < len(self.layers) and row != self.current_layer:
+            self._switch_layer(row)
+
+    def add_layer(self):
+        # 新图层以当前图层为初始值，在其上方追加
+        self.layers[self.current_layer] = self._collect_layer()
+        self.layers.append(dict(self.layers[self.current_layer], drag_pos=None))
+        self._switch_layer(len(self.layers) - 1)
+
+    def remove_layer(self):
+        if len(self.layers) < 2:
+            return
+        del self.layers[self.current_layer]
+        self.current_layer = min(self.current_layer, len(self.layers) - 1)
+        self._load_layer_into_widgets(self.layers[self.current_layer])
+        self._refresh_layer_list()
+        self.update_preview()
+
+    def _load_layer_into_widgets(self, layer):
+        self._suspend_preview = True
+        try:
+            self._apply_settings_to_widgets(layer)
+        finally:
+            self._suspend_preview = False
+        self._restore_drag_pos(layer)
+
+    def _restore_drag_pos(self, layer):
+        # 恢复该图层拖拽后的位置（以预览图宽度归一化保存）
+        self.dragged_text_pos = None
+        self.dragged_image_pos = None
+        drag = layer.get('drag_pos')
+        if drag and hasattr(self, 'preview_base_image'):
+            pw = self.preview_base_image.width
+            pos = QPointF(drag[0] * pw, drag[1] * pw)
+            if layer.get('type', '文本水印') == '文本水印':
+                self.dragged_text_pos = pos
+            else:
+                self.dragged_image_pos = pos
 
     # ---------------- Template ----------------
     def _refresh_template_list(self):
         self.template_list.clear()
-        for name in sorted(self.templates.keys()):
+        if self.template_store is None:
+            return
+        for name in self.template_store.names(self.template_search_edit.text().strip()):
             it = QListWidgetItem(name)
             self.template_list.addItem(it)
 
@@ -730,8 +3842,8 @@ class WatermarkerApp(QMainWindow):
         if not ok or not name.strip():
             return
         tpl = self._collect_settings()
-        self.templates[name] = tpl
-        save_json(TEMPLATES_FILE, self.templates)
+        tpl['export_profile'] = self.export_profile_combo.currentText()
+        self.template_store.save(name, tpl)
         self._refresh_template_list()
         QMessageBox.information(self, '已保存', f'模板 {name} 已保存')
 
@@ -741,10 +3853,12 @@ class WatermarkerApp(QMainWindow):
             QMessageBox.warning(self, '提示', '请先选择一个模板')
             return
         name = it.text()
-        tpl = self.templates.get(name)
+        tpl = self.template_store.get(name)
         if not tpl:
             return
         self._apply_settings(tpl)
+        if tpl.get('export_profile') in EXPORT_PROFILES:
+            self.export_profile_combo.setCurrentText(tpl['export_profile'])
         QMessageBox.information(self, '已加载', f'模板 {name} 已加载')
 
     def delete_template(self):
@@ -753,12 +3867,19 @@ class WatermarkerApp(QMainWindow):
             QMessageBox.warning(self, '提示', '请先选择一个模板')
             return
         name = it.text()
-        if name in self.templates:
-            del self.templates[name]
-            save_json(TEMPLATES_FILE, self.templates)
-            self._refresh_template_list()
+        self.template_store.delete(name)
+        self._refresh_template_list()
 
     def _collect_settings(self):
+        """当前图层的设置，外加完整的图层列表（layers）与当前图层序号。"""
+        layer = self._collect_layer()
+        self.layers[self.current_layer] = layer
+        s = {k: v for k, v in layer.items() if k != 'drag_pos'}
+        s['layers'] = [dict(l) for l in self.layers]
+        s['current_layer'] = self.current_layer
+        return s
+
+    def _collect_layer(self):
         s = {
             'type': self.watermark_type_combo.currentText(),
             'text': self.text_edit.text(),
@@ -770,18 +3891,38 @@ class WatermarkerApp(QMainWindow):
             'opacity': self.opacity_slider.value(),
             'shadow': self.chk_shadow.isChecked(),
             'stroke': self.chk_stroke.isChecked(),
+            'auto_color': self.chk_auto_color.isChecked(),
             'rotate': self.rotate_slider.value(),
             'pos': self.pos_combo.currentText(),
+            'tile_gap': self.tile_gap_spin.value(),
+            'tile_stagger': self.chk_tile_stagger.isChecked(),
             'scale': self.scale_spin.value(),
             'wm_image': getattr(self, 'wm_image_path', ''),
             'img_opacity': self.img_opacity_slider.value(),
             'img_rotate': self.img_rotate_slider.value(),
             'img_scale': self.img_scale_spin.value(),
             'img_pos': self.img_pos_combo.currentText(),
+            'img_tile_gap': self.img_tile_gap_spin.value(),
+            'img_tile_stagger': self.img_chk_tile_stagger.isChecked(),
+            # 还没有预览图时无法换算拖拽位置，沿用图层里已保存的值
+            'drag_pos': (self._drag_pos_normalized() if hasattr(self, 'preview_base_image')
+                         else self.layers[self.current_layer].get('drag_pos')),
         }
         return s
 
     def _apply_settings(self, s: dict):
+        # 旧版模板没有 layers，整个设置即唯一的图层
+        layers = [dict(l) for l in s.get('layers') or []]
+        if not layers:
+            layers = [{k: v for k, v in s.items() if k not in ('layers', 'current_layer')}]
+        self.layers = layers
+        self.current_layer = max(0, min(s.get('current_layer', 0), len(layers) - 1))
+        # 逐个控件赋值时暂停预览重建，最后统一刷新一次
+        self._load_layer_into_widgets(layers[self.current_layer])
+        self._refresh_layer_list()
+        self.update_preview()
+
+    def _apply_settings_to_widgets(self, s: dict):
         try:
             self.watermark_type_combo.setCurrentText(s.get('type', '文本水印'))
         except Exception:
@@ -800,321 +3941,199 @@ class WatermarkerApp(QMainWindow):
         self.opacity_slider.setValue(s.get('opacity', 80))
         self.chk_shadow.setChecked(s.get('shadow', False))
         self.chk_stroke.setChecked(s.get('stroke', False))
+        self.chk_auto_color.setChecked(s.get('auto_color', False))
         self.rotate_slider.setValue(s.get('rotate', 0))
         self.pos_combo.setCurrentText(s.get('pos', '居中'))
+        self.tile_gap_spin.setValue(s.get('tile_gap', 50))
+        self.chk_tile_stagger.setChecked(s.get('tile_stagger', True))
         self.scale_spin.setValue(s.get('scale', 20))
-        if s.get('wm_image'):
-            self.wm_image_path = s.get('wm_image')
-            self.wm_image_label.setText(os.path.basename(self.wm_image_path))
+        self.wm_image_path = s.get('wm_image') or ''
+        self.wm_image_label.setText(os.path.basename(self.wm_image_path) if self.wm_image_path else '未选择')
         self.img_opacity_slider.setValue(s.get('img_opacity', 80))
         self.img_rotate_slider.setValue(s.get('img_rotate', 0))
         self.img_scale_spin.setValue(s.get('img_scale', 20))
         self.img_pos_combo.setCurrentText(s.get('img_pos', '居中'))
-        self.update_preview()
+        self.img_tile_gap_spin.setValue(s.get('img_tile_gap', 50))
+        self.img_chk_tile_stagger.setChecked(s.get('img_tile_stagger', True))
 
     # ---------------- Export ----------------
-    def export_images(self):
+    def _checked_out_folder(self):
+        """检查待导出图片与输出文件夹，不满足条件时提示并返回 None。"""
         if not self.images:
             QMessageBox.warning(self, '提示', '没有要导出的图片')
-            return
+            return None
         out_folder = self.out_folder_edit.text().strip()
         if not out_folder:
             QMessageBox.warning(self, '提示', '请选择输出文件夹')
-            return
+            return None
         out_folder = os.path.abspath(out_folder)
         prevent = self.chk_prevent_overwrite.isChecked()
         if prevent:
             # check all images not in out_folder
             for p in self.images:
-                if os.path.commonpath([out_folder, os.path.abspath(os.path.dirname(p))]) == out_folder:
+                if os.path.commonpath([out_folder, os.path.abspath(source_dir(p))]) == out_folder:
                     QMessageBox.warning(self, '警告', '禁止导出到原文件夹，请选择其他输出文件夹或取消该选项')
-                    return
+                    return None
+        return out_folder
+
+    def export_images(self):
+        out_folder = self._checked_out_folder()
+        if out_folder is None:
+            return
         # export each image
-        format_choice = self.format_combo.currentText()
-        jpeg_quality = self.jpeg_quality_slider.value()
-        resize_mode = self.size_combo.currentText()
-        size_value = self.size_value.value()
+        opts = self._collect_export_options(out_folder)
+        budget = self.memory_budget_spin.value() * 2 ** 20
+        # 只读文件头做预估，不解码像素
+        plan_all = plan_export(self.images, budget)
 
-        choose_all = QMessageBox.question(self, '导出', '是否导出全部图片？(否 = 只导出当前选中)',
+        choose_all = QMessageBox.question(self, '导出', '是否导出全部图片？(否 = 只导出当前选中)\n\n'
+                                          f'全部：{plan_all.summary()}',
                                           QMessageBox.Yes | QMessageBox.No)
-        targets = []
         if choose_all == QMessageBox.Yes:
-            targets = self.images[:]
+            plan = plan_all
         else:
             if self.current_index is None:
                 QMessageBox.warning(self, '提示', '请先选择一张图片')
                 return
-            targets = [self.images[self.current_index]]
+            plan = plan_export([self.images[self.current_index]], budget)
 
-        total = len(targets)
+        total = len(plan.jobs)
         progress = QtWidgets.QProgressDialog('导出中...', '取消', 0, total, self)
         progress.setWindowModality(Qt.WindowModal)
         progress.show()
 
-        for idx, src in enumerate(targets):
-            progress.setValue(idx)
-            if progress.wasCanceled():
-                break
-            try:
-                im = Image.open(src).convert('RGBA')
-                out_im = self._apply_watermark_to_pil(im)
-                # resize
-                if resize_mode != '不变':
-                    if resize_mode == '按宽度':
-                        w = size_value
-                        h = int(out_im.height * (w / out_im.width))
-                        out_im = out_im.resize((w, h), Image.LANCZOS)
-                    elif resize_mode == '按高度':
-                        h = size_value
-                        w = int(out_im.width * (h / out_im.height))
-                        out_im = out_im.resize((w, h), Image.LANCZOS)
-                    else:  # 百分比
-                        p = size_value
-                        w = int(out_im.width * p / 100.0)
-                        h = int(out_im.height * p / 100.0)
-                        out_im = out_im.resize((w, h), Image.LANCZOS)
-                # naming
-                base_name = os.path.splitext(os.path.basename(src))[0]
-                ext = os.path.splitext(src)[1]
-                rule = self.name_rule_combo.currentText()
-                extra = self.name_extra_edit.text().strip()
-                if rule == '保留原文件名':
-                    name = base_name
-                elif rule == '添加前缀':
-                    name = f'{extra}{base_name}' if extra else f'wm_{base_name}'
-                else:
-                    name = f'{base_name}{extra}' if extra else f'{base_name}_watermarked'
-                # format choice
-                if format_choice == '保持原格式':
-                    out_ext = ext.lower()
-                elif format_choice == 'JPEG':
-                    out_ext = '.jpg'
-                else:
-                    out_ext = '.png'
-                out_path = os.path.join(out_folder, name + out_ext)
-                # prevent overwrite
-                if os.path.exists(out_path):
-                    # add index
-                    i = 1
-                    while os.path.exists(os.path.join(out_folder, f'{name}_{i}{out_ext}')):
-                        i += 1
-                    out_path = os.path.join(out_folder, f'{name}_{i}{out_ext}')
-                # save
-                if out_ext in ('.jpg', '.jpeg'):
-                    # convert to RGB
-                    rgb = out_im.convert('RGB')
-                    rgb.save(out_path, 'JPEG', quality=jpeg_quality)
-                else:
-                    out_im.save(out_path)
-            except Exception as e:
-                print('导出失败', src, e)
+        def on_progress(done, total, elapsed):
+            progress.setValue(done)
+            if done:
+                remaining = elapsed / done * (total - done)
+                progress.setLabelText(f'导出中... {done}/{total}，剩余约 {remaining:.0f} 秒')
             QtWidgets.QApplication.processEvents()
-        progress.setValue(total)
-        QMessageBox.information(self, '完成', '导出操作已完成')
-
-    def _apply_watermark_to_pil(self, base_im: Image.Image) -> Image.Image:
-        base = base_im.convert('RGBA')
-        w, h = base.size
-        overlay = Image.new('RGBA', base.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(overlay)
 
-        if self.watermark_type_combo.currentText() == '文本水印':
-            text = self.text_edit.text() or ''
-            font_family = self.font_combo.currentText()
-            # 直接根据用户的字号（font_size_spin）作为像素大小（不再使用“占比”）
-            requested_size = max(6, int(self.font_size_spin.value()))
-
-            # 获取粗体和斜体设置
-            is_bold = self.chk_bold.isChecked()
-            is_italic = self.chk_italic.isChecked()
-            
-            # 尝试找到系统字体文件（支持中文）
-            font_path = find_system_font_path(font_family)
-            pil_font = None
-            if font_path:
-                try:
-                    # 应用粗体和斜体设置
-                    if hasattr(ImageFont, 'TRUETYPE'):
-                        # 较新版本的PIL支持直接设置font_weight和font_style
-                        font_weight = 'bold' if is_bold else 'normal'
-                        font_style = 'italic' if is_italic else 'normal'
-                        pil_font = ImageFont.truetype(
-                            font_path, 
-                            requested_size, 
-                            font_weight=font_weight, 
-                            font_style=font_style
-                        )
-                    else:
-                        # 旧版本PIL的兼容处理
-                        pil_font = ImageFont.truetype(font_path, requested_size)
-                except Exception:
-                    pil_font = None
-
-            # 如果没找到或加载失败，尝试常见中文备选（再试一次）
-            if pil_font is None:
-                fallback_list = [
-                    find_system_font_path('Microsoft YaHei'),
-                    find_system_font_path('SimHei'),
-                    find_system_font_path('SimSun'),
-                    find_system_font_path('NotoSansCJK'),
-                ]
-                for fp in filter(None, fallback_list):
-                    try:
-                        # 应用粗体和斜体设置
-                        if hasattr(ImageFont, 'TRUETYPE'):
-                            font_weight = 'bold' if is_bold else 'normal'
-                            font_style = 'italic' if is_italic else 'normal'
-                            pil_font = ImageFont.truetype(
-                                fp, 
-                                requested_size, 
-                                font_weight=font_weight, 
-                                font_style=font_style
-                            )
-                        else:
-                            pil_font = ImageFont.truetype(fp, requested_size)
-                        break
-                    except Exception:
-                        pil_font = None
+        pipeline = ExportPipeline(self._collect_settings(), opts, plan.workers, plan.memory_budget)
+        _, failures = pipeline.run(plan, on_progress=on_progress, should_cancel=progress.wasCanceled)
+        progress.setValue(total)
+        print(pipeline.stats_text())
+        if pipeline.report:
+            # 运行报告：每个输出的大小与实际使用的质量
+            try:
+                write_report(unique_path(os.path.join(out_folder, EXPORT_REPORT_NAME)), pipeline.report)
+            except OSError as e:
+                print('写入导出报告失败', e)
+        if failures:
+            QMessageBox.warning(self, '完成', f'导出操作已完成，{len(failures)} 张失败\n\n{pipeline.stats_text()}')
+        else:
+            QMessageBox.information(self, '完成', f'导出操作已完成\n\n{pipeline.stats_text()}')
 
-            # 最后退回到 PIL 默认（会导致中文缺失），但我们尽量避免到这步
-            if pil_font is None:
-                pil_font = ImageFont.load_default()
+    def distribute_export(self):
+        """协调端：把全部图片拆成共享目录中的任务，交给各机器上的工作进程处理。"""
+        out_folder = self._checked_out_folder()
+        if out_folder is None:
+            return
+        root = QFileDialog.getExistingDirectory(self, '选择共享任务目录')
+        if not root:
+            return
+        try:
+            job_queue = JobQueue.create(root, [os.path.abspath(p) for p in self.images],
+                                    self._collect_settings(), self._collect_export_options(out_folder))
+        except Exception as e:
+            QMessageBox.warning(self, '错误', f'无法创建任务：{e}')
+            return
+        QMessageBox.information(self, '分布式导出', f'已生成 {len(job_queue.job_ids())} 个任务。\n'
+                                f'在各台机器上运行：python watermark.py --worker "{root}"\n'
+                                f'查看进度：python watermark.py --queue-status "{root}"')
+
+    def _collect_export_options(self, out_folder):
+        return {
+            'out_folder': out_folder,
+            'format': self.format_combo.currentText(),
+            'jpeg_quality': self.jpeg_quality_slider.value(),
+            'target_kb': self.target_kb_spin.value(),
+            'export_profile': self.export_profile_combo.currentText(),
+            'png_level': self.png_level_spin.value(),
+            'png_filter': self.png_filter_combo.currentText(),
+            'resize_mode': self.size_combo.currentText(),
+            'size_value': self.size_value.value(),
+            'name_rule': self.name_rule_combo.currentText(),
+            'name_extra': self.name_extra_edit.text().strip(),
+            'renditions': self._collect_renditions(),
+            'manifest': self.manifest_edit.text().strip(),
+            'zip_output': (unique_path(os.path.join(out_folder, EXPORT_ZIP_NAME))
+                           if self.chk_zip_output.isChecked() else ''),
+        }
 
-            # 对于PIL不支持直接设置粗体斜体的情况，我们可以尝试寻找特定的粗体斜体字体文件
-            if pil_font and (is_bold or is_italic):
-                try:
-                    # 尝试寻找粗体版本的字体
-                    if is_bold:
-                        bold_variants = [f'{font_family} Bold', f'{font_family}Bold']
-                        for variant in bold_variants:
-                            bold_path = find_system_font_path(variant)
-                            if bold_path:
-                                pil_font = ImageFont.truetype(bold_path, requested_size)
-                                break
-                    # 尝试寻找斜体版本的字体
-                    if is_italic and pil_font:
-                        italic_variants = [f'{font_family} Italic', f'{font_family}Italic']
-                        for variant in italic_variants:
-                            italic_path = find_system_font_path(variant)
-                            if italic_path:
-                                pil_font = ImageFont.truetype(italic_path, requested_size)
-                                break
-                except Exception:
-                    # 如果找不到特定变体，保持原有字体
-                    pass
+    def _apply_export_profile(self, name):
+        # 切换配置时带出该配置的 PNG 压缩设置，之后仍可单独调整
+        profile = EXPORT_PROFILES.get(name)
+        if profile:
+            self.png_level_spin.setValue(profile['png_level'])
+            self.png_filter_combo.setCurrentText(profile['png_filter'])
 
-            # measure text using the chosen font
-            try:
-                left, top, right, bottom = pil_font.getbbox(text)
-                tw, th = right - left, bottom - top
-            except Exception:
-                # fallback measure
-                tw, th = draw.textsize(text, font=pil_font)
-
-            # color + alpha
-            r, g, b, a = (self._color.red(), self._color.green(), self._color.blue(), 255)
-            alpha = int(255 * (self.opacity_slider.value() / 100.0))
-            fill = (r, g, b, alpha)
-
-            # draw shadow/outline
-            # 检查是否有拖拽后的位置，如果有则使用，否则使用预设位置
-            if hasattr(self, 'dragged_text_pos') and self.dragged_text_pos is not None:
-                # 将场景坐标转换为实际图像坐标
-                scene_x = self.dragged_text_pos.x()
-                scene_y = self.dragged_text_pos.y()
-                # 计算相对于实际图像的比例
-                scale_factor = w / self.preview_base_image.width
-                x = int(scene_x * scale_factor)
-                y = int(scene_y * scale_factor)
-            else:
-                x, y = self._calc_position_for_pil(w, h, tw, th, self.pos_combo.currentText())
-            
-            if self.chk_shadow.isChecked():
-                # draw shadow
-                shadow_color = (0, 0, 0, int(alpha * 0.6))
-                draw.text((x + 2, y + 2), text, font=pil_font, fill=shadow_color)
-            if self.chk_stroke.isChecked():
-                stroke_color = (0, 0, 0, alpha)
-                offsets = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-                for ox, oy in offsets:
-                    draw.text((x + ox, y + oy), text, font=pil_font, fill=stroke_color)
-            draw.text((x, y), text, font=pil_font, fill=fill)
-            # rotation
-            rot = self.rotate_slider.value()
-            if rot != 0:
-                # 反转旋转角度的符号以匹配Qt的顺时针旋转方向
-                overlay = overlay.rotate(-rot, expand=1)
-                # composite onto base with centering
-                base = Image.alpha_composite(base, Image.new('RGBA', base.size, (255, 255, 255, 0)))
-                temp = Image.new('RGBA', base.size, (255, 255, 255, 0))
-                tx = int((base.size[0] - overlay.size[0]) / 2)
-                ty = int((base.size[1] - overlay.size[1]) / 2)
-                temp.paste(overlay, (tx, ty), overlay)
-                out = Image.alpha_composite(base, temp)
-                return out
-            else:
-                out = Image.alpha_composite(base, overlay)
-                return out
+    def choose_manifest(self):
+        path, _ = QFileDialog.getOpenFileName(self, '选择清单 CSV', '', 'CSV (*.csv)')
+        if path:
+            self.manifest_edit.setText(path)
+            self.update_preview()
 
+    def _add_rendition_row(self, r=None):
+        r = r or {}
+        row = self.rendition_table.rowCount()
+        self.rendition_table.insertRow(row)
+        mode = QComboBox()
+        mode.addItems(RESIZE_MODES)
+        mode.setCurrentText(r.get('resize_mode', '按长边'))
+        value = QSpinBox()
+        value.setRange(1, 10000)
+        value.setValue(r.get('size_value', 2048))
+        fmt = QComboBox()
+        fmt.addItems(FORMATS)
+        fmt.setCurrentText(r.get('format', 'JPEG'))
+        quality = QSpinBox()
+        quality.setRange(1, 100)
+        quality.setValue(r.get('quality', 90))
+        self.rendition_table.setCellWidget(row, 0, mode)
+        self.rendition_table.setCellWidget(row, 1, value)
+        self.rendition_table.setCellWidget(row, 2, fmt)
+        max_kb = QSpinBox()
+        max_kb.setRange(0, 1000000)
+        max_kb.setSpecialValueText('不限')
+        max_kb.setValue(r.get('max_kb', 0))
+        self.rendition_table.setCellWidget(row, 3, quality)
+        self.rendition_table.setCellWidget(row, 4, max_kb)
+        self.rendition_table.setItem(row, 5, QtWidgets.QTableWidgetItem(r.get('suffix', '')))
+        self.rendition_table.setItem(row, 6, QtWidgets.QTableWidgetItem(r.get('subfolder', '')))
+
+    def _remove_rendition_row(self):
+        row = self.rendition_table.currentRow()
+        if row < 0:
+            row = self.rendition_table.rowCount() - 1
+        if row >= 0:
+            self.rendition_table.removeRow(row)
+
+    def _collect_renditions(self):
+        t = self.rendition_table
+        renditions = []
+        for row in range(t.rowCount()):
+            renditions.append({
+                'resize_mode': t.cellWidget(row, 0).currentText(),
+                'size_value': t.cellWidget(row, 1).value(),
+                'format': t.cellWidget(row, 2).currentText(),
+                'quality': t.cellWidget(row, 3).value(),
+                'max_kb': t.cellWidget(row, 4).value(),
+                'suffix': t.item(row, 5).text().strip() if t.item(row, 5) else '',
+                'subfolder': t.item(row, 6).text().strip() if t.item(row, 6) else '',
+            })
+        return renditions
+
+    def _drag_pos_normalized(self):
+        """把预览中拖拽后的场景坐标换算为以预览图宽度归一化的位置，未拖拽时返回 None。"""
+        if self.watermark_type_combo.currentText() == '文本水印':
+            pos = getattr(self, 'dragged_text_pos', None)
         else:
-            # 图片水印
-            wm_path = getattr(self, 'wm_image_path', None)
-            if not wm_path or not os.path.exists(wm_path):
-                return base
-            try:
-                wim = Image.open(wm_path).convert('RGBA')
-                # scale to width percent
-                target_w = max(1, int(w * (self.img_scale_spin.value() / 100.0)))
-                ratio = target_w / wim.width
-                new_size = (max(1, int(wim.width * ratio)), max(1, int(wim.height * ratio)))
-                wim = wim.resize(new_size, Image.LANCZOS)
-                # apply opacity
-                alpha = int(255 * (self.img_opacity_slider.value() / 100.0))
-                if alpha < 255:
-                    a = wim.split()[3]
-                    a = ImageEnhance.Brightness(a).enhance(alpha / 255.0)
-                    wim.putalpha(a)
-                # rotation
-                rot = self.img_rotate_slider.value()
-                if rot != 0:
-                    # 反转旋转角度的符号以匹配Qt的顺时针旋转方向
-                    wim = wim.rotate(-rot, expand=1)
-                # position
-                tw, th = wim.size
-                # 检查是否有拖拽后的位置，如果有则使用，否则使用预设位置
-                if hasattr(self, 'dragged_image_pos') and self.dragged_image_pos is not None:
-                    # 将场景坐标转换为实际图像坐标
-                    scene_x = self.dragged_image_pos.x()
-                    scene_y = self.dragged_image_pos.y()
-                    # 计算相对于实际图像的比例
-                    scale_factor = w / self.preview_base_image.width
-                    x = int(scene_x * scale_factor)
-                    y = int(scene_y * scale_factor)
-                else:
-                    x, y = self._calc_position_for_pil(w, h, tw, th, self.img_pos_combo.currentText())
-                overlay.paste(wim, (int(x), int(y)), wim)
-                out = Image.alpha_composite(base, overlay)
-                return out
-            except Exception as e:
-                print('图片水印应用失败', e)
-                return base
-
-    def _calc_position_for_pil(self, base_w, base_h, tw, th, preset):
-        # 根据九宫格预设计算绘制坐标
-        pad = 10
-        if preset in ('左上', '左中', '左下'):
-            x = pad
-        elif preset in ('上中', '居中', '下中'):
-            x = (base_w - tw) / 2
-        else:
-            x = base_w - tw - pad
-        if preset in ('左上', '上中', '右上'):
-            y = pad
-        elif preset in ('左中', '居中', '右中'):
-            y = (base_h - th) / 2
-        else:
-            y = base_h - th - pad
-        return int(x), int(y)
+            pos = getattr(self, 'dragged_image_pos', None)
+        if pos is None or not hasattr(self, 'preview_base_image'):
+            return None
+        pw = self.preview_base_image.width
+        return pos.x() / pw, pos.y() / pw
 
     # ---------------- Last settings persistence ----------------
     def _load_last_settings(self):
@@ -1126,6 +4145,15 @@ class WatermarkerApp(QMainWindow):
                 # naming
                 self.name_rule_combo.setCurrentText(self.last_settings.get('name_rule', '保留原文件名'))
                 self.name_extra_edit.setText(self.last_settings.get('name_extra', ''))
+                self.memory_budget_spin.setValue(self.last_settings.get('memory_budget_mb', DEFAULT_MEMORY_BUDGET_MB))
+                for r in self.last_settings.get('renditions', []):
+                    self._add_rendition_row(r)
+                self.manifest_edit.setText(self.last_settings.get('manifest', ''))
+                self.chk_zip_output.setChecked(self.last_settings.get('zip_output', False))
+                self.target_kb_spin.setValue(self.last_settings.get('target_kb', 0))
+                self.export_profile_combo.setCurrentText(self.last_settings.get('export_profile', DEFAULT_EXPORT_PROFILE))
+                self.png_level_spin.setValue(self.last_settings.get('png_level', PNG_DEFAULT_LEVEL))
+                self.png_filter_combo.setCurrentText(self.last_settings.get('png_filter', PNG_DEFAULT_FILTER))
             except Exception:
                 pass
 
@@ -1137,17 +4165,47 @@ class WatermarkerApp(QMainWindow):
             'prevent_overwrite': self.chk_prevent_overwrite.isChecked(),
             'name_rule': self.name_rule_combo.currentText(),
             'name_extra': self.name_extra_edit.text(),
+            'memory_budget_mb': self.memory_budget_spin.value(),
+            'renditions': self._collect_renditions(),
+            'manifest': self.manifest_edit.text(),
+            'zip_output': self.chk_zip_output.isChecked(),
+            'target_kb': self.target_kb_spin.value(),
+            'export_profile': self.export_profile_combo.currentText(),
+            'png_level': self.png_level_spin.value(),
+            'png_filter': self.png_filter_combo.currentText(),
         }
         save_json(LAST_SETTINGS_FILE, s)
+        if self.template_store is not None:
+            self.template_store.close()
+        if self.thumb_cache is not None:
+            self.thumb_cache.close()
         event.accept()
 
 
 # --------------------------- Run ---------------------------
 
 def main():
+    # 命令行模式：分布式导出的工作进程与进度查询，不创建界面
+    for flag in ('--worker', '--queue-status'):
+        if flag not in sys.argv:
+            continue
+        i = sys.argv.index(flag)
+        if i + 1 >= len(sys.argv):
+            sys.exit(f'用法：python watermark.py {flag} 共享任务目录')
+        root = sys.argv[i + 1]
+        if not os.path.isfile(os.path.join(root, 'queue.json')):
+            sys.exit(f'不是分布式导出的任务目录（缺少 queue.json）：{root}')
+        if flag == '--worker':
+            sys.exit(run_worker(root))
+        print(JobQueue(root).summary_text())
+        sys.exit(0)
+    STARTUP_TIMER.enabled = '--startup-timing' in sys.argv or os.environ.get('WATERMARK_STARTUP_TIMING') == '1'
+    STARTUP_TIMER.mark('导入模块')
     app = QApplication(sys.argv)
+    STARTUP_TIMER.mark('创建 QApplication')
     win = WatermarkerApp()
     win.show()
+    STARTUP_TIMER.mark('显示窗口')
     sys.exit(app.exec_())
 
 